@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from application.sqlite import maintenance
+from chats import sharding
+
+
+class Command(BaseCommand):
+    help = 'Incrementally vacuum and ANALYZE the SQLite database without blocking readers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append',
+                            help='Only maintain this database; may be repeated (all shards).')
+        parser.add_argument('--step', type=int, default=None,
+                            help="Pages freed per transaction (SQLITE['MAINTENANCE']['VACUUM_STEP']).")
+        parser.add_argument('--pause', type=float, default=None,
+                            help='Seconds to sleep between steps.')
+        parser.add_argument('--analysis-limit', type=int, default=None)
+        parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                            help='Convert the database with a full VACUUM first; blocks writers.')
+
+    def handle(self, *args, **options):
+        for alias in options['database'] or sharding.get_shards():
+            self.maintain(alias, options)
+
+    def maintain(self, alias, options):
+        if options['enable_incremental_vacuum']:
+            maintenance.enable_incremental_vacuum(alias)
+            self.stdout.write(f'{alias}: converted to auto_vacuum=INCREMENTAL.')
+        stats = maintenance.run(
+            using=alias,
+            step=options['step'],
+            pause=options['pause'],
+            analysis_limit=options['analysis_limit'])
+        if not stats['incremental']:
+            self.stdout.write(self.style.WARNING(
+                f'{alias}: auto_vacuum is not INCREMENTAL, so no pages were freed; '
+                'run once with --enable-incremental-vacuum.'))
+        self.stdout.write(self.style.SUCCESS(
+            f"{alias}: done, {stats['freed_pages']} pages freed, "
+            f"{stats['free_pages']} left, statistics updated."))
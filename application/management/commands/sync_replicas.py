@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from application import replicas
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database over its read replicas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', dest='databases',
+                            help="Replica alias to refresh (all of REPLICAS['DATABASES']).")
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep copying every this many seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            aliases = replicas.sync_replicas(options['databases'])
+            self.stdout.write(
+                f'Copied to {", ".join(aliases) or "no replicas"} '
+                f'in {time.monotonic() - started:.2f} s')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
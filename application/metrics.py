@@ -0,0 +1,410 @@
+import atexit
+import bisect
+import contextvars
+import fcntl
+import glob
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+from .paths import private_directory
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+ARCHIVE = 'archive.json'
+
+logger = logging.getLogger(__name__)
+
+current = contextvars.ContextVar('metrics', default=None)
+
+
+def get_setting(name, default):
+    return getattr(settings, 'METRICS', {}).get(name, default)
+
+
+class Timings:
+    """
+    Where the time of one request went; queries are counted by the
+    execute wrapper of every connection while it is current.
+    """
+    __slots__ = ('queries', 'db_time', 'view_start', 'view_end')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.view_start = None
+        self.view_end = None
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.db_time += time.perf_counter() - start
+
+
+def instrument(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(instrument, dispatch_uid='application.metrics.instrument')
+
+
+def empty():
+    return {'requests': {}, 'durations': {}, 'work': {}}
+
+
+def merge(into, data):
+    for (route, method, status), count in data['requests']:
+        key = (route, method, status)
+        into['requests'][key] = into['requests'].get(key, 0) + count
+    for route, method, counts in data['durations']:
+        known = into['durations'].get((route, method))
+        if known is None or len(known) != len(counts):
+            into['durations'][(route, method)] = list(counts)
+        else:
+            for index, value in enumerate(counts):
+                known[index] += value
+    for route, method, work in data['work']:
+        known = into['work'].setdefault((route, method), [0] * len(work))
+        for index, value in enumerate(work):
+            known[index] += value
+    return into
+
+
+def dump(data):
+    return {
+        'requests': [[list(key), count] for key, count in data['requests'].items()],
+        'durations': [[*key, counts] for key, counts in data['durations'].items()],
+        'work': [[*key, work] for key, work in data['work'].items()],
+    }
+
+
+class MetricsStore:
+    """
+    Request metrics of all workers on a host, through a directory holding
+    one JSON snapshot per process.
+
+    Each process counts in memory and rewrites its own snapshot at most
+    every `flush_interval` seconds, so a request costs a dict update. A
+    scrape sums the snapshots, folding those of exited processes into one
+    archive file so their counts are kept without the files piling up.
+    """
+
+    def __init__(self, path, buckets, flush_interval=1.0):
+        self.path = path
+        self.buckets = sorted(buckets)
+        self.flush_interval = flush_interval
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        self.lock = threading.Lock()
+        self.pid = None
+        self.reset()
+        atexit.register(self.flush)
+
+    def reset(self):
+        # Also after a fork, so the parent's counts are not reported twice.
+        self.pid = os.getpid()
+        self.name = os.path.join(self.path, f'{self.pid}-{uuid.uuid4().hex[:8]}.json')
+        self.data = empty()
+        self.dirty = False
+        self.next_flush = time.monotonic() + self.flush_interval
+
+    def observe(self, route, method, status, duration, timings, render_time):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            data = self.data
+            key = (route, method, status)
+            data['requests'][key] = data['requests'].get(key, 0) + 1
+            key = (route, method)
+            counts = data['durations'].get(key)
+            if counts is None:
+                # Per bucket then +Inf, and the sum of all durations.
+                counts = data['durations'][key] = [0] * (len(self.buckets) + 2)
+            counts[bisect.bisect_left(self.buckets, duration)] += 1
+            counts[-1] += duration
+            work = data['work'].get(key)
+            if work is None:
+                # Queries, then seconds in the database, in the view outside
+                # it and rendering.
+                work = data['work'][key] = [0, 0.0, 0.0, 0.0]
+            work[0] += timings.queries
+            work[1] += timings.db_time
+            if timings.view_start is not None:
+                work[2] += max(timings.view_end - timings.view_start - timings.db_time, 0.0)
+            work[3] += render_time
+            self.dirty = True
+            flush = time.monotonic() >= self.next_flush
+        if flush:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty or self.pid != os.getpid():
+                return
+            self.next_flush = time.monotonic() + self.flush_interval
+            temp = f'{self.name}.tmp'
+            try:
+                with open(temp, 'w') as file:
+                    json.dump(dump(self.data), file)
+                os.replace(temp, self.name)
+            except OSError:
+                # Never fail the request; the counts are written next time.
+                logger.warning('Could not write metrics to %s', self.name, exc_info=True)
+                return
+            self.dirty = False
+
+    @contextmanager
+    def file_lock(self):
+        fd = os.open(os.path.join(self.path, '.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def read(self, name):
+        try:
+            with open(name) as file:
+                raw = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        return {
+            'requests': [(tuple(key), count) for key, count in raw['requests']],
+            'durations': [(route, method, counts) for route, method, counts in raw['durations']],
+            'work': [(route, method, work) for route, method, work in raw['work']],
+        }
+
+    def collect(self):
+        """
+        The metrics of every process, merged.
+        """
+        self.flush()
+        archive_name = os.path.join(self.path, ARCHIVE)
+        with self.file_lock():
+            archived = self.read(archive_name)
+            archived = merge(empty(), archived) if archived else empty()
+            running, exited = [], []
+            for name in glob.glob(os.path.join(self.path, '*-*.json')):
+                data = self.read(name)
+                if data is None:
+                    continue
+                if is_alive(int(os.path.basename(name).split('-')[0])):
+                    running.append(data)
+                else:
+                    merge(archived, data)
+                    exited.append(name)
+            if exited:
+                temp = f'{archive_name}.tmp'
+                with open(temp, 'w') as file:
+                    json.dump(dump(archived), file)
+                os.replace(temp, archive_name)
+                for name in exited:
+                    os.remove(name)
+            for data in running:
+                merge(archived, data)
+        return archived
+
+    def render(self):
+        return render(self.collect(), self.buckets)
+
+
+def is_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def labels(**values):
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in values.items()) + '}'
+
+
+def number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(data, buckets):
+    """
+    `data` in the Prometheus text exposition format.
+    """
+    lines = [
+        '# HELP http_requests_total Requests by route, method and status.',
+        '# TYPE http_requests_total counter',
+    ]
+    for (route, method, status), count in sorted(data['requests'].items()):
+        lines.append(
+            f'http_requests_total{labels(route=route, method=method, status=status)} {count}')
+
+    lines += [
+        '# HELP http_request_duration_seconds Time to respond, middleware included.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    bounds = [number(float(bound)) for bound in buckets] + ['+Inf']
+    for (route, method), counts in sorted(data['durations'].items()):
+        if len(counts) != len(bounds) + 1:
+            # Written with other buckets, before a settings change.
+            continue
+        cumulative = 0
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            lines.append(
+                'http_request_duration_seconds_bucket'
+                f'{labels(route=route, method=method, le=bound)} {cumulative}')
+        lines.append(
+            f'http_request_duration_seconds_sum{labels(route=route, method=method)} '
+            f'{number(float(counts[-1]))}')
+        lines.append(
+            f'http_request_duration_seconds_count{labels(route=route, method=method)} '
+            f'{cumulative}')
+
+    for index, (name, help_text) in enumerate([
+        ('http_request_db_queries_total', 'Database queries run by requests.'),
+        ('http_request_db_seconds_total', 'Time spent in database queries.'),
+        ('http_request_view_seconds_total',
+         'Time spent in views outside the database, serializers included.'),
+        ('http_request_render_seconds_total', 'Time spent rendering responses.'),
+    ]):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (route, method), work in sorted(data['work'].items()):
+            value = work[index] if index == 0 else number(float(work[index]))
+            lines.append(f'{name}{labels(route=route, method=method)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                path = get_setting('PATH', None) or private_directory('pythontests-metrics')
+                _store = MetricsStore(
+                    path,
+                    buckets=get_setting('BUCKETS', (
+                        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+                    flush_interval=get_setting('FLUSH_INTERVAL', 1.0))
+    return _store
+
+
+def get_route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.route or match.view_name
+
+
+class MetricsMiddleware:
+    """
+    Records every request in the metrics store, labelled with its URL name
+    (`message-list`, `chat-add-members`, `login`, ...). Goes first, so the
+    time of the other middleware counts too. Runs in async mode under ASGI,
+    so long-polls and streams do not hold a thread while they wait.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not get_setting('ENABLED', True):
+            return self.get_response(request)
+        timings, start = self.start()
+        token = current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, timings, start)
+        return response
+
+    async def __acall__(self, request):
+        if not get_setting('ENABLED', True):
+            return await self.get_response(request)
+        timings, start = self.start()
+        token = current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, timings, start)
+        return response
+
+    def start(self):
+        # Connections opened before this module was imported.
+        for connection in connections.all(initialized_only=True):
+            instrument(connection)
+        return Timings(), time.perf_counter()
+
+    def finish(self, request, response, timings, start):
+        end = time.perf_counter()
+        render_time = 0.0
+        if timings.view_start is not None:
+            if timings.view_end is None:
+                timings.view_end = end
+            else:
+                # DRF responses are rendered once the view returned, after
+                # process_template_response.
+                render_time = end - timings.view_end
+        get_store().observe(
+            get_route(request), request.method, response.status_code,
+            end - start, timings, render_time)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current.get()
+        if timings is not None:
+            timings.view_start = time.perf_counter()
+        return None
+
+    def process_template_response(self, request, response):
+        timings = current.get()
+        if timings is not None:
+            timings.view_end = time.perf_counter()
+        return response
+
+
+def metrics_view(request):
+    """
+    GET /metrics: the metrics of every worker on this host, for Prometheus.
+    Requires `Authorization: Bearer <METRICS['TOKEN']>` when a token is set.
+    """
+    token = get_setting('TOKEN', None)
+    if token and not hmac.compare_digest(
+            request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return HttpResponse(status=403)
+    return HttpResponse(get_store().render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,21 @@
+import os
+import stat
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+def private_directory(name):
+    """
+    `<name>-<uid>` under the temporary directory, for files the workers of
+    this user share on the host. Its name can be guessed, so it is refused
+    unless the user owns it and nobody else can read or write it.
+    """
+    path = os.path.join(tempfile.gettempdir(), f'{name}-{os.getuid()}')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid()
+            or info.st_mode & 0o077):
+        raise ImproperlyConfigured(
+            f'{path} is not a private directory of this user; configure another path.')
+    return path
@@ -0,0 +1,134 @@
+import contextvars
+import os
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+replica = contextvars.ContextVar('replica', default=None)
+
+
+def get_setting(name, default):
+    return getattr(settings, 'REPLICAS', {}).get(name, default)
+
+
+def get_cache():
+    return caches[get_setting('CACHE', 'default')]
+
+
+def pin(user_id):
+    """
+    Keep `user_id` on the primary for REPLICAS['STICKY_SECONDS'], long
+    enough for the replicas to catch up with what they just wrote.
+    """
+    seconds = get_setting('STICKY_SECONDS', 5)
+    if seconds > 0:
+        get_cache().set(f'replicas:pin:{user_id}', time.time() + seconds, seconds)
+
+
+def is_pinned(user_id):
+    until = get_cache().get(f'replicas:pin:{user_id}')
+    return until is not None and until > time.time()
+
+
+def choose_replica():
+    aliases = get_setting('DATABASES', [])
+    return random.choice(aliases) if aliases else None
+
+
+@contextmanager
+def use_replica(alias=None):
+    """
+    Route reads in the block to `alias`, or to a random replica.
+    """
+    token = replica.set(alias or choose_replica())
+    try:
+        yield replica.get()
+    finally:
+        replica.reset(token)
+
+
+def copy_database(source, target, pages=1024):
+    """
+    Snapshot the SQLite connection `source` into the file `target`. The
+    copy is written next to `target` and renamed over it, so readers never
+    see a partial file; connections opened before the rename keep the
+    previous snapshot.
+    """
+    temporary = f'{target}.sync'
+    destination = sqlite3.connect(temporary)
+    try:
+        source.backup(destination, pages=pages)
+        # Replicas are never written, and a WAL left over from the previous
+        # snapshot must not be replayed onto this one.
+        destination.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        destination.close()
+    os.replace(temporary, target)
+
+
+def sync_replicas(aliases=None):
+    """
+    Copy the primary over each replica; return the aliases copied.
+    """
+    aliases = get_setting('DATABASES', []) if aliases is None else aliases
+    primary = connections[DEFAULT_DB_ALIAS]
+    primary.ensure_connection()
+    for alias in aliases:
+        copy_database(primary.connection, connections[alias].settings_dict['NAME'])
+    return aliases
+
+
+class ReplicaRouter:
+    """
+    Reads go to the replica chosen for the current request, if any, and
+    everything else to the primary. Only `default` is migrated; replicas
+    are copies of it.
+    """
+
+    def db_for_read(self, model, **hints):
+        return replica.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadsMixin:
+    """
+    Serve safe-method requests from a replica, except for users who wrote
+    something within the last REPLICAS['STICKY_SECONDS'], so nobody misses
+    their own message.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        # Bound for this request only, and restored also when the view
+        # raised: a thread serves other requests.
+        token = replica.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            replica.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        user = request.user
+        if request.method in SAFE_METHODS and not (
+                user.is_authenticated and is_pinned(user.pk)):
+            replica.set(choose_replica())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        user = getattr(request, '_user', None)
+        if (request.method not in SAFE_METHODS and response.status_code < 400
+                and user is not None and user.is_authenticated):
+            pin(user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -23,6 +23,14 @@ ALLOWED_HOSTS = ['*']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Avatar thumbnails, written under MEDIA_ROOT/avatars/thumbs/ with
+# content-hashed names; serve that directory with far-future cache headers
+AVATAR_THUMBNAILS = {
+    'SIZES': [32, 64, 128, 256],
+    'FORMATS': ['webp', 'jpeg'],
+    'QUALITY': 80,
+}
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -34,12 +42,14 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework_simplejwt',
+    'application',
     'chats',
     'users',
     'tasks',
 ]
 
 MIDDLEWARE = [
+    'application.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -47,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'application.sqlite.middleware.OverloadedMiddleware',
 ]
 
 # Authentication settings
@@ -54,13 +65,66 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
 
+PASSWORD_HASHERS = [
+    'users.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Password hashing cost, and how many hashes may run or wait at once before
+# auth endpoints answer 503
+PASSWORD_HASHING = {
+    'ITERATIONS': int(os.environ.get('PASSWORD_HASH_ITERATIONS', 600000)),
+    'MAX_WORKERS': 2,
+    'MAX_QUEUE': 32,
+}
+
 # Auth
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ],
 }
 
+# Decoded JWTs and their users, cached per process
+AUTH_CACHE = {
+    'MAX_TOKENS': 10000,
+    'MAX_USERS': 10000,
+    'TTL': 60,
+}
+
+# Chat ids of each user, cached per process for membership checks
+MEMBERSHIP_CACHE = {
+    'MAX_USERS': 10000,
+    'TTL': 30,
+}
+
+# Token ids revoked on logout. PATH must be shared by every worker on the
+# host and survive restarts; it defaults to a private directory of the user
+# under /tmp.
+TOKEN_REVOCATION = {
+    'PATH': None,
+    'BLOOM_CAPACITY': 100000,
+    'BLOOM_ERROR_RATE': 0.001,
+}
+
+# Request metrics served at /metrics. Each worker writes its counts to a
+# file under PATH every FLUSH_INTERVAL seconds; PATH must be shared by the
+# workers on the host and defaults to a private directory of the user under
+# /tmp. With TOKEN set, scrapes need an "Authorization: Bearer <TOKEN>"
+# header. Test runs keep them off (application.test_runner).
+METRICS = {
+    'ENABLED': True,
+    'PATH': os.environ.get('METRICS_PATH'),
+    'FLUSH_INTERVAL': 1.0,
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+TEST_RUNNER = 'application.test_runner.TestRunner'
+
 # Simple JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=14),
@@ -77,6 +141,49 @@ SIMPLE_JWT = {
     'AUTH_COOKIE_NAME': None,
 }
 
+# Realtime delivery over websockets
+# chats.brokers.UnixSocketBroker fans events out between worker processes
+REALTIME = {
+    'BROKER': 'chats.brokers.InProcessBroker',
+    'BROKER_OPTIONS': {},
+    'MAX_PENDING_MESSAGES': 100,
+    'LONG_POLL_TIMEOUT': 25,
+    'SSE_MAX_DURATION': 300,
+    'SSE_HEARTBEAT': 15,
+}
+
+# Messages older than AGE_DAYS move to compressed per-chat segments with
+# `manage.py archive_messages`; history pagination reads through to them.
+MESSAGE_ARCHIVE = {
+    'AGE_DAYS': 365,
+    'SEGMENT_SIZE': 1000,
+    'PAUSE': 0,
+}
+
+# Group commit for POST /api/messages/, enabled with MESSAGE_GROUP_COMMIT=1.
+# Messages created by concurrent requests of a process are written in one
+# transaction, at most BATCH_SIZE at a time, the first waiting up to
+# MAX_WAIT seconds for company. Responses still follow the commit.
+# POST /api/messages/batch/ takes up to BATCH_SEND_MAX messages at once.
+MESSAGE_INGEST = {
+    'GROUP_COMMIT': os.environ.get('MESSAGE_GROUP_COMMIT') == '1',
+    'BATCH_SIZE': 64,
+    'MAX_WAIT': 0.002,
+    'BATCH_SEND_MAX': 500,
+}
+
+# Background jobs (tasks app), run with `manage.py run_worker`. A claimed
+# batch must finish within VISIBILITY_TIMEOUT seconds or it is retried.
+TASKS = {
+    'PROCESSES': 2,
+    'BATCH_SIZE': 10,
+    'POLL_INTERVAL': 1.0,
+    'VISIBILITY_TIMEOUT': 300,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF': 5,
+    'RETRY_BACKOFF_MAX': 3600,
+}
+
 ROOT_URLCONF = 'application.urls'
 
 TEMPLATES = [
@@ -108,6 +215,89 @@ DATABASES = {
     }
 }
 
+# Production SQLite profile, enabled with SQLITE_PRODUCTION=1: WAL and the
+# PRAGMAS below on every connection, persistent connections, and write
+# transactions serialized per process with at most WRITER_QUEUE waiting
+# WRITER_TIMEOUT seconds (503 beyond that). Run `manage.py
+# sqlite_maintenance` from cron for incremental vacuum and ANALYZE of every
+# shard.
+SQLITE = {
+    'PRODUCTION': os.environ.get('SQLITE_PRODUCTION') == '1',
+    'PRAGMAS': {
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    'WRITER_QUEUE': 64,
+    'WRITER_TIMEOUT': 5,
+    'MAINTENANCE': {
+        'VACUUM_STEP': 1000,
+        'PAUSE': 0.05,
+        'ANALYSIS_LIMIT': 1000,
+    },
+}
+
+if SQLITE['PRODUCTION']:
+    DATABASES['default'].update({
+        'ENGINE': 'application.sqlite',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    })
+
+# Read replicas, as comma-separated SQLite paths in DATABASE_REPLICAS. Keep
+# them current with `manage.py sync_replicas --interval N`.
+REPLICA_DATABASES = [
+    path for path in os.environ.get('DATABASE_REPLICAS', '').split(',') if path
+]
+for number, path in enumerate(REPLICA_DATABASES, 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Chat shards, as comma-separated SQLite paths in DATABASE_SHARDS. Each chat
+# lives with its messages and memberships on the shard its id hashes to
+# (chats.sharding); users stay on default, itself the first shard. Move
+# chats between shards with `manage.py move_chats`.
+SHARD_DATABASES = [
+    path for path in os.environ.get('DATABASE_SHARDS', '').split(',') if path
+]
+for number, path in enumerate(SHARD_DATABASES, 1):
+    DATABASES[f'shard{number}'] = {**DATABASES['default'], 'NAME': path}
+
+SHARDING = {
+    'DATABASES': ['default'] + [f'shard{number}' for number in range(1, len(SHARD_DATABASES) + 1)],
+    'PLACEMENT_CACHE_SIZE': 100000,
+    'PLACEMENT_TTL': 5,
+}
+
+DATABASE_ROUTERS = ['chats.sharding.ShardRouter', 'application.replicas.ReplicaRouter']
+
+# Safe-method API requests read from a random replica, unless the user wrote
+# something in the last STICKY_SECONDS. CACHE holds those marks; with
+# replicas it is a file cache in REPLICA_PIN_CACHE (by default next to the
+# first replica), so every worker process on the host sees them.
+REPLICAS = {
+    'DATABASES': [f'replica{number}' for number in range(1, len(REPLICA_DATABASES) + 1)],
+    'STICKY_SECONDS': 5,
+    'CACHE': 'default',
+}
+if REPLICA_DATABASES:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'replicas': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('REPLICA_PIN_CACHE') or os.path.join(
+                os.path.dirname(os.path.abspath(REPLICA_DATABASES[0])), 'replica-pins'),
+        },
+    }
+    REPLICAS['CACHE'] = 'replicas'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
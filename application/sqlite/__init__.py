@@ -0,0 +1,4 @@
+"""
+Production profile for the SQLite backend: use 'application.sqlite' as
+the ENGINE. See SQLITE in settings.
+"""
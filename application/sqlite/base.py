@@ -0,0 +1,138 @@
+import fcntl
+import os
+import threading
+
+from django.conf import settings
+from django.db import OperationalError
+from django.db.backends.sqlite3 import base
+
+
+def get_setting(name, default):
+    return getattr(settings, 'SQLITE', {}).get(name, default)
+
+
+class Overloaded(OperationalError):
+    pass
+
+
+class WriterGate:
+    """
+    Lets one transaction at a time write to the database at `path`, across
+    threads with a lock and across processes with flock() on a file next
+    to it; `path` is None for in-memory databases, which only need the
+    lock. Waiting on flock() wakes as soon as the writer is done, unlike
+    SQLite's busy handler, which sleeps in growing steps.
+
+    Up to `max_queue` more threads per process wait at most `timeout`
+    seconds for their turn; anything beyond that raises Overloaded
+    straight away instead of piling up behind the lock.
+    """
+
+    def __init__(self, path, max_queue, timeout):
+        self.path = path and f'{path}-writer.lock'
+        self.admission = threading.BoundedSemaphore(1 + max_queue)
+        self.writer = threading.Lock()
+        self.timeout = timeout
+        self.file = None
+        self.pid = None
+
+    def lock_file(self):
+        if self.path is None:
+            return
+        # flock() locks are shared by forked children holding the same
+        # open file, so every process opens its own.
+        if self.pid != os.getpid():
+            self.file = open(self.path, 'a')
+            self.pid = os.getpid()
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def acquire(self):
+        if not self.admission.acquire(blocking=False):
+            raise Overloaded('Too many transactions waiting to write.')
+        if not self.writer.acquire(timeout=self.timeout):
+            self.admission.release()
+            raise Overloaded('Timed out waiting to write.')
+        try:
+            self.lock_file()
+        except BaseException:
+            self.writer.release()
+            self.admission.release()
+            raise
+
+    def release(self):
+        if self.path is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.writer.release()
+        self.admission.release()
+
+
+_gates = {}
+_gates_lock = threading.Lock()
+
+
+def get_gate(name, in_memory=False):
+    gate = _gates.get(name)
+    if gate is None:
+        with _gates_lock:
+            gate = _gates.get(name)
+            if gate is None:
+                gate = _gates[name] = WriterGate(
+                    None if in_memory else name, get_setting('WRITER_QUEUE', 64), get_setting('WRITER_TIMEOUT', 5))
+    return gate
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Applies SQLITE['PRAGMAS'] to every new connection, and starts
+    transactions with BEGIN IMMEDIATE behind the process's WriterGate.
+
+    A deferred BEGIN only takes the write lock at its first write, and
+    SQLite fails that upgrade with "database is locked" at once instead
+    of waiting out the busy timeout. Taking the lock up front lets
+    writers queue instead.
+    """
+    writer_gate = None
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        if not self.is_in_memory_db():
+            # Setting auto_vacuum takes the write lock and only has an
+            # effect on a new file; see maintenance.enable_incremental_vacuum.
+            is_new = conn.execute('PRAGMA page_count').fetchone()[0] == 0
+            for name, value in get_setting('PRAGMAS', {}).items():
+                if name != 'auto_vacuum' or is_new:
+                    conn.execute(f'PRAGMA {name}={value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        gate = get_gate(str(self.settings_dict['NAME']), self.is_in_memory_db())
+        gate.acquire()
+        try:
+            self.cursor().execute('BEGIN IMMEDIATE')
+        except BaseException:
+            gate.release()
+            raise
+        self.writer_gate = gate
+
+    def release_writer(self):
+        if self.writer_gate is not None:
+            self.writer_gate.release()
+            self.writer_gate = None
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self.release_writer()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self.release_writer()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self.release_writer()
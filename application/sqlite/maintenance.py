@@ -0,0 +1,55 @@
+import time
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .base import get_setting
+
+
+def pragma(cursor, name):
+    cursor.execute(f'PRAGMA {name}')
+    return cursor.fetchone()[0]
+
+
+def enable_incremental_vacuum(using=DEFAULT_DB_ALIAS):
+    """
+    Switch the database to auto_vacuum=INCREMENTAL. This rewrites the whole
+    file with VACUUM, so it is a one-off for a quiet moment.
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        cursor.execute('VACUUM')
+
+
+def run(using=DEFAULT_DB_ALIAS, step=None, pause=None, analysis_limit=None):
+    """
+    Checkpoint the WAL, return free pages to the filesystem `step` pages
+    per transaction, and refresh the planner statistics.
+
+    Each step is a short write transaction, so in WAL mode readers never
+    wait and writers only wait for one step.
+    """
+    maintenance = get_setting('MAINTENANCE', {})
+    step = step or maintenance.get('VACUUM_STEP', 1000)
+    pause = maintenance.get('PAUSE', 0.05) if pause is None else pause
+    analysis_limit = analysis_limit or maintenance.get('ANALYSIS_LIMIT', 1000)
+    connection = connections[using]
+    stats = {'freed_pages': 0}
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        stats['incremental'] = pragma(cursor, 'auto_vacuum') == 2
+        free = pragma(cursor, 'freelist_count')
+        while stats['incremental'] and free:
+            # Stepped to completion only by executescript.
+            connection.connection.executescript(f'PRAGMA incremental_vacuum({step})')
+            left = pragma(cursor, 'freelist_count')
+            stats['freed_pages'] += free - left
+            if left >= free:
+                break
+            free = left
+            if free and pause:
+                time.sleep(pause)
+        stats['free_pages'] = free
+        cursor.execute(f'PRAGMA analysis_limit={int(analysis_limit)}')
+        cursor.execute('ANALYZE')
+    return stats
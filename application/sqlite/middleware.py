@@ -0,0 +1,18 @@
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from .base import Overloaded
+
+
+class OverloadedMiddleware(MiddlewareMixin):
+    """
+    Answers 503 when the writer queue is full, rather than 500. Works in
+    both modes, so it does not make Django run async views in a thread.
+    """
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, Overloaded):
+            return JsonResponse(
+                {'detail': 'Too many writes, try again shortly.'},
+                status=503, headers={'Retry-After': '1'})
+        return None
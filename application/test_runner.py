@@ -0,0 +1,27 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with request metrics off and revoked tokens in a
+    temporary directory, so nothing is written to the files of a server on
+    the same host. Tests of the metrics turn them on with a temporary PATH.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.directory = tempfile.mkdtemp(prefix='pythontests-')
+        self.test_settings = override_settings(
+            METRICS={**settings.METRICS, 'ENABLED': False},
+            TOKEN_REVOCATION={**settings.TOKEN_REVOCATION, 'PATH': f'{self.directory}/revoked'})
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -1,11 +1,22 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from application.metrics import metrics_view
+from users.thumbnails import THUMBNAIL_DIR, serve_thumbnail
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('users.urls')),
     path('api/', include('chats.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('metrics', metrics_view, name='metrics'),
+]
+
+if settings.DEBUG:
+    # Thumbnail names are content hashes, so they can be cached forever.
+    urlpatterns.append(re_path(
+        rf'^{settings.MEDIA_URL.lstrip("/")}{THUMBNAIL_DIR}/(?P<path>.*)$', serve_thumbnail))
+
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
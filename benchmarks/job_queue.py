@@ -0,0 +1,140 @@
+"""
+Throughput and latency of the tasks job queue on SQLite.
+
+    python -m benchmarks.job_queue --jobs 100000 --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+
+from tasks import queue  # noqa: E402
+from tasks.models import Job  # noqa: E402
+from tasks.worker import run_pool  # noqa: E402
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous=NORMAL')
+
+
+connection_created.connect(configure_sqlite)
+
+
+def noop(i):
+    pass
+
+
+def record_latency(path, enqueued_at):
+    with open(path, 'a') as file:
+        file.write(f'{time.time() - enqueued_at}\n')
+
+
+def rate(count, seconds):
+    return f'{count} jobs in {seconds:.2f} s ({count / seconds:,.0f} jobs/s)'
+
+
+def enqueue_single(jobs):
+    started = time.perf_counter()
+    for i in range(jobs):
+        queue.enqueue(noop, args=[i])
+    return time.perf_counter() - started
+
+
+def enqueue_bulk(jobs):
+    started = time.perf_counter()
+    queue.enqueue_many(((noop, [i]) for i in range(jobs)), batch_size=5000)
+    return time.perf_counter() - started
+
+
+def drain(processes, batch_size):
+    started = time.perf_counter()
+    run_pool(processes, batch_size=batch_size, poll_interval=0.05, burst=True)
+    elapsed = time.perf_counter() - started
+    left = Job.objects.count()
+    if left:
+        print(f'    warning: {left} jobs left in the queue')
+    return elapsed
+
+
+def measure_latency(jobs, per_second, processes, batch_size):
+    directory = tempfile.mkdtemp()
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    pool = context.Process(
+        target=run_pool, args=(processes,),
+        kwargs={'batch_size': batch_size, 'poll_interval': 0.01})
+    pool.start()
+    paths = [os.path.join(directory, f'{i % processes}.txt') for i in range(jobs)]
+    interval = 1 / per_second
+    started = time.perf_counter()
+    for i in range(jobs):
+        queue.enqueue(record_latency, args=[paths[i], time.time()])
+        delay = started + (i + 1) * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    deadline = time.monotonic() + 30
+    while Job.objects.exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    os.kill(pool.pid, signal.SIGTERM)
+    pool.join()
+    latencies = []
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name)) as file:
+            latencies.extend(float(line) * 1000 for line in file)
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--jobs', type=int, default=100000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--latency-jobs', type=int, default=2000)
+    parser.add_argument('--latency-rate', type=int, default=500)
+    args = parser.parse_args()
+
+    database = settings.DATABASES['default']['NAME']
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    call_command('migrate', verbosity=0)
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+    print(f'enqueue, one transaction each: {rate(args.jobs, enqueue_single(args.jobs))}')
+    elapsed = drain(args.processes, args.batch_size)
+    print(f'drain, {args.processes} processes x batch {args.batch_size}: {rate(args.jobs, elapsed)}')
+
+    print(f'enqueue_many: {rate(args.jobs, enqueue_bulk(args.jobs))}')
+    elapsed = drain(args.processes, args.batch_size)
+    print(f'drain, {args.processes} processes x batch {args.batch_size}: {rate(args.jobs, elapsed)}')
+
+    latencies = measure_latency(
+        args.latency_jobs, args.latency_rate, args.processes, args.batch_size)
+    if latencies:
+        print(
+            f'enqueue -> start latency at {args.latency_rate} jobs/s over '
+            f'{len(latencies)} jobs: median {statistics.median(latencies):.1f} ms, '
+            f'p95 {latencies[int(len(latencies) * 0.95)]:.1f} ms, '
+            f'p99 {latencies[int(len(latencies) * 0.99)]:.1f} ms, '
+            f'max {latencies[-1]:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Query plans and latencies for the Message hot paths, with and without the
+indexes in Message.Meta.indexes. Unread messages are found by the members'
+read cursors, through the chat/seq unique constraint.
+
+    python -m benchmarks.message_indexes --messages 2000000
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.db.models import F  # noqa: E402
+
+from chats.models import Message  # noqa: E402
+from chats.pagination import MessageKeysetPagination  # noqa: E402
+
+CHUNK = 50000
+
+
+def seed(messages, chats, users, chats_per_user, unread_ratio):
+    rnd = random.Random(42)
+    user_ids = [uuid.uuid4().hex for _ in range(users)]
+    chat_ids = [uuid.uuid4().hex for _ in range(chats)]
+    now = datetime(2023, 1, 1)
+    members = {}
+    for user_id in user_ids:
+        for chat_id in rnd.sample(chat_ids, chats_per_user):
+            members.setdefault(chat_id, []).append(user_id)
+    last_seqs = dict.fromkeys(chat_ids, 0)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO users_user (id, password, email, first_name, last_name, '
+            'avatar, date_joined, is_active, is_staff, is_superuser) '
+            "VALUES (%s, '!', %s, '', '', '', %s, 1, 0, 0)",
+            [(pk, f'{pk}@bench.local', now) for pk in user_ids]
+        )
+        for start in range(0, messages, CHUNK):
+            rows = []
+            for i in range(start, min(start + CHUNK, messages)):
+                chat_id = rnd.choice(chat_ids)
+                last_seqs[chat_id] += 1
+                rows.append((
+                    uuid.uuid4().hex,
+                    f'message {i}',
+                    now + timedelta(seconds=i),
+                    False,
+                    rnd.choice(members.get(chat_id) or user_ids),
+                    chat_id,
+                    last_seqs[chat_id],
+                ))
+            cursor.executemany(
+                'INSERT INTO chats_message (id, text, created_at, is_read, user_id, chat_id, seq) '
+                'VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                rows
+            )
+        cursor.executemany(
+            'INSERT INTO chats_chat (id, avatar, title, is_private, created_at, '
+            'modified_at, version, last_message_seq) '
+            "VALUES (%s, '', %s, 1, %s, %s, 1, %s)",
+            [(pk, f'chat {i}', now, now, last_seqs[pk]) for i, pk in enumerate(chat_ids)]
+        )
+        # Every member has read all but the newest `unread_ratio` of a chat.
+        rows = []
+        for chat_id, ids in members.items():
+            last_read_seq = int(last_seqs[chat_id] * (1 - unread_ratio))
+            rows += [
+                (chat_id, user_id, last_read_seq, last_seqs[chat_id] - last_read_seq)
+                for user_id in ids
+            ]
+        cursor.executemany(
+            'INSERT INTO chats_chat_members (chat_id, user_id, last_read_seq, unread_count) '
+            'VALUES (%s, %s, %s, %s)',
+            rows
+        )
+    return user_ids, chat_ids
+
+
+def build_queries(user_id, chat_id):
+    history = Message.objects.filter(chat_id=chat_id)
+    anchors = list(history.order_by('-created_at', '-id'))
+    anchor = anchors[len(anchors) * 3 // 4]
+    pagination = MessageKeysetPagination()
+    return [
+        ('chat history, first page',
+         history.order_by('-created_at', '-id')[:50]),
+        ('chat history, deep page',
+         pagination.older_than(history, anchor)[:50]),
+        # As in MessageViewSet.get_unread_messages.
+        ('unread messages for user',
+         Message.objects.filter(
+             chat__memberships__user=user_id,
+             seq__gt=F('chat__memberships__last_read_seq')
+         ).exclude(user_id=user_id)),
+        ('messages by user',
+         Message.objects.filter(user_id=user_id).order_by('-created_at')[:50]),
+    ]
+
+
+def set_indexes(add):
+    with connection.schema_editor() as editor:
+        for index in Message._meta.indexes:
+            if add:
+                editor.add_index(Message, index)
+            else:
+                editor.remove_index(Message, index)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def explain(queryset):
+    sql, params = queryset.query.get_compiler(connection.alias).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def measure(queryset, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        list(queryset.all())
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def report(title, queries, repeat):
+    print(f'\n== {title}')
+    for name, queryset in queries:
+        median, worst = measure(queryset, repeat)
+        print(f'{name}: median {median:.2f} ms, max {worst:.2f} ms')
+        for line in explain(queryset):
+            print(f'    {line}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--messages', type=int, default=2000000)
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--chats-per-user', type=int, default=5)
+    parser.add_argument('--unread-ratio', type=float, default=0.02)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    database = settings.DATABASES['default']['NAME']
+    if os.path.exists(database):
+        os.remove(database)
+    call_command('migrate', verbosity=0)
+
+    started = time.perf_counter()
+    user_ids, chat_ids = seed(args.messages, args.chats, args.users,
+                              args.chats_per_user, args.unread_ratio)
+    print(f'seeded {args.messages} messages in {time.perf_counter() - started:.1f} s')
+
+    queries = build_queries(user_ids[0], chat_ids[0])
+    set_indexes(add=False)
+    report('before (foreign key indexes and the chat/seq constraint only)', queries, args.repeat)
+
+    started = time.perf_counter()
+    set_indexes(add=True)
+    print(f'\nbuilt indexes in {time.perf_counter() - started:.1f} s')
+    report('after (Message.Meta.indexes)', queries, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+List response time of MessageSerializer and ChatSerializer against the
+`.values()` fast path and FastJSONRenderer.
+
+    python -m benchmarks.serialization --rows 10000
+"""
+import argparse
+import os
+import statistics
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import transaction  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from chats.models import Chat, Membership, Message  # noqa: E402
+from chats.renderers import FastJSONRenderer  # noqa: E402
+from chats.serializers import (  # noqa: E402
+    ChatSerializer, MessageSerializer, ValuesListSerializer)
+
+User = get_user_model()
+
+
+def seed(rows):
+    with transaction.atomic():
+        users = User.objects.bulk_create(
+            [User(email=f'user{i}@bench.local', password='!') for i in range(100)])
+        chats = Chat.objects.bulk_create(
+            [Chat(title=f'Chat {i}', admin=users[i % 100], avatar=f'avatars/{i}.png',
+                  avatar_hash=f'{i:020x}' if i % 2 else None) for i in range(rows)])
+        Membership.objects.bulk_create(
+            [Membership(chat=chat, user=users[(i + j) % 100])
+             for i, chat in enumerate(chats) for j in range(3)], batch_size=5000)
+        Message.objects.bulk_create(
+            [Message(text=f'Сообщение номер {i} 👋', user=users[i % 100],
+                     chat=chats[i % 100], seq=i) for i in range(rows)], batch_size=5000)
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(timings)
+
+
+def compare(name, serializer_class, queryset, request, repeat):
+    context = {'request': request}
+
+    def drf():
+        data = serializer_class(queryset.all(), many=True, context=context).data
+        return JSONRenderer().render(data)
+
+    def fast():
+        serializer = ValuesListSerializer(serializer_class(context=context))
+        return FastJSONRenderer().render(serializer.to_representation(queryset.all()))
+
+    expected, slow_ms = measure(drf, repeat)
+    rendered, fast_ms = measure(fast, repeat)
+    same = 'identical' if rendered == expected else 'DIFFERENT'
+    print(f'{name}: serializer {slow_ms:.0f} ms, fast path {fast_ms:.0f} ms '
+          f'({slow_ms / fast_ms:.1f}x), {len(rendered):,} bytes, {same}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    database = settings.DATABASES['default']['NAME']
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    call_command('migrate', verbosity=0)
+    seed(args.rows)
+
+    request = Request(APIRequestFactory().get('/api/v1/chats/'))
+    compare('messages', MessageSerializer, Message.objects.all(), request, args.repeat)
+    compare('chats', ChatSerializer, Chat.objects.all(), request, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+import os
+import tempfile
+
+from application.settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get(
+            'BENCH_DATABASE',
+            os.path.join(tempfile.gettempdir(), 'pythontests_bench.sqlite3')
+        ),
+    }
+}
+
+if SQLITE['PRODUCTION']:  # noqa: F405
+    DATABASES['default']['ENGINE'] = 'application.sqlite'
@@ -0,0 +1,111 @@
+"""
+Concurrent message inserts on SQLite, with and without the production profile
+and group commit.
+
+    python -m benchmarks.sqlite_writes --processes 4 --threads 8
+    SQLITE_PRODUCTION=1 python -m benchmarks.sqlite_writes --processes 4 --threads 8
+    MESSAGE_GROUP_COMMIT=1 python -m benchmarks.sqlite_writes --processes 4 --threads 8
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import threading
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import OperationalError, connection, connections  # noqa: E402
+
+from chats.ingest import create_message  # noqa: E402
+from chats.models import Chat, Membership  # noqa: E402
+from users.models import User  # noqa: E402
+
+
+def post_messages(chat_ids, user_id, count, results):
+    latencies, errors = [], 0
+    for i in range(count):
+        started = time.perf_counter()
+        try:
+            create_message(
+                chat_id=chat_ids[i % len(chat_ids)], user_id=user_id, text=f'message {i}')
+        except OperationalError:
+            errors += 1
+        else:
+            latencies.append((time.perf_counter() - started) * 1000)
+    connection.close()
+    results.put((latencies, errors))
+
+
+def run_process(threads, chat_ids, user_id, count, results):
+    workers = [
+        threading.Thread(target=post_messages, args=(chat_ids, user_id, count, results))
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=200,
+                        help='Messages posted by each thread.')
+    parser.add_argument('--chats', type=int, default=20)
+    args = parser.parse_args()
+
+    database = settings.DATABASES['default']['NAME']
+    for suffix in ('', '-wal', '-shm', '-writer.lock'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    call_command('migrate', verbosity=0)
+    user = User.objects.create_user(email='bench@example.com', password='password')
+    chat_ids = []
+    for i in range(args.chats):
+        chat = Chat.objects.create(title=f'chat {i}', admin=user)
+        Membership.objects.create(chat=chat, user=user)
+        chat_ids.append(chat.pk)
+
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    started = time.perf_counter()
+    processes = [
+        context.Process(target=run_process, args=(
+            args.threads, chat_ids, user.pk, args.messages, results))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    latencies, errors = [], 0
+    for _ in range(args.processes * args.threads):
+        thread_latencies, thread_errors = results.get()
+        latencies.extend(thread_latencies)
+        errors += thread_errors
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    engine = settings.DATABASES['default']['ENGINE']
+    group_commit = ', group commit' if settings.MESSAGE_INGEST['GROUP_COMMIT'] else ''
+    print(f'{engine}{group_commit}, {args.processes} processes x {args.threads} threads')
+    print(f'{len(latencies)} messages in {elapsed:.2f} s '
+          f'({len(latencies) / elapsed:,.0f} messages/s), {errors} failed')
+    if latencies:
+        print(f'latency: median {statistics.median(latencies):.1f} ms, '
+              f'p99 {latencies[int(len(latencies) * 0.99)]:.1f} ms, '
+              f'max {latencies[-1]:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+from django.conf import settings
+
+from users.authentication import LRUCache
+
+from . import sharding
+from .models import Membership
+
+
+def get_setting(name, default):
+    return getattr(settings, 'MEMBERSHIP_CACHE', {}).get(name, default)
+
+
+cache = LRUCache(get_setting('MAX_USERS', 10000), get_setting('TTL', 30))
+
+
+def get_chat_ids(user_id, refresh=False):
+    """
+    The ids of the chats `user_id` belongs to on any shard, as a frozenset.
+
+    Sets are cached per process and dropped on membership changes made in
+    it; other processes notice within MEMBERSHIP_CACHE['TTL'] seconds.
+    """
+    key = str(user_id)
+    chat_ids = None if refresh else cache.get(key)
+    if chat_ids is None:
+        generation = cache.generation
+        chat_ids = frozenset().union(*(
+            Membership.objects.using(alias).filter(
+                user_id=user_id).values_list('chat_id', flat=True)
+            for alias in sharding.get_shards()))
+        cache.set(key, chat_ids, generation=generation)
+    return chat_ids
+
+
+def is_member(user_id, chat_id):
+    if chat_id in get_chat_ids(user_id):
+        return True
+    # The user may have joined in another process since the set was cached.
+    return chat_id in get_chat_ids(user_id, refresh=True)
+
+
+def invalidate(user_ids):
+    for user_id in user_ids:
+        cache.delete(str(user_id))
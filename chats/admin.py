@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.utils.html import format_html
 
+from users.thumbnails import thumbnail_url
+
 from .models import Chat, Message
 
 
@@ -12,7 +14,7 @@ class ChatAdmin(admin.ModelAdmin):
     search_fields = ('id', 'title', 'admin__username', 'members__username')
 
     def avatar_tag(self, obj):
-        return format_html('<img src="{}" width="50" height="50"/>'.format(obj.avatar.url))
+        return format_html('<img src="{}" width="50" height="50"/>', thumbnail_url(obj, 50))
     avatar_tag.short_description = 'Avatar'
 
     def members_list(self, obj):
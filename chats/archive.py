@@ -0,0 +1,188 @@
+import json
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedMessage, Chat, Membership, Message, MessageArchiveSegment
+
+FIELDS = ('id', 'text', 'created_at', 'is_read', 'user_id', 'seq')
+
+
+def get_setting(name, default):
+    return getattr(settings, 'MESSAGE_ARCHIVE', {}).get(name, default)
+
+
+def encode(rows):
+    data = [
+        [row['id'].hex, row['text'], row['created_at'].isoformat(), row['is_read'],
+         row['user_id'] and row['user_id'].hex, row['seq']]
+        for row in rows
+    ]
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode(), 6)
+
+
+def decode(data):
+    return [
+        (uuid.UUID(pk), text, datetime.fromisoformat(created_at), is_read,
+         user_id and uuid.UUID(user_id), seq)
+        for pk, text, created_at, is_read, user_id, seq
+        in json.loads(zlib.decompress(data))
+    ]
+
+
+@lru_cache(maxsize=128)
+def load(segment_id, chat_id, using):
+    # Segments never change once written, so their decoded rows are kept.
+    data = MessageArchiveSegment.objects.using(using).filter(
+        pk=segment_id).values_list('data', flat=True).get()
+    return decode(bytes(data))
+
+
+def to_message(chat_id, row, using):
+    message = Message(chat_id=chat_id, **dict(zip(FIELDS, row)))
+    message._state.adding = False
+    message._state.db = using
+    message.is_archived = True
+    return message
+
+
+def segment_messages(segment):
+    using = segment._state.db
+    return [
+        to_message(segment.chat_id, row, using)
+        for row in load(segment.pk, segment.chat_id, using)
+    ]
+
+
+def get_message(pk, using='default'):
+    """
+    The archived message `pk` as an unsaved Message, or None.
+    """
+    entry = ArchivedMessage.objects.using(using).select_related(
+        'segment').defer('segment__data').filter(pk=pk).first()
+    if entry is None:
+        return None
+    for message in segment_messages(entry.segment):
+        if message.pk == pk:
+            return message
+    return None
+
+
+def key(message):
+    return message.created_at, message.id
+
+
+def segments_of(chat_id, using):
+    return MessageArchiveSegment.objects.using(using).filter(
+        chat_id=chat_id).defer('data')
+
+
+def older_than(chat_id, anchor, limit, using='default'):
+    """
+    Up to `limit` archived messages of the chat older than `anchor`,
+    newest first; all of them from the newest if `anchor` is None.
+    """
+    segments = segments_of(chat_id, using)
+    if anchor is not None:
+        segments = segments.filter(first_created_at__lte=anchor.created_at)
+    found = []
+    for segment in segments.order_by('-last_created_at', '-pk').iterator():
+        messages = segment_messages(segment)
+        if anchor is not None:
+            messages = [message for message in messages if key(message) < key(anchor)]
+        found.extend(reversed(messages))
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+
+def newer_than(chat_id, anchor, limit, using='default'):
+    """
+    Up to `limit` archived messages of the chat newer than `anchor`,
+    oldest first.
+    """
+    segments = segments_of(chat_id, using).filter(
+        last_created_at__gte=anchor.created_at)
+    found = []
+    for segment in segments.order_by('last_created_at', 'pk').iterator():
+        found.extend(
+            message for message in segment_messages(segment)
+            if key(message) > key(anchor))
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+
+def archive_chat(chat_id, cutoff, segment_size, using='default'):
+    """
+    Move the chat's oldest messages created before `cutoff` into one
+    segment and return how many were moved.
+    """
+    with transaction.atomic(using=using):
+        rows = list(
+            Message.objects.using(using).select_for_update().filter(
+                chat_id=chat_id, created_at__lt=cutoff
+            ).order_by('created_at', 'id').values(*FIELDS)[:segment_size])
+        if not rows:
+            return 0
+        segment = MessageArchiveSegment.objects.using(using).create(
+            chat_id=chat_id,
+            first_seq=min(row['seq'] for row in rows),
+            last_seq=max(row['seq'] for row in rows),
+            first_created_at=rows[0]['created_at'],
+            last_created_at=rows[-1]['created_at'],
+            count=len(rows),
+            data=encode(rows),
+        )
+        ArchivedMessage.objects.using(using).bulk_create(
+            [ArchivedMessage(id=row['id'], segment=segment) for row in rows])
+        Message.objects.using(using).filter(
+            pk__in=[row['id'] for row in rows]).delete()
+        # The queryset delete skips Message.delete(): archived messages
+        # count as read, and the chat points at its newest live message.
+        last_seq = segment.last_seq
+        memberships = Membership.objects.using(using).filter(chat_id=chat_id)
+        memberships.filter(last_read_seq__lt=last_seq).update(last_read_seq=last_seq)
+        memberships.filter(last_read_seq=last_seq).rebuild_unread_counts()
+        chats = Chat.objects.db_manager(using)
+        chats.touch([chat_id])
+        chats.refresh_last_message([chat_id])
+    return len(rows)
+
+
+def iterate_chat_ids(using, chunk_size=1000):
+    chats = Chat.objects.using(using).order_by('pk').values_list('pk', flat=True)
+    chat_ids = list(chats[:chunk_size])
+    while chat_ids:
+        yield from chat_ids
+        chat_ids = list(chats.filter(pk__gt=chat_ids[-1])[:chunk_size])
+
+
+def archive_messages(age=None, segment_size=None, pause=None, using='default', progress=None):
+    """
+    Move messages older than `age` (a timedelta, by default
+    MESSAGE_ARCHIVE['AGE_DAYS']) out of chats_message, one segment per
+    transaction so the live table is never locked for long.
+    """
+    age = age or timedelta(days=get_setting('AGE_DAYS', 365))
+    segment_size = segment_size or get_setting('SEGMENT_SIZE', 1000)
+    pause = get_setting('PAUSE', 0) if pause is None else pause
+    cutoff = timezone.now() - age
+    total = 0
+    for chat_id in iterate_chat_ids(using):
+        while True:
+            moved = archive_chat(chat_id, cutoff, segment_size, using)
+            total += moved
+            if moved and progress is not None:
+                progress(total)
+            if moved < segment_size:
+                break
+            if pause:
+                time.sleep(pause)
+    return total
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.utils.encoders import JSONEncoder
+
+from application.paths import private_directory
+
+logger = logging.getLogger(__name__)
+
+# Below the default send buffer of Unix datagram sockets on Linux.
+MAX_DATAGRAM_SIZE = 200 * 1024
+
+
+def encode_event(event):
+    return json.dumps(event, cls=JSONEncoder, separators=(',', ':'))
+
+
+class BaseBroker:
+    """
+    Fans chat events out to the websocket hubs.
+
+    `publish` may be called from any thread. Subscribers are called on the
+    event loop they subscribed from, with the event already encoded as a
+    JSON string so it is serialized once no matter how many sockets get it.
+    Delivery is at most once; clients resync through the REST cursors.
+    """
+
+    def __init__(self, **options):
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        raise NotImplementedError
+
+    def subscribe(self, callback):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            self.subscribers.append((loop, callback))
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers = [
+                (loop, subscriber) for loop, subscriber in self.subscribers
+                if subscriber != callback
+            ]
+
+    def close(self):
+        pass
+
+    def dispatch(self, data):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for loop, callback in subscribers:
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(callback, data)
+
+
+class InProcessBroker(BaseBroker):
+    def publish(self, event):
+        self.dispatch(encode_event(event))
+
+
+class UnixSocketBroker(BaseBroker):
+    """
+    Cross-process broker over Unix datagram sockets in a shared directory.
+
+    Every subscribing process binds one socket in `path`; publishing sends
+    the event to every socket found there. Sockets left behind by dead
+    processes are removed on the first failed send. Whoever can write to
+    `path` gets every event, so it is private to the user by default.
+    """
+
+    def __init__(self, path=None, **options):
+        super().__init__(**options)
+        self.path = path or private_directory('pythontests-realtime')
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        self.receiver = None
+        self.address = None
+
+    def subscribe(self, callback):
+        super().subscribe(callback)
+        with self.lock:
+            if self.receiver is not None:
+                return
+            self.address = os.path.join(
+                self.path, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.sock')
+            self.receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.receiver.setblocking(False)
+            self.receiver.bind(self.address)
+            os.chmod(self.address, 0o600)
+        asyncio.get_running_loop().add_reader(
+            self.receiver.fileno(), self.receive)
+
+    def receive(self):
+        while True:
+            try:
+                data = self.receiver.recv(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.dispatch(data.decode())
+
+    def publish(self, event):
+        data = encode_event(event).encode()
+        if len(data) > MAX_DATAGRAM_SIZE:
+            messages = event.get('messages') or []
+            if len(messages) > 1:
+                # A batch announcement: send it in halves.
+                middle = len(messages) // 2
+                self.publish({**event, 'messages': messages[:middle]})
+                self.publish({**event, 'messages': messages[middle:]})
+            else:
+                logger.warning(
+                    'Dropped %s event of %d bytes, over the datagram limit',
+                    event.get('type'), len(data))
+            return
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith('.sock'):
+                continue
+            try:
+                self.sender.sendto(data, entry.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+            except (BlockingIOError, OSError) as error:
+                logger.warning('Dropped event for %s: %s', entry.name, error)
+
+    def close(self):
+        if self.receiver is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self.receiver.fileno())
+            except RuntimeError:
+                pass
+            self.receiver.close()
+            self.receiver = None
+            try:
+                os.unlink(self.address)
+            except FileNotFoundError:
+                pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                config = getattr(settings, 'REALTIME', {})
+                broker_class = import_string(
+                    config.get('BROKER', 'chats.brokers.InProcessBroker'))
+                _broker = broker_class(**config.get('BROKER_OPTIONS', {}))
+    return _broker
@@ -0,0 +1,55 @@
+import hashlib
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import sharding
+
+
+def combine(stamps):
+    if len(stamps) == 1:
+        return stamps[0]
+    versions = [stamp['version'] for stamp in stamps if stamp['version'] is not None]
+    modified = [stamp['modified_at'] for stamp in stamps if stamp['modified_at'] is not None]
+    return {
+        'count': sum(stamp['count'] for stamp in stamps),
+        'version': sum(versions) if versions else None,
+        'modified_at': max(modified, default=None),
+    }
+
+
+def get_validators(request, chats, single=False):
+    """
+    ETag and Last-Modified (a timestamp) of a list drawn from `chats`, as
+    `request` sees it, from the chats' version stamps.
+
+    Removing a chat from a set leaves the newest stamp alone, so only a
+    list of a single chat gets a Last-Modified; the ETag also counts them.
+    """
+    stamp = combine(sharding.gather(lambda: chats.order_by().aggregate(
+        count=Count('pk'), version=Sum('version'), modified_at=Max('modified_at'))))
+    modified_at = stamp['modified_at']
+    key = ':'.join(str(part) for part in (
+        request.user.pk, request.accepted_media_type, stamp['count'], stamp['version'],
+        modified_at and modified_at.timestamp()))
+    etag = 'W/"%s"' % hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    last_modified = int(modified_at.timestamp()) if single and modified_at else None
+    return etag, last_modified
+
+
+def get_not_modified(request, etag, last_modified):
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Revalidate every time instead of trusting Last-Modified heuristics,
+    # and never share one user's list with another.
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Authorization',))
@@ -0,0 +1,220 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connections, models, router, transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .brokers import get_broker
+from .models import Chat, Membership, Message
+from .serializers import MessageSerializer
+
+# Messages per event announcing a batch, which must fit in a datagram of
+# the UnixSocketBroker.
+EVENT_MESSAGES = 100
+
+
+def get_setting(name, default):
+    return getattr(settings, 'MESSAGE_INGEST', {}).get(name, default)
+
+
+def write_messages(messages, using):
+    """
+    Insert new messages, of one chat or several, in a single transaction:
+    per chat one seq range, version bump and unread count update, plus one
+    read cursor update per author, then one bulk_create for all of them.
+    post_save is not sent.
+    """
+    now = timezone.now()
+    by_chat = {}
+    for message in messages:
+        by_chat.setdefault(message.chat_id, []).append(message)
+    chats = Chat.objects.db_manager(using)
+    with transaction.atomic(using=using):
+        for chat_id, chat_messages in by_chat.items():
+            count = len(chat_messages)
+            last_seq = chats.allocate_message_seq(
+                chat_id, count=count, last_message_id=chat_messages[-1].pk, now=now)
+            for seq, message in enumerate(chat_messages, last_seq - count + 1):
+                message.seq = seq
+            memberships = Membership.objects.db_manager(using).filter(chat_id=chat_id)
+            # Like Message.save: authors have read up to their last message
+            # and only what others wrote after it is unread for them.
+            last_seqs = {
+                message.user_id: message.seq for message in chat_messages
+                if message.user_id is not None
+            }
+            memberships.exclude(
+                user_id__in=last_seqs
+            ).update(unread_count=models.F('unread_count') + count)
+            for user_id, seq in last_seqs.items():
+                unread = sum(
+                    1 for message in chat_messages
+                    if message.seq > seq and message.user_id != user_id)
+                memberships.filter(user_id=user_id, last_read_seq__lt=seq).update(
+                    last_read_seq=seq, last_read_at=now, unread_count=unread)
+        Message.objects.using(using).bulk_create(messages)
+    for chat_messages in by_chat.values():
+        last = chat_messages[-1]
+        if Message.chat.is_cached(last):
+            last.chat.last_message_seq = last.seq
+            last.chat.last_message_id = last.pk
+            last.chat.last_message_at = now
+    return messages
+
+
+def write_batch(messages, using):
+    """
+    write_messages(), falling back to one message at a time when that
+    fails, so one bad message does not fail the rest. Returns the error of
+    each message, None for those written.
+    """
+    try:
+        write_messages(messages, using)
+    except OperationalError as error:
+        # Locked or unavailable: no message would fare any better.
+        return [error] * len(messages)
+    except Exception:
+        errors = []
+        for message in messages:
+            message.seq = None
+            try:
+                write_messages([message], using)
+            except Exception as error:
+                errors.append(error)
+            else:
+                errors.append(None)
+        return errors
+    return [None] * len(messages)
+
+
+def publish_messages(messages, using):
+    """
+    Announce new messages with one event per chat, and per EVENT_MESSAGES
+    of its messages, instead of the post_save event for each.
+    """
+    by_chat = {}
+    for message in messages:
+        by_chat.setdefault(str(message.chat_id), []).append(message)
+    broker = get_broker()
+    for chat_id, chat_messages in by_chat.items():
+        for start in range(0, len(chat_messages), EVENT_MESSAGES):
+            event = {
+                'type': 'messages',
+                'chat': chat_id,
+                'messages': MessageSerializer(
+                    chat_messages[start:start + EVENT_MESSAGES], many=True).data,
+            }
+            transaction.on_commit(lambda event=event: broker.publish(event), using=using)
+
+
+class Entry:
+    __slots__ = ('message', 'done', 'error')
+
+    def __init__(self, message):
+        self.message = message
+        self.done = False
+        self.error = None
+
+
+class GroupCommit:
+    """
+    Commits the messages that threads of this process submit for one
+    database together. The first thread to find no commit in progress
+    leads: it waits up to `max_wait` seconds for up to `batch_size`
+    messages, writes them in one transaction and wakes the others, whose
+    messages are then committed. Messages arriving meanwhile form the next
+    batch, led by one of their threads.
+    """
+
+    def __init__(self, using, batch_size, max_wait):
+        self.using = using
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.arrived = threading.Condition(self.lock)
+        self.finished = threading.Condition(self.lock)
+        self.pending = []
+        self.leading = False
+
+    def submit(self, message):
+        """
+        Return once `message` is committed, or raise what writing it raised.
+        """
+        entry = Entry(message)
+        with self.lock:
+            self.pending.append(entry)
+            self.arrived.notify()
+        while not entry.done:
+            batch = self.wait_or_lead(entry)
+            if batch:
+                self.commit(batch)
+        if entry.error is not None:
+            raise entry.error
+        return message
+
+    def wait_or_lead(self, entry):
+        with self.lock:
+            while self.leading and not entry.done:
+                self.finished.wait()
+            if entry.done:
+                return []
+            self.leading = True
+            deadline = time.monotonic() + self.max_wait
+            while len(self.pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.arrived.wait(remaining)
+            batch = self.pending[:self.batch_size]
+            del self.pending[:self.batch_size]
+            return batch
+
+    def commit(self, batch):
+        try:
+            errors = write_batch([entry.message for entry in batch], self.using)
+            for entry, error in zip(batch, errors):
+                entry.error = error
+        finally:
+            with self.lock:
+                for entry in batch:
+                    if entry.error is None and entry.message._state.adding:
+                        entry.error = DatabaseError('The message was not committed.')
+                    entry.done = True
+                self.leading = False
+                self.finished.notify_all()
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(using):
+    group = _groups.get(using)
+    if group is None:
+        with _groups_lock:
+            group = _groups.get(using)
+            if group is None:
+                group = _groups[using] = GroupCommit(
+                    using, get_setting('BATCH_SIZE', 64), get_setting('MAX_WAIT', 0.002))
+    return group
+
+
+def create_message(**fields):
+    """
+    Message.objects.create(), but committed together with the messages
+    concurrent requests create when MESSAGE_INGEST['GROUP_COMMIT'] is on.
+    It still only returns once the message is committed.
+    """
+    message = Message(**fields)
+    using = router.db_for_write(Message, instance=message)
+    # Inside a transaction the message could not be committed on its own.
+    if not get_setting('GROUP_COMMIT', False) or connections[using].in_atomic_block:
+        message.save(force_insert=True, using=using)
+        return message
+    get_group(using).submit(message)
+    post_save.send(
+        sender=Message, instance=message, created=True,
+        update_fields=None, raw=False, using=using)
+    return message
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from chats import archive, sharding
+
+
+class Command(BaseCommand):
+    help = 'Move old messages into compressed per-chat archive segments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Archive messages older than this (MESSAGE_ARCHIVE['AGE_DAYS']).")
+        parser.add_argument('--segment-size', type=int, default=None)
+        parser.add_argument('--pause', type=float, default=None,
+                            help='Seconds to sleep between segments.')
+        parser.add_argument('--database', action='append',
+                            help='Only archive on this shard; may be repeated (all shards).')
+
+    def handle(self, *args, **options):
+        days = options['days']
+        total = 0
+        for alias in options['database'] or sharding.get_shards():
+            total += archive.archive_messages(
+                age=timedelta(days=days) if days is not None else None,
+                segment_size=options['segment_size'],
+                pause=options['pause'],
+                using=alias,
+                progress=lambda count: self.stdout.write(
+                    f'Archived {total + count} messages'))
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} messages archived.'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chats import rebalance, sharding
+from chats.models import Chat
+
+
+class Command(BaseCommand):
+    help = ('Move chats to another shard while they stay in use; by default every '
+            'chat not on the shard its id hashes to, such as after adding a shard.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chat', action='append',
+                            help='Only move this chat; may be repeated.')
+        parser.add_argument('--to', help='Shard to move --chat to (the one it hashes to).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the chats that would move.')
+
+    def handle(self, *args, **options):
+        shards = sharding.get_shards()
+        if options['to'] is not None and options['to'] not in shards:
+            raise CommandError(f"Unknown shard {options['to']}, expected one of {', '.join(shards)}.")
+        if options['to'] is not None and not options['chat']:
+            raise CommandError('--to needs --chat.')
+        if options['chat']:
+            moves = ((chat_id, options['to'] or sharding.hash_shard(chat_id, shards))
+                     for chat_id in options['chat'])
+        else:
+            moves = (
+                (chat_id, sharding.hash_shard(chat_id, shards))
+                for alias in shards for chat_id in rebalance.misplaced(alias))
+
+        total = 0
+        for chat_id, target in moves:
+            if options['dry_run']:
+                self.stdout.write(f'Would move {chat_id} to {target}')
+                total += 1
+                continue
+            try:
+                source = rebalance.move_chat(chat_id, target, batch_size=options['batch_size'])
+            except (Chat.DoesNotExist, ValueError):
+                raise CommandError(f'Chat {chat_id} does not exist.')
+            if source is not None:
+                total += 1
+                self.stdout.write(f'Moved {chat_id} from {source} to {target}')
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} chats moved.'))
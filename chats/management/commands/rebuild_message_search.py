@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from chats import search, sharding
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the FTS5 message search index and its sync triggers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--database', action='append',
+                            help='Only rebuild on this shard; may be repeated (all shards).')
+
+    def handle(self, *args, **options):
+        aliases = options['database'] or sharding.get_shards()
+        if not all(search.is_supported(connections[alias]) for alias in aliases):
+            raise CommandError('Message search needs an SQLite database.')
+        total = 0
+        for alias in aliases:
+            total += search.rebuild(
+                using=alias,
+                batch_size=options['batch_size'],
+                progress=lambda count: self.stdout.write(
+                    f'Indexed {total + count} messages'))
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} messages indexed.'))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chats import sharding
+from chats.models import Membership
+
+
+class Command(BaseCommand):
+    help = 'Recount Membership.unread_count from the read cursors, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--chat', help='Only rebuild counters of this chat.')
+        parser.add_argument('--user', help='Only rebuild counters of this user.')
+        parser.add_argument('--database', action='append',
+                            help='Only rebuild on this shard; may be repeated (all shards).')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        for alias in options['database'] or sharding.get_shards():
+            memberships = Membership.objects.using(alias).order_by('pk')
+            if options['chat']:
+                memberships = memberships.filter(chat_id=options['chat'])
+            if options['user']:
+                memberships = memberships.filter(user_id=options['user'])
+
+            last_pk = 0
+            while True:
+                pks = list(memberships.filter(pk__gt=last_pk).values_list(
+                    'pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                with transaction.atomic(using=alias):
+                    Membership.objects.using(alias).filter(pk__in=pks).rebuild_unread_counts()
+                last_pk = pks[-1]
+                total += len(pks)
+                self.stdout.write(f'Rebuilt {total} counters')
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} counters rebuilt.'))
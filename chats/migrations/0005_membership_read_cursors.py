@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_message_seq(apps, schema_editor):
+    Chat = apps.get_model('chats', 'Chat')
+    Membership = apps.get_model('chats', 'Membership')
+    Message = apps.get_model('chats', 'Message')
+    db = schema_editor.connection.alias
+    for chat_id in Chat.objects.using(db).values_list('id', flat=True).iterator():
+        batch = []
+        seq = 0
+        messages = Message.objects.using(db).filter(chat_id=chat_id).order_by(
+            'created_at', 'id').only('id')
+        for message in messages.iterator(chunk_size=2000):
+            seq += 1
+            message.seq = seq
+            batch.append(message)
+            if len(batch) == 2000:
+                Message.objects.using(db).bulk_update(batch, ['seq'])
+                batch = []
+        if batch:
+            Message.objects.using(db).bulk_update(batch, ['seq'])
+        Chat.objects.using(db).filter(pk=chat_id).update(last_message_seq=seq)
+        # Unread counting starts with the messages sent after the upgrade.
+        Membership.objects.using(db).filter(chat_id=chat_id).update(last_read_seq=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chats', '0004_message_indexes'),
+    ]
+
+    operations = [
+        # The implicit chats_chat_members table becomes the Membership
+        # through model; only the migration state changes here.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Membership',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='chats.chat')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'chats_chat_members',
+                        'unique_together': {('chat', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='chat',
+                    name='members',
+                    field=models.ManyToManyField(related_name='chats', through='chats.Membership', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='membership',
+            name='last_read_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='membership',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_message_seq, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('chat', 'seq'), name='message_chat_seq_unique'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.1 on 2026-10-18 08:32
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_unread_count(apps, schema_editor):
+    Membership = apps.get_model('chats', 'Membership')
+    Message = apps.get_model('chats', 'Message')
+    unread = Message.objects.filter(
+        chat_id=models.OuterRef('chat_id'),
+        seq__gt=models.OuterRef('last_read_seq')
+    ).exclude(
+        user_id=models.OuterRef('user_id')
+    ).order_by().values('chat_id').annotate(
+        count=models.Count('*')).values('count')
+    Membership.objects.using(schema_editor.connection.alias).update(
+        unread_count=Coalesce(models.Subquery(unread), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_membership_read_cursors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='membership',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_unread_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from chats import search
+
+
+def create_search_index(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+    search.install(schema_editor.connection)
+    search.rebuild(using=schema_editor.connection.alias)
+
+
+def drop_search_index(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0006_membership_unread_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0007_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='avatar_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
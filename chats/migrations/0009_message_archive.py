@@ -0,0 +1,39 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0008_avatar_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_seq', models.PositiveBigIntegerField()),
+                ('last_seq', models.PositiveBigIntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_created_at', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='chats.chat')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('segment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chats.messagearchivesegment')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='messagearchivesegment',
+            index=models.Index(fields=['chat', 'last_created_at'], name='archive_chat_created_idx'),
+        ),
+    ]
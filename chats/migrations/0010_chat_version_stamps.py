@@ -0,0 +1,24 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:28
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0009_message_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='modified_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
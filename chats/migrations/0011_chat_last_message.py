@@ -0,0 +1,35 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_last_message(apps, schema_editor):
+    Chat = apps.get_model('chats', 'Chat')
+    Message = apps.get_model('chats', 'Message')
+    newest = Message.objects.filter(
+        chat_id=models.OuterRef('pk')).order_by('-seq')
+    Chat.objects.using(schema_editor.connection.alias).update(
+        last_message_id=models.Subquery(newest.values('pk')[:1]),
+        last_message_at=models.Subquery(newest.values('created_at')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0010_chat_version_stamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_message',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message'),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from chats import search
+
+
+def reinstall_search_triggers(apps, schema_editor):
+    # Rebuilding chats_message dropped them.
+    search.install(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chats', '0011_chat_last_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatPlacement',
+            fields=[
+                ('chat_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('database', models.CharField(max_length=64)),
+                ('moved_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='chat',
+            name='admin',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='admin', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='membership',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(reinstall_search_triggers, reinstall_search_triggers),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-18 11:17
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0012_sharding'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_unread_idx',
+        ),
+    ]
@@ -1,12 +1,60 @@
 import uuid
 
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
+class ShardedQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        # The shard depends on the new row itself (chats.sharding).
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=router.db_for_write(self.model, instance=obj))
+        return obj
+
+
+class ChatManager(models.Manager.from_queryset(ShardedQuerySet)):
+    def allocate_message_seq(self, chat_id, count=1, last_message_id=None, now=None):
+        now = now or timezone.now()
+        fields = {}
+        if last_message_id is not None:
+            fields = {'last_message_id': last_message_id, 'last_message_at': now}
+        with transaction.atomic(using=self.db):
+            self.filter(pk=chat_id).update(
+                last_message_seq=models.F('last_message_seq') + count,
+                version=models.F('version') + 1,
+                modified_at=now,
+                **fields)
+            return self.filter(pk=chat_id).values_list(
+                'last_message_seq', flat=True).get()
+
+    def touch(self, chat_ids):
+        """
+        Bump the version stamps of the chats, which list ETags are built
+        from, after anything that changes how they or their messages list.
+        """
+        return self.filter(pk__in=chat_ids).update(
+            version=models.F('version') + 1, modified_at=timezone.now())
+
+    def refresh_last_message(self, chat_ids):
+        """
+        Point the chats at their newest live message again, after the one
+        they had was deleted or moved.
+        """
+        newest = Message.objects.filter(
+            chat_id=models.OuterRef('pk')).order_by('-seq')
+        return self.filter(pk__in=chat_ids).update(
+            last_message_id=models.Subquery(newest.values('pk')[:1]),
+            last_message_at=models.Subquery(newest.values('created_at')[:1]))
+
+
 class Chat(models.Model):
     id = models.UUIDField(
         primary_key=True,
@@ -19,6 +67,12 @@ class Chat(models.Model):
         upload_to='avatars/',
         default='avatars/default_avatar.jpg'
     )
+    avatar_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False
+    )
     title = models.TextField()
     is_private = models.BooleanField(
         default=True
@@ -26,17 +80,48 @@ class Chat(models.Model):
     created_at = models.DateTimeField(
         auto_now_add=True
     )
+    # Users stay on the default database when chats are sharded, so links
+    # to them carry no database constraint (chats.sharding).
     admin = models.ForeignKey(
         User,
         null=True,
         blank=True,
         on_delete=models.SET_NULL,
-        related_name='admin'
+        related_name='admin',
+        db_constraint=False
     )
     members = models.ManyToManyField(
         User,
+        through='Membership',
         related_name='chats'
     )
+    last_message_seq = models.PositiveBigIntegerField(
+        default=0,
+        editable=False
+    )
+    last_message = models.ForeignKey(
+        'Message',
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+    last_message_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False
+    )
+    version = models.PositiveBigIntegerField(
+        default=0,
+        editable=False
+    )
+    modified_at = models.DateTimeField(
+        default=timezone.now,
+        editable=False
+    )
+
+    objects = ChatManager()
 
     def __str__(self) -> str:
         return f'{self.id}'
@@ -62,16 +147,235 @@ class Message(models.Model):
         User,
         null=True,
         on_delete=models.SET_NULL,
-        related_name='messages'
+        related_name='messages',
+        db_constraint=False
     )
     chat = models.ForeignKey(
         Chat,
         on_delete=models.CASCADE,
         related_name='messages'
     )
+    seq = models.PositiveBigIntegerField(
+        editable=False
+    )
+
+    objects = ShardedQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.text
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.seq is None:
+            # The chat's shard, before anything else is written.
+            kwargs['using'] = kwargs.get('using') or router.db_for_write(Message, instance=self)
+            chats = Chat.objects.db_manager(kwargs['using'])
+            with transaction.atomic(using=chats.db):
+                now = timezone.now()
+                self.seq = chats.allocate_message_seq(
+                    self.chat_id, last_message_id=self.pk, now=now)
+                if Message.chat.is_cached(self):
+                    self.chat.last_message_seq = self.seq
+                    self.chat.last_message_id = self.pk
+                    self.chat.last_message_at = now
+                memberships = Membership.objects.db_manager(chats.db).filter(chat_id=self.chat_id)
+                memberships.exclude(
+                    user_id=self.user_id
+                ).update(unread_count=models.F('unread_count') + 1)
+                # Whoever writes has read the chat up to their own message.
+                if self.user_id is not None:
+                    memberships.filter(user_id=self.user_id).read_up_to(self.seq, now)
+                return super().save(*args, **kwargs)
+        messages = Message.objects.db_manager(kwargs.get('using') or self._state.db)
+        with transaction.atomic(using=messages.db):
+            # The message may be moving to another chat.
+            chat_ids = {self.chat_id, *messages.filter(pk=self.pk).values_list('chat_id', flat=True)}
+            chats = Chat.objects.db_manager(messages.db)
+            if len(chat_ids) > 1:
+                # Its seq is taken in the chat it joins.
+                self.seq = chats.allocate_message_seq(self.chat_id)
+            super().save(*args, **kwargs)
+            chats.touch(chat_ids)
+            if len(chat_ids) > 1:
+                chats.refresh_last_message(chat_ids)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or self._state.db
+        with transaction.atomic(using=using):
+            Membership.objects.db_manager(using).filter(
+                chat_id=self.chat_id,
+                last_read_seq__lt=self.seq,
+                unread_count__gt=0
+            ).exclude(
+                user_id=self.user_id
+            ).update(unread_count=models.F('unread_count') - 1)
+            deleted = super().delete(*args, **kwargs)
+            chats = Chat.objects.db_manager(using)
+            chats.touch([self.chat_id])
+            chats.refresh_last_message([self.chat_id])
+            return deleted
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['chat', '-created_at', '-id'],
+                name='message_chat_created_idx'
+            ),
+            models.Index(
+                fields=['user', '-created_at'],
+                name='message_user_created_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['chat', 'seq'],
+                name='message_chat_seq_unique'
+            ),
+        ]
+
+
+class MembershipQuerySet(ShardedQuerySet):
+    def read_up_to(self, seq, now):
+        """
+        Move the read cursors forward to the newest message `seq`, leaving
+        nothing unread.
+        """
+        return self.filter(last_read_seq__lt=seq).update(
+            last_read_seq=seq, last_read_at=now, unread_count=0)
+
+    def rebuild_unread_counts(self):
+        # Own messages never count as unread.
+        unread = Message.objects.filter(
+            chat_id=models.OuterRef('chat_id'),
+            seq__gt=models.OuterRef('last_read_seq')
+        ).exclude(
+            user_id=models.OuterRef('user_id')
+        ).order_by().values('chat_id').annotate(
+            count=models.Count('*')).values('count')
+        return self.update(unread_count=Coalesce(
+            models.Subquery(unread), 0))
+
+
+class Membership(models.Model):
+    chat = models.ForeignKey(
+        Chat,
+        on_delete=models.CASCADE,
+        related_name='memberships'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='memberships',
+        db_constraint=False
+    )
+    last_read_seq = models.PositiveBigIntegerField(
+        default=0
+    )
+    last_read_at = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+    unread_count = models.PositiveIntegerField(
+        default=0
+    )
+
+    objects = MembershipQuerySet.as_manager()
+
+    def __str__(self) -> str:
+        return f'{self.chat_id}:{self.user_id}'
+
+    def mark_read(self, message):
+        return self.mark_read_seq(message.seq, message.created_at)
+
+    def mark_read_seq(self, seq, read_at):
+        """
+        Move the cursor to `seq`, which need not be a live message: the
+        chat's newest may have been archived or deleted.
+        """
+        if seq <= self.last_read_seq:
+            return False
+        memberships = Membership.objects.db_manager(self._state.db)
+        with transaction.atomic(using=memberships.db):
+            read = Message.objects.db_manager(memberships.db).filter(
+                chat_id=self.chat_id,
+                seq__gt=self.last_read_seq,
+                seq__lte=seq
+            ).exclude(user_id=self.user_id).count()
+            updated = memberships.filter(
+                pk=self.pk, last_read_seq=self.last_read_seq
+            ).update(
+                last_read_seq=seq,
+                last_read_at=read_at,
+                unread_count=Greatest(models.F('unread_count') - read, 0)
+            )
+        self.refresh_from_db(
+            fields=['last_read_seq', 'last_read_at', 'unread_count'])
+        return bool(updated)
+
+    class Meta:
+        db_table = 'chats_chat_members'
+        unique_together = [('chat', 'user')]
+
+
+class MessageArchiveSegment(models.Model):
+    """
+    Up to MESSAGE_ARCHIVE['SEGMENT_SIZE'] consecutive old messages of one
+    chat, stored as zlib-compressed JSON; see chats.archive.
+    """
+    chat = models.ForeignKey(
+        Chat,
+        on_delete=models.CASCADE,
+        related_name='archive_segments'
+    )
+    first_seq = models.PositiveBigIntegerField()
+    last_seq = models.PositiveBigIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    def __str__(self) -> str:
+        return f'{self.chat_id}:{self.first_seq}-{self.last_seq}'
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['chat', 'last_created_at'],
+                name='archive_chat_created_idx'
+            ),
+        ]
+
+
+class ArchivedMessage(models.Model):
+    # Only maps archived message ids to their segment, so cursors pointing
+    # into the archive can still be resolved.
+    id = models.UUIDField(
+        primary_key=True
+    )
+    segment = models.ForeignKey(
+        MessageArchiveSegment,
+        on_delete=models.CASCADE,
+        related_name='messages'
+    )
+
+
+class ChatPlacement(models.Model):
+    """
+    The shard of a chat that was moved off the one its id hashes to; kept
+    on the default database (chats.sharding).
+    """
+    chat_id = models.UUIDField(
+        primary_key=True
+    )
+    database = models.CharField(
+        max_length=64
+    )
+    moved_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    def __str__(self) -> str:
+        return f'{self.chat_id}@{self.database}'
@@ -0,0 +1,220 @@
+import uuid
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import access, archive, sharding
+
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset pagination over (chat, created_at, id), newest messages first.
+
+    Pagination is only engaged when the client asks for it with `limit`,
+    `before`, `after` or `around`, so plain list requests keep their shape.
+    Pages cover the chat given with `chat`, and all of the caller's chats
+    otherwise; an anchor only positions the page. Pages of a single chat
+    continue into its archive (chats.archive) once the live table runs out.
+    """
+    default_limit = 50
+    max_limit = 200
+    limit_query_param = 'limit'
+    before_query_param = 'before'
+    after_query_param = 'after'
+    around_query_param = 'around'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        anchor_params = [
+            param for param in (self.before_query_param,
+                                self.after_query_param,
+                                self.around_query_param)
+            if param in request.query_params
+        ]
+        if not anchor_params and self.limit_query_param not in request.query_params:
+            return None
+        if len(anchor_params) > 1:
+            raise ValidationError(
+                {'detail': 'Only one of before, after or around can be used.'})
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.next_id = None
+        self.previous_id = None
+        self.chat_id = getattr(view, 'history_chat_id', None)
+
+        if not anchor_params:
+            return self.paginate_first(queryset)
+
+        param = anchor_params[0]
+        anchor = self.get_anchor(queryset, request.query_params[param])
+        if param == self.before_query_param:
+            return self.paginate_before(queryset, anchor)
+        if param == self.after_query_param:
+            return self.paginate_after(queryset, anchor)
+        return self.paginate_around(queryset, anchor)
+
+    def get_limit(self, request):
+        value = request.query_params.get(self.limit_query_param)
+        if value is None:
+            return self.default_limit
+        try:
+            limit = int(value)
+        except ValueError:
+            raise ValidationError({self.limit_query_param: 'Must be an integer.'})
+        if limit < 1:
+            raise ValidationError({self.limit_query_param: 'Must be positive.'})
+        return min(limit, self.max_limit)
+
+    def get_anchor(self, queryset, value):
+        try:
+            pk = uuid.UUID(value)
+        except ValueError:
+            raise ValidationError({'detail': 'Invalid message id.'})
+        found = [
+            anchor for anchor in sharding.gather(lambda: self.find_anchor(queryset, pk))
+            if anchor is not None
+        ]
+        if not found:
+            raise NotFound('Message not found.')
+        return found[0]
+
+    def find_anchor(self, queryset, pk):
+        anchor = queryset.filter(pk=pk).first()
+        if anchor is None:
+            anchor = archive.get_message(pk, using=queryset.db)
+            if anchor is not None and (
+                    self.chat_id not in (None, anchor.chat_id)
+                    or not access.is_member(self.request.user.pk, anchor.chat_id)):
+                anchor = None
+        return anchor
+
+    def older_than(self, queryset, anchor):
+        # The extra bound on created_at lets SQLite seek into the
+        # (chat, created_at, id) index instead of filtering the OR row by row.
+        return queryset.filter(
+            Q(created_at__lt=anchor.created_at) | Q(id__lt=anchor.id),
+            created_at__lte=anchor.created_at
+        ).order_by('-created_at', '-id')
+
+    def newer_than(self, queryset, anchor):
+        return queryset.filter(
+            Q(created_at__gt=anchor.created_at) | Q(id__gt=anchor.id),
+            created_at__gte=anchor.created_at
+        ).order_by('created_at', 'id')
+
+    def take(self, queryset, limit):
+        rows = list(queryset[:limit + 1])
+        return rows[:limit], len(rows) > limit
+
+    def take_older(self, queryset, anchor, limit):
+        if anchor is None:
+            queryset = queryset.order_by('-created_at', '-id')
+        else:
+            queryset = self.older_than(queryset, anchor)
+        page, has_more = self.take(queryset, limit)
+        if not has_more and self.chat_id is not None:
+            start = page[-1] if page else anchor
+            page += archive.older_than(
+                self.chat_id, start, limit + 1 - len(page), using=queryset.db)
+            page, has_more = page[:limit], len(page) > limit
+        return page, has_more
+
+    def take_newer(self, queryset, anchor, limit):
+        page = []
+        if self.chat_id is not None and getattr(anchor, 'is_archived', False):
+            page = archive.newer_than(
+                anchor.chat_id, anchor, limit + 1, using=queryset.db)
+        if len(page) <= limit:
+            # Everything still in the live table is newer than the archive.
+            page += list(self.newer_than(queryset, anchor)[:limit + 1 - len(page)])
+        return page[:limit], len(page) > limit
+
+    def gather_older(self, queryset, anchor, limit):
+        """
+        take_older() on every shard the request covers, merged.
+        """
+        pages = sharding.gather(lambda: self.take_older(queryset.all(), anchor, limit))
+        page = sharding.merge([page for page, has_more in pages], ['-created_at', '-id'])
+        return page[:limit], len(page) > limit or any(has_more for page, has_more in pages)
+
+    def gather_newer(self, queryset, anchor, limit):
+        pages = sharding.gather(lambda: self.take_newer(queryset.all(), anchor, limit))
+        page = sharding.merge([page for page, has_more in pages], ['created_at', 'id'])
+        return page[:limit], len(page) > limit or any(has_more for page, has_more in pages)
+
+    def paginate_first(self, queryset):
+        page, has_more = self.gather_older(queryset, None, self.limit)
+        if has_more:
+            self.next_id = page[-1].id
+        return page
+
+    def paginate_before(self, queryset, anchor):
+        page, has_more = self.gather_older(queryset, anchor, self.limit)
+        if page:
+            self.previous_id = page[0].id
+            if has_more:
+                self.next_id = page[-1].id
+        else:
+            self.previous_id = anchor.id
+        return page
+
+    def paginate_after(self, queryset, anchor):
+        page, has_more = self.gather_newer(queryset, anchor, self.limit)
+        page.reverse()
+        if page:
+            self.next_id = page[-1].id
+            if has_more:
+                self.previous_id = page[0].id
+        else:
+            self.next_id = anchor.id
+        return page
+
+    def paginate_around(self, queryset, anchor):
+        newer_limit = (self.limit - 1) // 2
+        older_limit = self.limit - 1 - newer_limit
+        newer, has_newer = self.gather_newer(queryset, anchor, newer_limit)
+        older, has_older = self.gather_older(queryset, anchor, older_limit)
+        newer.reverse()
+        page = newer + [anchor] + older
+        if has_newer:
+            self.previous_id = page[0].id
+        if has_older:
+            self.next_id = page[-1].id
+        return page
+
+    def get_link(self, param, message_id):
+        if message_id is None:
+            return None
+        url = self.request.build_absolute_uri()
+        for other in (self.before_query_param, self.after_query_param,
+                      self.around_query_param):
+            url = remove_query_param(url, other)
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, param, str(message_id))
+
+    def get_next_link(self):
+        return self.get_link(self.before_query_param, self.next_id)
+
+    def get_previous_link(self):
+        return self.get_link(self.after_query_param, self.previous_id)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,12 @@
+from rest_framework.permissions import BasePermission
+
+from . import access
+from .models import Chat
+
+
+class IsChatMember(BasePermission):
+    message = 'You are not a member of this chat.'
+
+    def has_object_permission(self, request, view, obj):
+        chat_id = obj.pk if isinstance(obj, Chat) else obj.chat_id
+        return access.is_member(request.user.pk, chat_id)
@@ -0,0 +1,170 @@
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from . import access, sharding
+from .archive import iterate_chat_ids
+from .models import ArchivedMessage, Chat, ChatPlacement, Membership, Message, MessageArchiveSegment
+
+
+def insert(model, objs, using, keep_pk=True):
+    """
+    INSERT the rows as they are, auto_now_add fields included and without
+    signals; return the new primary keys when `keep_pk` is False.
+    """
+    fields = [
+        field for field in model._meta.local_concrete_fields
+        if keep_pk or not field.primary_key
+    ]
+    returning = None if keep_pk else [model._meta.pk]
+    # One row at a time when their keys are wanted back.
+    size = max(connections[using].ops.bulk_batch_size(fields, objs), 1) if keep_pk else 1
+    pks = []
+    for start in range(0, len(objs), size):
+        rows = model._base_manager._insert(
+            objs[start:start + size], fields=fields,
+            returning_fields=returning, raw=True, using=using)
+        pks.extend(row[0] for row in rows or ())
+    return pks
+
+
+def copy_messages(chat_id, source, target, after=0, batch_size=1000):
+    """
+    Copy the chat's live messages with a seq above `after` from `source` to
+    `target` in batches; return the last seq copied.
+    """
+    messages = Message.objects.using(source).filter(chat_id=chat_id).order_by('seq')
+    while True:
+        batch = list(messages.filter(seq__gt=after)[:batch_size])
+        if not batch:
+            return after
+        insert(Message, batch, target)
+        after = batch[-1].seq
+
+
+def copy_archive(chat_id, source, target):
+    for segment in MessageArchiveSegment.objects.using(source).filter(chat_id=chat_id):
+        message_ids = list(segment.messages.values_list('pk', flat=True))
+        segment_id, = insert(MessageArchiveSegment, [segment], target, keep_pk=False)
+        ArchivedMessage.objects.using(target).bulk_create(
+            [ArchivedMessage(id=pk, segment_id=segment_id) for pk in message_ids])
+
+
+def copy_memberships(chat_id, source, target):
+    # Membership ids are per database, so the copies get new ones.
+    insert(Membership, list(Membership.objects.using(source).filter(chat_id=chat_id)),
+           target, keep_pk=False)
+
+
+def delete_in_batches(queryset, batch_size):
+    """
+    DELETE the rows in pk order, `batch_size` at a time and without
+    signals, so each batch holds the write lock only briefly.
+    """
+    queryset = queryset.order_by('pk')
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        queryset.model._base_manager.using(queryset.db).filter(pk__in=pks)._raw_delete(queryset.db)
+
+
+def drop_chat(chat_id, using):
+    """
+    DELETE the chat's row on `using` only, leaving the rest to clear(), so
+    writes routed there fail from now on. Foreign keys must be off, as
+    constraint_checks_disabled() does outside a transaction.
+    """
+    Chat._base_manager.using(using).filter(pk=chat_id)._raw_delete(using)
+
+
+def clear(chat_id, using, batch_size=1000):
+    """
+    Delete the rest of the chat from shard `using` after drop_chat(). No
+    signals are sent, so the membership cache is invalidated here.
+    """
+    memberships = Membership.objects.using(using).filter(chat_id=chat_id)
+    user_ids = list(memberships.values_list('user_id', flat=True))
+    delete_in_batches(memberships, batch_size)
+    access.invalidate(user_ids)
+    delete_in_batches(Message.objects.using(using).filter(chat_id=chat_id), batch_size)
+    delete_in_batches(
+        ArchivedMessage.objects.using(using).filter(segment__chat_id=chat_id), batch_size)
+    delete_in_batches(
+        MessageArchiveSegment.objects.using(using).filter(chat_id=chat_id), batch_size)
+
+
+def move_chat(chat_id, target, batch_size=1000):
+    """
+    Move the chat with its messages, archive and memberships to shard
+    `target` while it stays in use; return the shard it was moved from, or
+    None if it already was on `target`.
+
+    Messages are copied in batches first. Only the rest is copied with the
+    chat locked on its old shard, so writes to it wait for just that long;
+    the chat's row goes with the lock and the rest of it afterwards, a
+    batch at a time. Copies left by an interrupted move are dropped when it
+    is run again. Must not run inside a transaction.
+    """
+    source = sharding.locate(chat_id, refresh=True)
+    if source is None:
+        raise Chat.DoesNotExist(f'Chat {chat_id} does not exist.')
+    if source == target:
+        return None
+    for alias in sharding.get_shards():
+        if alias != source:
+            with connections[alias].constraint_checks_disabled():
+                drop_chat(chat_id, alias)
+            clear(chat_id, alias, batch_size)
+    # Keep lookups on the old shard while both hold the chat.
+    ChatPlacement.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        chat_id=chat_id, defaults={'database': source})
+    sharding.cache.delete(str(chat_id))
+
+    chat = Chat.objects.using(source).get(pk=chat_id)
+    first_version, first_seq = chat.version, chat.last_message_seq
+    chat.last_message_id = None
+    insert(Chat, [chat], target)
+    copied = copy_messages(chat_id, source, target, batch_size=batch_size)
+
+    # Foreign keys off, so the chat's row can go before its messages.
+    with connections[source].constraint_checks_disabled(), transaction.atomic(using=source):
+        # Takes the write lock, so the chat no longer changes on `source`.
+        Chat.objects.db_manager(source).touch([chat_id])
+        chat = Chat.objects.using(source).get(pk=chat_id)
+        with transaction.atomic(using=target):
+            # Each new message bumps the version once; anything else that
+            # happened meanwhile (edits, deletes, archiving) means copying
+            # the messages again.
+            if chat.version - 1 - first_version != chat.last_message_seq - first_seq:
+                Message.objects.using(target).filter(chat_id=chat_id).delete()
+                copied = 0
+            copy_messages(chat_id, source, target, after=copied, batch_size=batch_size)
+            MessageArchiveSegment.objects.using(target).filter(chat_id=chat_id).delete()
+            copy_archive(chat_id, source, target)
+            Membership.objects.using(target).filter(chat_id=chat_id).delete()
+            copy_memberships(chat_id, source, target)
+            Chat.objects.using(target).filter(pk=chat_id).update(**{
+                field.attname: getattr(chat, field.attname)
+                for field in Chat._meta.concrete_fields if not field.primary_key
+            })
+        ChatPlacement.objects.using(DEFAULT_DB_ALIAS).filter(
+            chat_id=chat_id).update(database=target)
+        drop_chat(chat_id, source)
+    if target == sharding.hash_shard(chat_id):
+        ChatPlacement.objects.using(DEFAULT_DB_ALIAS).filter(chat_id=chat_id).delete()
+    sharding.cache.delete(str(chat_id))
+    clear(chat_id, source, batch_size)
+    return source
+
+
+def misplaced(using):
+    """
+    Ids of the chats on shard `using` that hash to another one and were not
+    moved there on purpose, such as after a shard was added.
+    """
+    shards = sharding.get_shards()
+    for chat_id in iterate_chat_ids(using):
+        if sharding.hash_shard(chat_id, shards) == using:
+            continue
+        if not ChatPlacement.objects.using(DEFAULT_DB_ALIAS).filter(
+                chat_id=chat_id, database=using).exists():
+            yield chat_id
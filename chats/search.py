@@ -0,0 +1,192 @@
+import base64
+import binascii
+
+from django.db import connections, transaction
+
+SEARCH_TABLE = 'chats_message_search'
+ROWID_TABLE = 'chats_message_search_rowid'
+MAX_ROWID = 2 ** 63 - 1
+
+# FTS5 needs a stable integer rowid; chats_message is keyed by UUID and its
+# implicit rowids are renumbered by VACUUM and table rebuilds, so the rowids
+# handed to FTS5 live in their own table.
+CREATE_TABLES = [
+    f'CREATE TABLE IF NOT EXISTS {ROWID_TABLE} ('
+    'rowid INTEGER PRIMARY KEY, message_id char(32) NOT NULL UNIQUE)',
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+    "text, chat_id UNINDEXED, message_id UNINDEXED, "
+    "tokenize='unicode61 remove_diacritics 2')",
+]
+
+DROP_TABLES = [
+    f'DROP TABLE IF EXISTS {SEARCH_TABLE}',
+    f'DROP TABLE IF EXISTS {ROWID_TABLE}',
+]
+
+ROWID_OF = f'(SELECT rowid FROM {ROWID_TABLE} WHERE message_id = {{}}.id)'
+
+CREATE_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert
+    AFTER INSERT ON chats_message BEGIN
+        INSERT INTO {ROWID_TABLE} (message_id) VALUES (new.id);
+        INSERT INTO {SEARCH_TABLE} (rowid, text, chat_id, message_id)
+        VALUES ({ROWID_OF.format('new')}, new.text, new.chat_id, new.id);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update
+    AFTER UPDATE OF text, chat_id ON chats_message BEGIN
+        UPDATE {SEARCH_TABLE} SET text = new.text, chat_id = new.chat_id
+        WHERE rowid = {ROWID_OF.format('old')};
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete
+    AFTER DELETE ON chats_message BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = {ROWID_OF.format('old')};
+        DELETE FROM {ROWID_TABLE} WHERE message_id = old.id;
+    END''',
+]
+
+DROP_TRIGGERS = [
+    f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{event}'
+    for event in ('insert', 'update', 'delete')
+]
+
+
+def is_supported(connection):
+    return connection.vendor == 'sqlite'
+
+
+def execute_all(cursor, statements):
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def install(connection):
+    """
+    Create the search tables and the triggers keeping them in sync.
+
+    Django rebuilds SQLite tables for most schema changes, which drops their
+    triggers, so migrations altering chats_message must call this again.
+    """
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        execute_all(cursor, CREATE_TABLES)
+        execute_all(cursor, CREATE_TRIGGERS)
+
+
+def uninstall(connection):
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        execute_all(cursor, DROP_TRIGGERS)
+        execute_all(cursor, DROP_TABLES)
+
+
+def rebuild(using='default', batch_size=10000, progress=None):
+    connection = connections[using]
+    if not is_supported(connection):
+        return 0
+    uninstall(connection)
+    with connection.cursor() as cursor:
+        execute_all(cursor, CREATE_TABLES)
+    total = 0
+    last_rowid = 0
+    while True:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid, id, text, chat_id FROM chats_message '
+                'WHERE rowid > %s ORDER BY rowid LIMIT %s',
+                [last_rowid, batch_size])
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany(
+                f'INSERT OR IGNORE INTO {ROWID_TABLE} (message_id) VALUES (%s)',
+                [(row[1],) for row in rows])
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, text, chat_id, message_id) '
+                f'SELECT r.rowid, m.text, m.chat_id, m.id FROM chats_message m '
+                f'JOIN {ROWID_TABLE} r ON r.message_id = m.id '
+                'WHERE m.rowid > %s AND m.rowid <= %s',
+                [last_rowid, rows[-1][0]])
+        last_rowid = rows[-1][0]
+        total += len(rows)
+        if progress is not None:
+            progress(total)
+    install(connection)
+    return total
+
+
+def to_match_expression(query):
+    terms = ['"{}"'.format(term.replace('"', '""')) for term in query.split()]
+    return ' '.join(terms)
+
+
+def encode_cursor(rank, position, rowid):
+    return base64.urlsafe_b64encode(f'{rank!r}:{position}:{rowid}'.encode()).decode()
+
+
+def decode_cursor(value):
+    try:
+        rank, position, rowid = base64.urlsafe_b64decode(value.encode()).decode().split(':')
+        return float(rank), int(position), int(rowid)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor.')
+
+
+def fetch_matches(expression, user_id, limit, after=None, using='default'):
+    """
+    (rank, rowid, message id) of up to `limit` matches in one database,
+    best first, after the (rank, rowid) pair `after`.
+    """
+    sql = (
+        f'SELECT s.rank, s.rowid, s.message_id FROM {SEARCH_TABLE} s '
+        f'WHERE {SEARCH_TABLE} MATCH %s AND s.chat_id IN ('
+        'SELECT chat_id FROM chats_chat_members WHERE user_id = %s)'
+    )
+    params = [expression, user_id.hex]
+    if after is not None:
+        rank, rowid = after
+        sql += ' AND (s.rank > %s OR (s.rank = %s AND s.rowid > %s))'
+        params += [rank, rank, rowid]
+    sql += ' ORDER BY s.rank, s.rowid LIMIT %s'
+    params.append(limit)
+    with connections[using].cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        return db_cursor.fetchall()
+
+
+def search_message_ids(user_id, query, limit, cursor=None, shards=('default',)):
+    """
+    Return ([(database, message id)], next cursor) for the best bm25 matches
+    of `query` in the chats `user_id` belongs to, `limit` at a time.
+
+    Every shard in `shards` is searched and the matches merged by rank, then
+    shard, then rowid. Ranks are computed per shard, so they are only
+    comparable as far as the shards hold similar messages.
+    """
+    expression = to_match_expression(query)
+    if not expression:
+        return [], None
+    if cursor is not None:
+        rank, cursor_position, cursor_rowid = decode_cursor(cursor)
+    rows = []
+    for position, alias in enumerate(shards):
+        after = None
+        if cursor is not None:
+            # Matches ranked equal to the cursor come after it only on
+            # later shards, or past its rowid on its own shard.
+            if position == cursor_position:
+                after = (rank, cursor_rowid)
+            else:
+                after = (rank, -1 if position > cursor_position else MAX_ROWID)
+        rows += [
+            (match_rank, position, rowid, message_id, alias)
+            for match_rank, rowid, message_id
+            in fetch_matches(expression, user_id, limit + 1, after, alias)
+        ]
+    rows.sort()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*rows[-1][:3])
+    return [(row[4], row[3]) for row in rows], next_cursor
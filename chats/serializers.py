@@ -1,23 +1,276 @@
-from rest_framework import serializers
+from operator import attrgetter
 
-from .models import Message, Chat
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import PKOnlyObject
+from rest_framework.settings import api_settings
+
+from users.thumbnails import thumbnail_urls_builder
+
+from . import sharding
+from .models import Message, Chat, Membership
+
+User = get_user_model()
+
+RELATED_CHUNK = 500
+
+
+class ChatField(serializers.PrimaryKeyRelatedField):
+    """
+    Looks the chat up on its own shard, not on the one the request is
+    bound to.
+    """
+
+    def to_internal_value(self, data):
+        if not sharding.is_sharded():
+            return super().to_internal_value(data)
+        alias = sharding.locate(data)
+        if alias is None:
+            self.fail('does_not_exist', pk_value=data)
+        with sharding.use_shard(alias):
+            return super().to_internal_value(data)
 
 
 class MessageSerializer(serializers.ModelSerializer):
+    chat = ChatField(queryset=Chat.objects.all())
+
     class Meta:
         model = Message
         fields = '__all__'
         read_only_fields = ('id', 'created_at', 'is_read')
 
 
+class BatchMessageSerializer(serializers.Serializer):
+    """
+    One message of a batch send; the chat is only checked against the
+    caller's memberships, for the whole batch at once.
+    """
+    chat = serializers.UUIDField()
+    text = serializers.CharField()
+
+
+class MemberIdsField(serializers.ManyRelatedField):
+    """
+    Member ids read from the chat's memberships alone, which share its
+    shard, where `chat.members` would join them to the users table.
+    """
+
+    def get_attribute(self, instance):
+        if instance.pk is None:
+            return []
+        return [
+            PKOnlyObject(pk=user_id) for user_id in
+            instance.memberships.order_by('user_id').values_list('user_id', flat=True)
+        ]
+
+
 class ChatSerializer(serializers.ModelSerializer):
+    members = MemberIdsField(child_relation=serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.all()))
+    avatar_thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Chat
-        fields = '__all__'
+        exclude = ('avatar_hash', 'last_message', 'version', 'modified_at')
         read_only_fields = ('id', 'created_at', 'admin')
 
+    @cached_property
+    def build_thumbnail_urls(self):
+        return thumbnail_urls_builder(self.context.get('request'))
+
+    def get_avatar_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj.avatar_hash)
+
     def validate_members(self, value):
         if len(value) < 2:
             raise serializers.ValidationError(
                 'Chat should have at least two members')
         return value
+
+    def set_members(self, chat, users):
+        # Unlike chat.members.set(), add() and remove() only touch the
+        # memberships, not the users table on another database.
+        user_ids = {user.pk for user in users}
+        current = set(chat.memberships.values_list('user_id', flat=True))
+        if current - user_ids:
+            chat.members.remove(*(current - user_ids))
+        if user_ids - current:
+            chat.members.add(*(user_ids - current))
+
+    def create(self, validated_data):
+        members = validated_data.pop('members')
+        chat = super().create(validated_data)
+        self.set_members(chat, members)
+        return chat
+
+    def update(self, instance, validated_data):
+        members = validated_data.pop('members', None)
+        chat = super().update(instance, validated_data)
+        if members is not None:
+            self.set_members(chat, members)
+        return chat
+
+
+class MembershipSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Membership
+        fields = ('chat', 'user', 'last_read_seq', 'last_read_at', 'unread_count')
+        read_only_fields = fields
+
+
+class InboxChatSerializer(ChatSerializer):
+    members = None
+
+    class Meta(ChatSerializer.Meta):
+        exclude = ChatSerializer.Meta.exclude + ('members',)
+
+
+class InboxSerializer(serializers.ModelSerializer):
+    chat = InboxChatSerializer()
+    last_message = MessageSerializer(source='chat.last_message', allow_null=True)
+
+    class Meta:
+        model = Membership
+        fields = ('chat', 'last_message', 'unread_count', 'last_read_seq', 'last_read_at')
+        read_only_fields = fields
+
+
+class Row:
+    """
+    Attribute access to a `.values()` row, standing in for the instance
+    in SerializerMethodFields.
+    """
+
+
+def none_or(attname, convert):
+    def get(row):
+        value = getattr(row, attname)
+        return None if value is None else convert(value)
+    return get
+
+
+class ValuesListSerializer:
+    """
+    Read-only `serializer_class(queryset, many=True).data` for large lists.
+
+    Rows come from `.values()` instead of model instances and every field
+    is turned into a converter once, up front. Only the field types these
+    serializers use are supported; anything else raises TypeError when the
+    converters are built.
+    """
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+        self.model = serializer.Meta.model
+        self.request = serializer.context.get('request')
+        self.related = {}
+        self.fields = [
+            (field.field_name, self.compile(field))
+            for field in serializer.fields.values()
+            if not field.write_only
+        ]
+
+    def compile(self, field):
+        if isinstance(field, serializers.SerializerMethodField):
+            return getattr(self.serializer, field.method_name)
+        if isinstance(field, serializers.ManyRelatedField):
+            return self.compile_many(field)
+        model_field = self.model._meta.get_field(field.source)
+        attname = model_field.attname
+        if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+            return attrgetter(attname)
+        if isinstance(field, serializers.UUIDField):
+            if field.uuid_format == 'hex_verbose':
+                return none_or(attname, str)
+            return none_or(attname, field.to_representation)
+        if isinstance(field, serializers.DateTimeField):
+            return none_or(attname, self.datetime_iso(field))
+        if isinstance(field, serializers.FileField):
+            return none_or(attname, self.file_url(field, model_field))
+        if type(field) in (serializers.CharField, serializers.BooleanField,
+                           serializers.IntegerField):
+            return attrgetter(attname)
+        raise TypeError(f'{type(field).__name__} {field.field_name!r} is not supported.')
+
+    def compile_many(self, field):
+        if not isinstance(field.child_relation, serializers.PrimaryKeyRelatedField):
+            raise TypeError(f'{field.field_name!r} must be a list of primary keys.')
+        name = field.field_name
+        self.related[name] = {}
+        pk = self.model._meta.pk.attname
+
+        def get(row):
+            return self.related[name].get(getattr(row, pk), [])
+        return get
+
+    def datetime_iso(self, field):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if output_format is None or output_format.lower() != ISO_8601:
+            return field.to_representation
+        # DateTimeField looks the current timezone up again for every value.
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if field_timezone is None:
+            return field.to_representation
+
+        def convert(value):
+            if value.tzinfo is None:
+                return field.to_representation(value)
+            value = value.astimezone(field_timezone).isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return convert
+
+    def file_url(self, field, model_field):
+        if not getattr(field, 'use_url', True):
+            return lambda name: name or None
+        storage = model_field.storage
+        request = self.request
+
+        def url(name):
+            if not name:
+                return None
+            if request is not None:
+                return request.build_absolute_uri(storage.url(name))
+            return storage.url(name)
+        return url
+
+    def load_related(self, pks, using):
+        for name in self.related:
+            many_field = self.model._meta.get_field(self.serializer.fields[name].source)
+            through = many_field.remote_field.through
+            source = through._meta.get_field(many_field.m2m_field_name()).attname
+            target = through._meta.get_field(many_field.m2m_reverse_field_name()).attname
+            related = self.related[name]
+            # Chunked to stay under SQLite's limit on query parameters.
+            for start in range(0, len(pks), RELATED_CHUNK):
+                # The related manager reads the (chat, user) unique index,
+                # so its rows come in this order too.
+                links = through.objects.using(using).filter(
+                    **{f'{source}__in': pks[start:start + RELATED_CHUNK]}
+                ).order_by(source, target).values_list(source, target)
+                for pk, target_pk in links:
+                    related.setdefault(pk, []).append(target_pk)
+
+    def read(self, queryset):
+        """
+        The rows of `queryset`, with their related ids loaded for render().
+        """
+        attnames = [field.attname for field in self.model._meta.concrete_fields]
+        rows = []
+        for values in queryset.values(*attnames):
+            row = Row()
+            row.__dict__ = values
+            rows.append(row)
+        if self.related and rows:
+            pk = self.model._meta.pk.attname
+            self.load_related([getattr(row, pk) for row in rows], queryset.db)
+        return rows
+
+    def render(self, rows):
+        fields = self.fields
+        return [{name: get(row) for name, get in fields} for row in rows]
+
+    def to_representation(self, queryset):
+        return self.render(self.read(queryset))
@@ -0,0 +1,173 @@
+import contextvars
+import hashlib
+import uuid
+from contextlib import contextmanager
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from users.authentication import LRUCache
+
+from .models import ArchivedMessage, Chat, ChatPlacement, Message
+
+shard = contextvars.ContextVar('shard', default=None)
+
+
+def get_setting(name, default):
+    return getattr(settings, 'SHARDING', {}).get(name, default)
+
+
+def get_shards():
+    return get_setting('DATABASES', [DEFAULT_DB_ALIAS])
+
+
+def is_sharded():
+    return len(get_shards()) > 1
+
+
+def hash_shard(chat_id, shards=None):
+    """
+    The shard a chat is placed on unless it was moved. Rendezvous hashing,
+    so adding a shard only takes the chats that now score highest on it.
+    """
+    key = uuid.UUID(str(chat_id)).bytes
+    return max(shards or get_shards(), key=lambda alias: hashlib.blake2b(
+        key, key=alias.encode(), digest_size=8).digest())
+
+
+cache = LRUCache(get_setting('PLACEMENT_CACHE_SIZE', 100000), get_setting('PLACEMENT_TTL', 5))
+
+
+def find(chat_id):
+    shards = get_shards()
+    placed = ChatPlacement.objects.using(DEFAULT_DB_ALIAS).filter(
+        chat_id=chat_id).values_list('database', flat=True).first()
+    # Chats not moved yet after a shard was added are still found.
+    for alias in dict.fromkeys([placed, hash_shard(chat_id, shards), *shards]):
+        if alias in shards and Chat.objects.using(alias).filter(pk=chat_id).exists():
+            return alias
+    return None
+
+
+def locate(chat_id, refresh=False):
+    """
+    The alias of the shard holding chat `chat_id`, or None if none does.
+
+    Lookups are cached per process; other processes notice a move within
+    SHARDING['PLACEMENT_TTL'] seconds.
+    """
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+    try:
+        chat_id = uuid.UUID(str(chat_id))
+    except ValueError:
+        return None
+    key = str(chat_id)
+    alias = None if refresh else cache.get(key)
+    if alias is None:
+        generation = cache.generation
+        alias = find(chat_id)
+        if alias is not None:
+            cache.set(key, alias, generation=generation)
+    return alias
+
+
+def locate_message(message_id):
+    """
+    The alias of the shard holding message `message_id`, live or archived,
+    or None if none does.
+    """
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+    try:
+        message_id = uuid.UUID(str(message_id))
+    except ValueError:
+        return None
+    for alias in get_shards():
+        if (Message.objects.using(alias).filter(pk=message_id).exists()
+                or ArchivedMessage.objects.using(alias).filter(pk=message_id).exists()):
+            return alias
+    return None
+
+
+@contextmanager
+def use_shard(alias):
+    """
+    Route the chats app's queries in the block to `alias`.
+    """
+    token = shard.set(alias)
+    try:
+        yield alias
+    finally:
+        shard.reset(token)
+
+
+def gather(func):
+    """
+    [func()] run on the shard the request is bound to, or on every shard in
+    turn when it is bound to none.
+    """
+    if not is_sharded() or shard.get() is not None:
+        return [func()]
+    results = []
+    for alias in get_shards():
+        with use_shard(alias):
+            results.append(func())
+    return results
+
+
+def merge(lists, ordering):
+    """
+    Join the per-shard `lists` from gather(), each sorted by `ordering`
+    (field names, '-' for descending), into one list sorted the same way.
+    """
+    if len(lists) == 1:
+        return lists[0]
+    rows = [row for rows in lists for row in rows]
+    for name in reversed(ordering):
+        rows.sort(key=attrgetter(name.lstrip('-')), reverse=name.startswith('-'))
+    return rows
+
+
+class ShardRouter:
+    """
+    Sends the chats app's tables to the shard of the chat in hand: that of
+    the instance in the hints, else the one the request is bound to. Other
+    apps and ChatPlacement stay on the default database.
+
+    With a single shard it has no opinion and later routers decide.
+    """
+
+    def db_for_chat(self, model, hints):
+        if model._meta.app_label != 'chats' or model is ChatPlacement or not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._meta.app_label == 'chats':
+            # New rows go by their chat: assigning a user to one already
+            # set its database to the user's.
+            if not instance._state.adding:
+                return instance._state.db
+            if isinstance(instance, Chat):
+                return hash_shard(instance.pk)
+            chat_id = getattr(instance, 'chat_id', None)
+            if chat_id is not None:
+                return locate(chat_id) or hash_shard(chat_id)
+            if instance._state.db is not None:
+                return instance._state.db
+        if model is Chat and 'pk' in hints:
+            return locate(hints['pk'])
+        return shard.get()
+
+    def db_for_read(self, model, **hints):
+        return self.db_for_chat(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_chat(model, hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not is_sharded() or db not in get_shards():
+            return None
+        if app_label == 'chats' and model_name != 'chatplacement':
+            return True
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,125 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.thumbnails import avatar_replaced, remember_avatar, schedule, thumbnails_ready
+
+from . import access, sharding
+from .brokers import get_broker
+from .models import Chat, Membership, Message
+from .serializers import MessageSerializer
+
+User = get_user_model()
+
+
+@receiver(m2m_changed, sender=Chat.members.through)
+def count_unread_for_new_members(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    memberships = Membership.objects.using(using)
+    if reverse:
+        memberships = memberships.filter(user=instance, chat_id__in=pk_set)
+    else:
+        memberships = memberships.filter(chat=instance, user_id__in=pk_set)
+    memberships.rebuild_unread_counts()
+
+
+@receiver(m2m_changed, sender=Chat.members.through)
+def publish_membership(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    verb = 'add' if action == 'post_add' else 'remove'
+    if reverse:
+        events = [
+            {'type': 'membership', 'action': verb,
+             'chat': str(chat_id), 'users': [str(instance.pk)]}
+            for chat_id in pk_set
+        ]
+    else:
+        events = [{
+            'type': 'membership', 'action': verb,
+            'chat': str(instance.pk), 'users': [str(pk) for pk in pk_set],
+        }]
+    broker = get_broker()
+    for event in events:
+        transaction.on_commit(lambda event=event: broker.publish(event), using=using)
+
+
+@receiver(post_save, sender=Message)
+def publish_message(sender, instance, created, using, **kwargs):
+    if not created:
+        return
+    event = {
+        'type': 'message',
+        'chat': str(instance.chat_id),
+        'message': MessageSerializer(instance).data,
+    }
+    transaction.on_commit(lambda: get_broker().publish(event), using=using)
+
+
+@receiver(post_init, sender=Chat)
+def remember_loaded_avatar(sender, instance, **kwargs):
+    remember_avatar(instance)
+
+
+@receiver(post_save, sender=Chat)
+def make_avatar_thumbnails(sender, instance, created, update_fields, **kwargs):
+    if avatar_replaced(instance, created, update_fields):
+        schedule(instance)
+
+
+@receiver(post_save, sender=Chat)
+def touch_saved_chat(sender, instance, using, **kwargs):
+    Chat.objects.db_manager(using).touch([instance.pk])
+
+
+@receiver(thumbnails_ready, sender=Chat)
+def touch_chat_with_thumbnails(sender, pk, **kwargs):
+    Chat.objects.db_manager(sharding.locate(pk)).touch([pk])
+
+
+@receiver(m2m_changed, sender=Chat.members.through)
+def touch_chats_on_membership(sender, instance, action, reverse, pk_set, using, **kwargs):
+    chats = Chat.objects.db_manager(using)
+    if action in ('post_add', 'post_remove') and pk_set:
+        chats.touch(pk_set if reverse else [instance.pk])
+    elif action == 'pre_clear' and reverse:
+        chats.touch(Membership.objects.using(using).filter(
+            user=instance).values('chat_id'))
+    elif action == 'post_clear' and not reverse:
+        chats.touch([instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def touch_chats_of_deleted_user(sender, instance, using, **kwargs):
+    # Their memberships go and their messages and chats lose the author.
+    for alias in sharding.get_shards():
+        chats = Chat.objects.db_manager(alias)
+        chats.touch(chats.filter(
+            Q(memberships__user=instance) | Q(admin=instance)).values('pk'))
+        chats.touch(Message.objects.using(alias).filter(
+            user=instance).order_by().values('chat_id'))
+        if alias != using:
+            # Deleting the user only cascades on its own database.
+            Membership.objects.using(alias).filter(user=instance).delete()
+            Message.objects.using(alias).filter(user=instance).update(user=None)
+            chats.filter(admin=instance).update(admin=None)
+
+
+@receiver(m2m_changed, sender=Chat.members.through)
+def invalidate_memberships(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action in ('post_add', 'post_remove') and pk_set:
+        access.invalidate([instance.pk] if reverse else pk_set)
+    elif action == 'pre_clear' and not reverse:
+        access.invalidate(Membership.objects.using(using).filter(
+            chat=instance).values_list('user_id', flat=True))
+    elif action == 'post_clear' and reverse:
+        access.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def invalidate_membership(sender, instance, using, **kwargs):
+    access.invalidate([instance.user_id])
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import math
+import uuid
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from users.authentication import CachedJWTAuthentication
+
+from . import sharding
+from .brokers import encode_event
+from .models import Membership, Message
+from .serializers import MessageSerializer
+from .websocket import get_hub
+
+MAX_MESSAGES = 100
+
+
+def get_setting(name, default):
+    return getattr(settings, 'REALTIME', {}).get(name, default)
+
+
+class Waiter:
+    __slots__ = ('user_id', 'chat_ids', 'events', 'wakeup', 'overflowed', 'closed')
+
+    def __init__(self, user_id, chat_ids):
+        self.user_id = user_id
+        self.chat_ids = chat_ids
+        self.events = deque()
+        self.wakeup = asyncio.Event()
+        self.overflowed = False
+        self.closed = False
+
+    def push(self, data, max_pending):
+        if len(self.events) < max_pending:
+            self.events.append(data)
+        else:
+            self.overflowed = True
+        self.wakeup.set()
+
+
+class RequestError(Exception):
+    def __init__(self, status, detail):
+        self.status = status
+        self.detail = detail
+
+
+def error(status, detail):
+    return JsonResponse({'detail': detail}, status=status)
+
+
+@sync_to_async
+def authenticate(request):
+    try:
+        result = CachedJWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed) as exc:
+        detail = exc.detail
+        if isinstance(detail, dict):
+            detail = detail.get('detail')
+        return None, None, str(detail)
+    if result is None:
+        return None, None, 'Authentication credentials were not provided.'
+    user = result[0]
+    chat_ids = Membership.objects.filter(user=user).values_list('chat_id', flat=True)
+    chat_ids = set(
+        str(chat_id) for rows in sharding.gather(lambda: list(chat_ids.all()))
+        for chat_id in rows)
+    return user, chat_ids, None
+
+
+@sync_to_async
+def get_cursor(user, value):
+    messages = Message.objects.filter(chat__memberships__user=user)
+    if value is None:
+        newest = sharding.gather(lambda: messages.order_by('-created_at', '-id').only(
+            'id', 'created_at').first())
+        return max((message for message in newest if message is not None),
+                   key=lambda message: (message.created_at, message.id), default=None)
+    try:
+        pk = uuid.UUID(value)
+    except ValueError:
+        raise RequestError(400, 'Invalid message id.')
+    found = sharding.gather(lambda: messages.filter(pk=pk).only('id', 'created_at').first())
+    cursor = next((message for message in found if message is not None), None)
+    if cursor is None:
+        raise RequestError(404, 'Message not found.')
+    return cursor
+
+
+@sync_to_async
+def get_messages_after(user, cursor):
+    messages = Message.objects.filter(chat__memberships__user=user)
+    if cursor is not None:
+        messages = messages.filter(
+            Q(created_at__gt=cursor.created_at) | Q(id__gt=cursor.id),
+            created_at__gte=cursor.created_at
+        )
+    messages = messages.order_by('created_at', 'id')[:MAX_MESSAGES]
+    messages = sharding.merge(
+        sharding.gather(lambda: list(messages.all())), ['created_at', 'id'])[:MAX_MESSAGES]
+    if messages:
+        cursor = messages[-1]
+    return MessageSerializer(messages, many=True).data, cursor
+
+
+def get_timeout(request, name, default):
+    limit = get_setting(name, default)
+    value = request.GET.get('timeout')
+    if value is None:
+        return limit
+    try:
+        timeout = float(value)
+    except ValueError:
+        timeout = math.nan
+    if not math.isfinite(timeout) or timeout <= 0:
+        raise RequestError(400, 'Invalid timeout.')
+    return min(timeout, limit)
+
+
+async def open_waiter(request):
+    user, chat_ids, detail = await authenticate(request)
+    if user is None:
+        raise RequestError(401, detail)
+    value = request.GET.get('after') or request.headers.get('Last-Event-ID')
+    # Register before reading the cursor so nothing committed in between
+    # is missed.
+    waiter = Waiter(str(user.pk), chat_ids)
+    hub = get_hub()
+    hub.add(waiter)
+    try:
+        cursor = await get_cursor(user, value)
+    except RequestError:
+        hub.remove(waiter)
+        raise
+    return user, waiter, cursor
+
+
+async def poll_messages(request):
+    """
+    Long-poll for messages newer than `after` in any of the caller's chats.
+
+    Waits on the realtime hub without a thread or a database connection,
+    and answers with an empty list when `timeout` seconds pass.
+    """
+    if request.method != 'GET':
+        return error(405, f'Method "{request.method}" not allowed.')
+    try:
+        timeout = get_timeout(request, 'LONG_POLL_TIMEOUT', 25)
+        user, waiter, cursor = await open_waiter(request)
+    except RequestError as exc:
+        return error(exc.status, exc.detail)
+
+    hub = get_hub()
+    try:
+        results, next_cursor = await get_messages_after(user, cursor)
+        if not results:
+            try:
+                await asyncio.wait_for(waiter.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                results, next_cursor = await get_messages_after(user, cursor)
+    finally:
+        hub.remove(waiter)
+
+    return JsonResponse({
+        'cursor': next_cursor and str(next_cursor.id),
+        'results': results,
+    }, encoder=JSONEncoder)
+
+
+def format_event(event_id, data):
+    return f'id: {event_id}\nevent: message\ndata: {data}\n\n'
+
+
+async def stream_messages(request):
+    """
+    Server-Sent Events stream of new messages in the caller's chats.
+
+    Replays messages after `after` (or the Last-Event-ID header), then
+    relays events from the realtime hub until SSE_MAX_DURATION passes and
+    the client reconnects with its last event id.
+    """
+    if request.method != 'GET':
+        return error(405, f'Method "{request.method}" not allowed.')
+    try:
+        timeout = get_timeout(request, 'SSE_MAX_DURATION', 300)
+        user, waiter, cursor = await open_waiter(request)
+    except RequestError as exc:
+        return error(exc.status, exc.detail)
+
+    async def events():
+        hub = get_hub()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        heartbeat = get_setting('SSE_HEARTBEAT', 15)
+        try:
+            replayed = set()
+            position = cursor
+            while True:
+                messages, position = await get_messages_after(user, position)
+                for message in messages:
+                    replayed.add(message['id'])
+                    yield format_event(message['id'], encode_event({
+                        'type': 'message', 'chat': message['chat'], 'message': message,
+                    }))
+                if len(messages) < MAX_MESSAGES:
+                    break
+            while not waiter.overflowed:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(
+                        waiter.wakeup.wait(), min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                waiter.wakeup.clear()
+                while waiter.events:
+                    data = waiter.events.popleft()
+                    event = json.loads(data)
+                    if event['type'] == 'message':
+                        if event['message']['id'] not in replayed:
+                            yield format_event(event['message']['id'], data)
+                        continue
+                    # A batch send: one event per message, so the last
+                    # event id is that of the last message.
+                    for message in event['messages']:
+                        if message['id'] not in replayed:
+                            yield format_event(message['id'], encode_event({
+                                'type': 'message', 'chat': event['chat'], 'message': message,
+                            }))
+        finally:
+            hub.remove(waiter)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
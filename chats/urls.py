@@ -2,6 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
 from .views import MessageViewSet, ChatViewSet
+from .streaming import poll_messages, stream_messages
 
 router = DefaultRouter()
 router.register(r'messages', MessageViewSet, basename='message')
@@ -9,5 +10,7 @@ router.register(r'chats', ChatViewSet, basename='chat')
 
 
 urlpatterns = [
+    path('messages/poll/', poll_messages, name='message-poll'),
+    path('messages/stream/', stream_messages, name='message-stream'),
     path('', include(router.urls)),
 ]
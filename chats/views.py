@@ -1,42 +1,417 @@
+import logging
+import uuid
+
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework import status
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.renderers import BrowsableAPIRenderer
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed
 from django.shortcuts import get_object_or_404
-from .models import Message, Chat
-from .serializers import MessageSerializer, ChatSerializer
+from django.utils import timezone
+from application.replicas import ReplicaReadsMixin
+from .models import Message, Chat, Membership
+from .pagination import MessageKeysetPagination
+from . import access, conditional, ingest, search, sharding
+from .permissions import IsChatMember
+from .renderers import FastJSONRenderer
+from .serializers import (
+    MessageSerializer, BatchMessageSerializer, ChatSerializer, InboxSerializer,
+    MembershipSerializer, ValuesListSerializer)
 from users.serializers import UserSerializer, User
 
+logger = logging.getLogger(__name__)
+
+
+def member_chat_ids(user):
+    return Membership.objects.filter(user=user).values('chat_id')
+
+
+class ShardRoutingMixin:
+    """
+    Binds each request to the shard of the chat it is about, so the chats
+    app's queries go there (chats.sharding). Requests about no chat in
+    particular read every shard through sharding.gather().
+    """
+    shard_token = None
+
+    def get_request_shard(self):
+        return None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if sharding.is_sharded():
+            alias = self.get_request_shard()
+            if alias is not None:
+                self.shard_token = sharding.shard.set(alias)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            # Also when the view raised: a thread serves other requests.
+            if self.shard_token is not None:
+                sharding.shard.reset(self.shard_token)
+                self.shard_token = None
+
+
+class ConditionalListMixin:
+    """
+    Answers list requests with 304 when the version stamps of the chats
+    behind the list have not moved, before the queryset runs.
+    """
+
+    def get_stamped_chats(self):
+        """
+        The chats the list is drawn from, and whether that is a single chat.
+        """
+        return Chat.objects.filter(pk__in=member_chat_ids(self.request.user)), False
+
+    def list(self, request, *args, **kwargs):
+        chats, single = self.get_stamped_chats()
+        etag, last_modified = conditional.get_validators(request, chats, single)
+        response = conditional.get_not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            conditional.set_validators(response, etag, last_modified)
+        return response
+
 
-class MessageViewSet(viewsets.ModelViewSet):
+class ValuesListMixin:
+    """
+    Unpaginated lists are built from `.values()` rows and rendered with
+    orjson; see ValuesListSerializer.
+    """
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+
+    def list_response(self, queryset):
+        serializer = ValuesListSerializer(self.get_serializer())
+        rows = sharding.merge(
+            sharding.gather(lambda: serializer.read(queryset)),
+            queryset.query.order_by or queryset.model._meta.ordering)
+        return Response(serializer.render(rows))
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return self.list_response(queryset)
+
+
+class MessageViewSet(ReplicaReadsMixin, ShardRoutingMixin, ConditionalListMixin,
+                     ValuesListMixin, viewsets.ModelViewSet):
+    """
+    Lists only cover the caller's chats. Single messages are checked
+    against the cached membership set (chats.access) instead.
+    """
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
-    permission_classes = (IsAuthenticated,)
+    permission_classes = (IsAuthenticated, IsChatMember)
+    pagination_class = MessageKeysetPagination
+    history_chat_id = None
+
+    def get_request_shard(self):
+        if 'pk' in self.kwargs:
+            return sharding.locate_message(self.kwargs['pk'])
+        params = self.request.query_params
+        if 'chat' in params:
+            return sharding.locate(params['chat'])
+        data = self.request.data
+        chat = data.get('chat') if isinstance(data, dict) else None
+        return None if chat is None else sharding.locate(chat)
+
+    def get_chat_param(self):
+        chat = self.request.query_params.get('chat')
+        if chat is None:
+            return None
+        try:
+            chat = uuid.UUID(chat)
+        except ValueError:
+            raise ValidationError({'chat': 'Invalid chat id.'})
+        if not access.is_member(self.request.user.pk, chat):
+            raise PermissionDenied(IsChatMember.message)
+        return chat
+
+    def get_queryset(self):
+        messages = super().get_queryset()
+        if self.action != 'list':
+            return messages
+        chat = self.get_chat_param()
+        if chat is None:
+            return messages.filter(chat_id__in=member_chat_ids(self.request.user))
+        self.history_chat_id = chat
+        return messages.filter(chat_id=chat)
+
+    def get_stamped_chats(self):
+        chat = self.get_chat_param()
+        if chat is None:
+            return super().get_stamped_chats()
+        return Chat.objects.filter(pk=chat), True
+
+    def check_chat(self, serializer):
+        chat = serializer.validated_data.get('chat')
+        if chat is not None and not access.is_member(self.request.user.pk, chat.pk):
+            raise PermissionDenied(IsChatMember.message)
+
+    def perform_create(self, serializer):
+        self.check_chat(serializer)
+        serializer.instance = ingest.create_message(**serializer.validated_data)
+
+    def perform_update(self, serializer):
+        self.check_chat(serializer)
+        chat = serializer.validated_data.get('chat')
+        if chat is not None and chat._state.db != serializer.instance._state.db:
+            # Its id, seq and archive entries all live on the chat's shard.
+            raise ValidationError(
+                {'chat': 'Messages cannot be moved to a chat on another shard.'})
+        super().perform_update(serializer)
+
+    def get_batch_error(self, error):
+        if isinstance(error, (Chat.DoesNotExist, IntegrityError)):
+            return {'status': status.HTTP_404_NOT_FOUND, 'errors': {'chat': 'Chat not found.'}}
+        if isinstance(error, OperationalError):
+            return {'status': status.HTTP_503_SERVICE_UNAVAILABLE,
+                    'errors': {'detail': 'Database busy, try again.'}}
+        logger.error('Batch message not saved', exc_info=error)
+        return {'status': status.HTTP_500_INTERNAL_SERVER_ERROR,
+                'errors': {'detail': 'Message not saved.'}}
+
+    @action(methods=['POST'], detail=False, url_path='batch')
+    def create_batch(self, request):
+        """
+        Post up to MESSAGE_INGEST['BATCH_SEND_MAX'] messages to any of the
+        caller's chats: one membership check, one transaction per shard and
+        one event per chat for all of them. Results follow the order of
+        `messages`; 207 unless every message was created.
+        """
+        items = request.data.get('messages') if isinstance(request.data, dict) else None
+        limit = ingest.get_setting('BATCH_SEND_MAX', 500)
+        if not isinstance(items, list) or not items:
+            raise ValidationError({'messages': 'Expected a non-empty list of messages.'})
+        if len(items) > limit:
+            raise ValidationError({'messages': f'At most {limit} messages per batch.'})
+
+        results = [None] * len(items)
+        valid = {}
+        for index, item in enumerate(items):
+            serializer = BatchMessageSerializer(data=item)
+            if serializer.is_valid():
+                valid[index] = serializer.validated_data
+            else:
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+
+        chat_ids = access.get_chat_ids(request.user.pk)
+        if any(data['chat'] not in chat_ids for data in valid.values()):
+            chat_ids = access.get_chat_ids(request.user.pk, refresh=True)
+        by_shard = {}
+        for index, data in valid.items():
+            alias = sharding.locate(data['chat']) if data['chat'] in chat_ids else None
+            if alias is None:
+                results[index] = {'status': status.HTTP_403_FORBIDDEN,
+                                  'errors': {'chat': IsChatMember.message}}
+                continue
+            message = Message(chat_id=data['chat'], user_id=request.user.pk, text=data['text'])
+            by_shard.setdefault(alias, []).append((index, message))
+
+        for alias, entries in by_shard.items():
+            messages = [message for index, message in entries]
+            errors = ingest.write_batch(messages, alias)
+            created = [message for message, error in zip(messages, errors) if error is None]
+            ingest.publish_messages(created, alias)
+            data = iter(MessageSerializer(created, many=True).data)
+            for (index, message), error in zip(entries, errors):
+                if error is None:
+                    results[index] = {'status': status.HTTP_201_CREATED, 'message': next(data)}
+                else:
+                    results[index] = self.get_batch_error(error)
+
+        succeeded = all(result['status'] == status.HTTP_201_CREATED for result in results)
+        return Response(
+            {'results': results},
+            status=status.HTTP_201_CREATED if succeeded else status.HTTP_207_MULTI_STATUS)
 
     @action(methods=['GET'], detail=False, url_path='unread')
     def get_unread_messages(self, request):
         messages = Message.objects.filter(
-            chat__members=request.user, is_read=False)
-        serializer = self.get_serializer(messages, many=True)
-        return Response(serializer.data)
+            chat__memberships__user=request.user,
+            seq__gt=F('chat__memberships__last_read_seq')
+        ).exclude(user_id=request.user.pk)
+        return self.list_response(messages)
 
+    @action(methods=['GET'], detail=False)
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'No query parameter provided'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        limit = self.paginator.get_limit(request)
+        try:
+            matches, next_cursor = search.search_message_ids(
+                request.user.pk, query, limit,
+                cursor=request.query_params.get('cursor'),
+                shards=sharding.get_shards())
+        except ValueError:
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+        ids = [uuid.UUID(pk) for alias, pk in matches]
+        messages = {}
+        for alias in dict.fromkeys(alias for alias, pk in matches):
+            messages.update(Message.objects.using(alias).in_bulk(
+                [uuid.UUID(pk) for other, pk in matches if other == alias]))
+        serializer = self.get_serializer(
+            [messages[pk] for pk in ids if pk in messages], many=True)
+        next_link = None
+        if next_cursor is not None:
+            next_link = replace_query_param(
+                request.build_absolute_uri(), 'cursor', next_cursor)
+        return Response({'next': next_link, 'results': serializer.data})
 
-class ChatViewSet(viewsets.ModelViewSet):
+    @action(methods=['GET'], detail=False, url_path='unread/summary')
+    def get_unread_summary(self, request):
+        counters = Membership.objects.filter(
+            user=request.user, unread_count__gt=0
+        ).values_list('chat_id', 'unread_count')
+        chats = [
+            {'chat': chat_id, 'unread_count': unread_count}
+            for rows in sharding.gather(lambda: list(counters.all()))
+            for chat_id, unread_count in rows
+        ]
+        return Response({
+            'total': sum(chat['unread_count'] for chat in chats),
+            'chats': chats,
+        })
+
+
+class ChatViewSet(ReplicaReadsMixin, ShardRoutingMixin, ConditionalListMixin,
+                  ValuesListMixin, viewsets.ModelViewSet):
+    """
+    Lists only cover the caller's chats. Single chats are checked against
+    the cached membership set (chats.access) instead.
+    """
     queryset = Chat.objects.all()
     serializer_class = ChatSerializer
-    permission_classes = (IsAuthenticated,)
+    permission_classes = (IsAuthenticated, IsChatMember)
 
     def get_permissions(self):
         return super().get_permissions()
 
-    @action(methods=['PATCH'], detail=True)
-    def add_members(self, request, pk):
-        chat = get_object_or_404(Chat, pk=pk)
-        members = request.data.get('members')
+    def get_request_shard(self):
+        if 'pk' in self.kwargs:
+            return sharding.locate(self.kwargs['pk'])
+        return None
+
+    def get_queryset(self):
+        chats = super().get_queryset()
+        if self.action == 'list':
+            return chats.filter(pk__in=member_chat_ids(self.request.user))
+        return chats
+
+    def resolve_members(self, request):
+        if hasattr(request.data, 'getlist'):
+            members = request.data.getlist('members')
+        else:
+            members = request.data.get('members')
         if not isinstance(members, (list, tuple)):
-            members = [members]
+            members = [] if members is None else [members]
+
+        requested = {}
         for member_id in members:
-            member = get_object_or_404(User, id=member_id)
-            chat.members.add(member)
-        return Response({'flag': 'ok'}, status=status.HTTP_201_CREATED)
+            if not isinstance(member_id, (str, int)):
+                raise ValidationError({'members': 'Member ids must be strings or integers.'})
+            try:
+                requested[uuid.UUID(str(member_id))] = member_id
+            except ValueError:
+                requested[member_id] = member_id
+        found = set(User.objects.filter(
+            id__in=[pk for pk in requested if isinstance(pk, uuid.UUID)]
+        ).values_list('id', flat=True))
+        missing = [str(requested[pk]) for pk in requested if pk not in found]
+        if not found:
+            raise NotFound({'detail': 'No users found.', 'missing': missing})
+        return found, missing
+
+    @action(methods=['GET'], detail=False)
+    def inbox(self, request):
+        memberships = Membership.objects.filter(
+            user=request.user
+        ).select_related('chat__last_message').annotate(
+            activity=Coalesce('chat__last_message_at', 'chat__created_at')
+        ).order_by('-activity', '-chat_id')
+        memberships = sharding.merge(
+            sharding.gather(lambda: list(memberships.all())), ['-activity', '-chat_id'])
+        serializer = InboxSerializer(
+            memberships, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+
+    @action(methods=['PATCH'], detail=True)
+    def add_members(self, request, pk):
+        chat = self.get_object()
+        found, missing = self.resolve_members(request)
+        with transaction.atomic(using=chat._state.db):
+            existing = set(Membership.objects.filter(
+                chat=chat, user_id__in=found).values_list('user_id', flat=True))
+            added = found - existing
+            Membership.objects.bulk_create(
+                [Membership(chat=chat, user_id=user_id) for user_id in added],
+                ignore_conflicts=True
+            )
+            if added:
+                m2m_changed.send(
+                    sender=Chat.members.through, instance=chat, action='post_add',
+                    reverse=False, model=User, pk_set=added, using=chat._state.db)
+        return Response({
+            'flag': 'ok',
+            'added': sorted(str(user_id) for user_id in added),
+            'missing': missing,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(methods=['PATCH'], detail=True)
+    def remove_members(self, request, pk):
+        chat = self.get_object()
+        found, missing = self.resolve_members(request)
+        with transaction.atomic(using=chat._state.db):
+            removed = set(Membership.objects.filter(
+                chat=chat, user_id__in=found).values_list('user_id', flat=True))
+            if removed:
+                chat.members.remove(*removed)
+        return Response({
+            'flag': 'ok',
+            'removed': sorted(str(user_id) for user_id in removed),
+            'missing': missing,
+        }, status=status.HTTP_200_OK)
+
+    @action(methods=['POST'], detail=True, url_path='read')
+    def mark_read(self, request, pk):
+        chat = self.get_object()
+        membership = Membership.objects.filter(
+            chat=chat, user=request.user).first()
+        if membership is None:
+            raise PermissionDenied('You are not a member of this chat.')
+
+        message_id = request.data.get('message')
+        if message_id is not None:
+            try:
+                message_id = uuid.UUID(str(message_id))
+            except ValueError:
+                raise ValidationError({'message': 'Invalid message id.'})
+            message = get_object_or_404(Message, pk=message_id, chat=chat)
+        else:
+            message = Message.objects.filter(
+                chat=chat, seq=chat.last_message_seq).first()
+
+        if message is not None:
+            membership.mark_read(message)
+        elif message_id is None:
+            # The newest message is archived or deleted; its seq still counts.
+            membership.mark_read_seq(chat.last_message_seq, timezone.now())
+        serializer = MembershipSerializer(membership)
+        return Response(serializer.data)
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from users.authentication import CachedJWTAuthentication
+
+from . import sharding
+from .brokers import get_broker
+from .models import Membership
+
+logger = logging.getLogger(__name__)
+
+WEBSOCKET_PATH = '/ws/chats/'
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_TOO_SLOW = 4408
+
+
+def get_max_pending():
+    return getattr(settings, 'REALTIME', {}).get('MAX_PENDING_MESSAGES', 100)
+
+
+class Connection:
+    __slots__ = ('user_id', 'chat_ids', 'send', 'pending', 'flushing', 'closed')
+
+    def __init__(self, user_id, chat_ids, send):
+        self.user_id = user_id
+        self.chat_ids = chat_ids
+        self.send = send
+        self.pending = None
+        self.flushing = False
+        self.closed = False
+
+    def push(self, text, max_pending):
+        if self.closed:
+            return
+        if self.pending is None:
+            self.pending = deque()
+        if len(self.pending) >= max_pending:
+            # A client that cannot keep up is disconnected instead of
+            # buffering without bound; it catches up through the REST API.
+            self.pending = None
+            self.closed = True
+            asyncio.ensure_future(self.send(
+                {'type': 'websocket.close', 'code': CLOSE_TOO_SLOW}))
+            return
+        self.pending.append(text)
+        if not self.flushing:
+            self.flushing = True
+            asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        try:
+            while self.pending and not self.closed:
+                await self.send(
+                    {'type': 'websocket.send', 'text': self.pending.popleft()})
+        except Exception:
+            logger.debug('Failed to send to websocket of %s', self.user_id)
+            self.closed = True
+        finally:
+            self.flushing = False
+            if not self.pending:
+                # Idle connections keep no buffer at all.
+                self.pending = None
+
+
+class ConnectionHub:
+    """
+    Per-process registry of websocket connections, indexed by chat.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.by_chat = {}
+        self.by_user = {}
+        self.max_pending = get_max_pending()
+        broker.subscribe(self.on_event)
+
+    def close(self):
+        self.broker.unsubscribe(self.on_event)
+
+    def add(self, connection):
+        self.by_user.setdefault(connection.user_id, set()).add(connection)
+        for chat_id in connection.chat_ids:
+            self.by_chat.setdefault(chat_id, set()).add(connection)
+
+    def remove(self, connection):
+        connection.closed = True
+        self.discard(self.by_user, connection.user_id, connection)
+        for chat_id in connection.chat_ids:
+            self.discard(self.by_chat, chat_id, connection)
+
+    def discard(self, index, key, connection):
+        connections = index.get(key)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del index[key]
+
+    def on_event(self, data):
+        event = json.loads(data)
+        if event['type'] in ('message', 'messages'):
+            for connection in list(self.by_chat.get(event['chat'], ())):
+                connection.push(data, self.max_pending)
+        elif event['type'] == 'membership':
+            self.on_membership(event)
+
+    def on_membership(self, event):
+        chat_id = event['chat']
+        for user_id in event['users']:
+            for connection in self.by_user.get(user_id, ()):
+                if event['action'] == 'add':
+                    connection.chat_ids.add(chat_id)
+                    self.by_chat.setdefault(chat_id, set()).add(connection)
+                else:
+                    connection.chat_ids.discard(chat_id)
+                    self.discard(self.by_chat, chat_id, connection)
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def get_hub():
+    """
+    The hub of the running event loop. Under WSGI every async_to_sync call
+    runs on a loop of its own, so the hubs of loops closed since are
+    dropped and unsubscribed from the broker.
+    """
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        with _hubs_lock:
+            for closed in [other for other in _hubs if other.is_closed()]:
+                _hubs.pop(closed).close()
+            hub = _hubs[loop] = ConnectionHub(get_broker())
+    return hub
+
+
+def get_raw_token(scope):
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][0].encode()
+    header_types = settings.SIMPLE_JWT.get('AUTH_HEADER_TYPES', ('Bearer',))
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            parts = value.split()
+            if len(parts) == 2 and parts[0].decode() in header_types:
+                return parts[1]
+    return None
+
+
+@sync_to_async
+def authenticate(raw_token):
+    close_old_connections()
+    try:
+        authentication = CachedJWTAuthentication()
+        user = authentication.get_user(
+            authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None, None
+    chat_ids = Membership.objects.filter(user=user).values_list('chat_id', flat=True)
+    chat_ids = set(
+        str(chat_id) for rows in sharding.gather(lambda: list(chat_ids.all()))
+        for chat_id in rows)
+    return str(user.pk), chat_ids
+
+
+async def websocket_application(scope, receive, send):
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if scope['path'] != WEBSOCKET_PATH:
+        await send({'type': 'websocket.close'})
+        return
+
+    raw_token = get_raw_token(scope)
+    user_id, chat_ids = await authenticate(raw_token) if raw_token else (None, None)
+    if user_id is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+
+    await send({'type': 'websocket.accept'})
+    hub = get_hub()
+    connection = Connection(user_id, chat_ids, send)
+    hub.add(connection)
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+    finally:
+        hub.remove(connection)
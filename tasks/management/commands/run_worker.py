@@ -0,0 +1,44 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tasks.worker import Worker, run_pool
+
+
+def get_setting(name, default):
+    return getattr(settings, 'TASKS', {}).get(name, default)
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=get_setting('PROCESSES', 2))
+        parser.add_argument('--batch-size', type=int, default=get_setting('BATCH_SIZE', 10))
+        parser.add_argument(
+            '--poll-interval', type=float, default=get_setting('POLL_INTERVAL', 1.0))
+        parser.add_argument(
+            '--burst', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        worker_options = {
+            'batch_size': options['batch_size'],
+            'poll_interval': options['poll_interval'],
+            'burst': options['burst'],
+        }
+        if options['processes'] > 1:
+            self.stdout.write(f'Starting {options["processes"]} workers')
+            run_pool(options['processes'], **worker_options)
+            return
+        worker = Worker(**worker_options)
+        previous = {
+            signum: signal.signal(signum, lambda signum, frame: worker.stop_event.set())
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        try:
+            total = worker.run()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(f'Ran {total} jobs')
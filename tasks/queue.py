@@ -0,0 +1,143 @@
+import random
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Subquery
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+
+def get_setting(name, default):
+    return getattr(settings, 'TASKS', {}).get(name, default)
+
+
+def get_task_path(task):
+    if isinstance(task, str):
+        return task
+    return f'{task.__module__}.{task.__qualname__}'
+
+
+def build_job(task, args=(), kwargs=None, priority=0, delay=0, max_attempts=None):
+    return Job(
+        task=get_task_path(task),
+        args=list(args),
+        kwargs=kwargs or {},
+        priority=priority,
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or get_setting('MAX_ATTEMPTS', 5),
+    )
+
+
+def enqueue(task, args=(), kwargs=None, priority=0, delay=0, max_attempts=None, using=None):
+    """
+    Queue `task` (a function or its dotted path) to run in a worker.
+
+    The job is a row in the current transaction, so it only becomes
+    visible to workers once that commits. Higher priorities run first.
+    """
+    job = build_job(task, args, kwargs, priority, delay, max_attempts)
+    job.save(using=using)
+    return job
+
+
+def enqueue_many(jobs, batch_size=1000, using=None):
+    """
+    Queue several (task, args, kwargs) tuples with default options at once.
+    """
+    return Job.objects.using(using).bulk_create(
+        [build_job(*job) for job in jobs], batch_size=batch_size)
+
+
+def claim(worker, limit=1, using=None):
+    """
+    Lock up to `limit` due jobs for `worker`, highest priority first.
+
+    The single UPDATE both picks and locks the rows, so concurrent workers
+    never get the same job. Locked jobs reappear once the visibility
+    timeout passes without an ack.
+    """
+    now = timezone.now()
+    token = f'{worker}:{uuid.uuid4().hex[:12]}'
+    jobs = Job.objects.using(using)
+    ready = jobs.filter(
+        status=Job.QUEUED, run_at__lte=now
+    ).order_by('-priority', 'run_at', 'id').values('pk')[:limit]
+    with transaction.atomic(using=using):
+        claimed = jobs.filter(pk__in=Subquery(ready), status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            locked_by=token,
+            locked_until=now + timedelta(seconds=get_setting('VISIBILITY_TIMEOUT', 300)),
+            attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            return token, []
+        claimed_jobs = list(jobs.filter(status=Job.RUNNING, locked_by=token).order_by(
+            '-priority', 'run_at', 'id'))
+    return token, claimed_jobs
+
+
+def complete(job_ids, token, using=None):
+    if job_ids:
+        Job.objects.using(using).filter(pk__in=job_ids, locked_by=token).delete()
+
+
+def get_backoff(attempts):
+    base = get_setting('RETRY_BACKOFF', 5)
+    delay = min(base * 2 ** (attempts - 1), get_setting('RETRY_BACKOFF_MAX', 3600))
+    # Jitter keeps jobs that failed together from retrying in lockstep.
+    return delay * random.uniform(0.8, 1.2)
+
+
+def fail(job, token, error, using=None):
+    jobs = Job.objects.using(using).filter(pk=job.pk, locked_by=token)
+    if job.attempts >= job.max_attempts:
+        return jobs.update(
+            status=Job.FAILED, locked_by=None, locked_until=None, last_error=error)
+    return jobs.update(
+        status=Job.QUEUED,
+        locked_by=None,
+        locked_until=None,
+        run_at=timezone.now() + timedelta(seconds=get_backoff(job.attempts)),
+        last_error=error,
+    )
+
+
+def release_expired(using=None):
+    """
+    Requeue running jobs whose worker died or overran the visibility
+    timeout, or fail them once they have no attempts left.
+    """
+    expired = Job.objects.using(using).filter(
+        status=Job.RUNNING, locked_until__lte=timezone.now())
+    failed = expired.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, locked_by=None, locked_until=None,
+        last_error='Visibility timeout expired.')
+    requeued = expired.update(status=Job.QUEUED, locked_by=None, locked_until=None)
+    return requeued, failed
+
+
+def run_job(job):
+    func = import_string(job.task)
+    return func(*job.args, **job.kwargs)
+
+
+def process_batch(worker, limit=1, using=None):
+    """
+    Claim, run and acknowledge one batch of jobs; return how many ran.
+    """
+    token, jobs = claim(worker, limit, using)
+    done = []
+    for job in jobs:
+        try:
+            run_job(job)
+        except Exception:
+            fail(job, token, traceback.format_exc(), using)
+        else:
+            done.append(job.pk)
+    complete(done, token, using)
+    return len(jobs)
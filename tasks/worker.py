@@ -0,0 +1,109 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.db import OperationalError, close_old_connections, connections
+
+from . import queue
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = 30
+
+
+class Worker:
+    def __init__(self, batch_size=10, poll_interval=1.0, burst=False, stop_event=None):
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.stop_event = stop_event or multiprocessing.Event()
+        self.next_sweep = 0
+
+    def sweep(self):
+        if time.monotonic() < self.next_sweep:
+            return
+        requeued, failed = queue.release_expired()
+        if requeued or failed:
+            logger.warning('Released %s expired jobs, %s failed', requeued, failed)
+        self.next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def run(self):
+        """
+        Process jobs until stopped, or until the queue is empty in burst
+        mode. Returns the number of jobs run.
+        """
+        total = 0
+        while not self.stop_event.is_set():
+            try:
+                self.sweep()
+                count = queue.process_batch(self.name, self.batch_size)
+            except OperationalError:
+                # Most likely SQLite's write lock held by another worker.
+                logger.warning('Claiming jobs failed', exc_info=True)
+                count = 0
+            finally:
+                close_old_connections()
+            total += count
+            if count == 0:
+                if self.burst:
+                    break
+                self.stop_event.wait(self.poll_interval)
+        return total
+
+
+def run_worker(options, stop_event):
+    # Leave shutdown to the supervisor, which sets `stop_event`.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    Worker(stop_event=stop_event, **options).run()
+
+
+def run_pool(processes, **options):
+    """
+    Run `processes` forked workers, restarting any that die, until SIGINT
+    or SIGTERM, or until all of them exit in burst mode.
+    """
+    context = multiprocessing.get_context('fork')
+    stop_event = context.Event()
+    burst = options.get('burst', False)
+
+    def stop(signum, frame):
+        stop_event.set()
+
+    previous = {
+        signum: signal.signal(signum, stop)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+
+    def start():
+        process = context.Process(
+            target=run_worker, args=(options, stop_event), daemon=True)
+        process.start()
+        return process
+
+    # Children must not inherit open database connections.
+    connections.close_all()
+    workers = [start() for _ in range(processes)]
+    try:
+        while workers:
+            for process in list(workers):
+                process.join(timeout=0.5 / len(workers))
+                if process.is_alive():
+                    continue
+                workers.remove(process)
+                if process.exitcode != 0:
+                    logger.error('Worker %s exited with %s', process.pid, process.exitcode)
+                    if not stop_event.is_set():
+                        workers.append(start())
+                elif not burst and not stop_event.is_set():
+                    workers.append(start())
+    finally:
+        stop_event.set()
+        for process in workers:
+            process.join()
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
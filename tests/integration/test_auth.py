@@ -1,8 +1,12 @@
 from rest_framework.reverse import reverse
-from django.test import TestCase
+from unittest import mock
+
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from users.hashers import HashingPool
 from users.models import User
 
 
@@ -43,6 +47,42 @@ class AuthenticationTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['detail'], 'Logged out successfully.')
 
+    def test_logout_revokes_access_token(self):
+        user = User.objects.create_user(**self.user_data)
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        url = reverse('user-current-user')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(self.logout_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_revokes_refresh_token(self):
+        user = User.objects.create_user(**self.user_data)
+        refresh = RefreshToken.for_user(user)
+        response = self.client.post(self.logout_url, {'refresh': str(refresh)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh}')
+        response = self.client.get(reverse('user-current-user'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_invalid_refresh_token(self):
+        response = self.client.post(self.logout_url, {'refresh': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_other_tokens_stay_valid_after_logout(self):
+        user = User.objects.create_user(**self.user_data)
+        revoked = RefreshToken.for_user(user).access_token
+        other = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {revoked}')
+        self.client.post(self.logout_url)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {other}')
+        response = self.client.get(reverse('user-current-user'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_obtain_jwt_token_valid_credentials(self):
         User.objects.create_user(**self.user_data)
 
@@ -105,3 +145,87 @@ class AuthenticationTests(TestCase):
         }
         response = self.client.post(self.login_url, data=login_data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(PASSWORD_HASHING={'ITERATIONS': 1000})
+class AsyncAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user_data = {
+            'email': 'test@example.com',
+            'password': 'testpassword',
+            'first_name': 'John',
+            'last_name': 'Doe',
+        }
+
+    def test_registration(self):
+        response = self.client.post(reverse('async-register'), data=self.user_data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('access', response.json())
+        user = User.objects.get(email='test@example.com')
+        self.assertTrue(user.check_password('testpassword'))
+
+    def test_registration_invalid(self):
+        self.user_data.pop('email')
+        response = self.client.post(reverse('async-register'), data=self.user_data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('email', response.json())
+
+    def test_login(self):
+        User.objects.create_user(**self.user_data)
+        response = self.client.post(reverse('async-login'), data={
+            'email': 'test@example.com', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('refresh', response.json())
+
+    def test_login_json(self):
+        User.objects.create_user(**self.user_data)
+        response = self.client.post(reverse('async-login'), data={
+            'email': 'test@example.com', 'password': 'testpassword'},
+            content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_login_invalid_password(self):
+        User.objects.create_user(**self.user_data)
+        response = self.client.post(reverse('async-login'), data={
+            'email': 'test@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_login_unknown_email(self):
+        response = self.client.post(reverse('async-login'), data={
+            'email': 'nobody@example.com', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_login_upgrades_hash(self):
+        with override_settings(PASSWORD_HASHING={'ITERATIONS': 2000}):
+            User.objects.create_user(**self.user_data)
+        response = self.client.post(reverse('async-login'), data={
+            'email': 'test@example.com', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user = User.objects.get(email='test@example.com')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_obtain(self):
+        User.objects.create_user(**self.user_data)
+        response = self.client.post(reverse('async-obtain'), data={
+            'email': 'test@example.com', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('async-obtain'), data={
+            'email': 'test@example.com', 'password': 'wrong'})
+        self.assertEqual(response.json(), {'error': 'Invalid credentials'})
+
+    def test_get_not_allowed(self):
+        response = self.client.get(reverse('async-login'))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_overloaded(self):
+        pool = HashingPool(max_workers=1, max_queue=0)
+        pool.admit()
+        with mock.patch('users.async_views.get_pool', return_value=pool), \
+                mock.patch('users.views.get_pool', return_value=pool):
+            response = self.client.post(reverse('async-login'), data={
+                'email': 'test@example.com', 'password': 'testpassword'})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '1')
+            response = self.client.post(reverse('login'), data={
+                'email': 'test@example.com', 'password': 'testpassword'})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -1,9 +1,18 @@
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase, APIClient
 from django.contrib.auth import get_user_model
-from chats.models import Chat, Message
-from chats.serializers import MessageSerializer
+from chats import access, archive
+from chats.models import ArchivedMessage, Chat, Message, Membership, MessageArchiveSegment
+from chats.serializers import ChatSerializer, MessageSerializer
 
 User = get_user_model()
 
@@ -116,6 +125,8 @@ class MessageViewSetTestCase(APITestCase):
         )
         self.user = User.objects.create_user(
             email='testuser@kek.ru', password='testpass')
+        Membership.objects.create(
+            chat=self.chat, user=self.user, last_read_seq=self.message.seq)
         self.client.force_authenticate(user=self.user)
 
     def test_get_all_messages(self):
@@ -147,7 +158,7 @@ class MessageViewSetTestCase(APITestCase):
         chat.save()
         message = Message.objects.create(
             text='Unread message',
-            user=self.user,
+            user=new_user,
             chat=chat
         )
         self.message.save()
@@ -187,3 +198,843 @@ class MessageViewSetTestCase(APITestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Message.objects.count(), 0)
+
+
+class ValuesListTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(email='user1@top.com', password='password1')
+        self.user2 = User.objects.create_user(email='user2@top.com', password='password2')
+        self.user3 = User.objects.create_user(email='user3@top.com', password='password3')
+        self.chat = Chat.objects.create(title='Чат \u2028 "quoted"', admin=self.user1)
+        self.chat.members.add(self.user3, self.user1, self.user2)
+        self.other = Chat.objects.create(title='Other', is_private=True)
+        self.other.members.add(self.user2, self.user1)
+        Chat.objects.filter(pk=self.other.pk).update(
+            avatar='avatars/other.png', avatar_hash='0123456789abcdef0123')
+        Message.objects.create(text='Привет 👋', user=self.user1, chat=self.chat)
+        Message.objects.create(text='tab\tnew\nline \x01', user=None, chat=self.chat)
+        Message.objects.create(text='', user=self.user2, chat=self.other)
+        self.client.force_authenticate(user=self.user1)
+
+    def render(self, serializer_class, queryset, response):
+        serializer = serializer_class(
+            queryset, many=True, context={'request': response.wsgi_request})
+        return JSONRenderer().render(serializer.data)
+
+    def test_chat_list_matches_serializer(self):
+        response = self.client.get(reverse('chat-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.content, self.render(ChatSerializer, Chat.objects.all(), response))
+        self.assertIn('http://testserver/media/avatars/other.png', response.json()[0]['avatar'])
+
+    def test_message_list_matches_serializer(self):
+        response = self.client.get(reverse('message-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.content, self.render(MessageSerializer, Message.objects.all(), response))
+        self.assertEqual(len(response.json()), 3)
+
+    def test_chat_filter_matches_serializer(self):
+        response = self.client.get(reverse('message-list'), {'chat': self.chat.pk})
+        messages = Message.objects.filter(chat=self.chat)
+        self.assertEqual(response.content, self.render(MessageSerializer, messages, response))
+
+    def test_empty_list(self):
+        Message.objects.all().delete()
+        response = self.client.get(reverse('message-list'))
+        self.assertEqual(response.content, b'[]')
+
+    def test_browsable_api(self):
+        response = self.client.get(reverse('chat-list'), HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, 'Other')
+
+
+class MembershipScopeTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='member@top.com', password='password1')
+        self.stranger = User.objects.create_user(email='stranger@top.com', password='password2')
+        self.chat = Chat.objects.create(title='Mine')
+        self.chat.members.add(self.user, self.stranger)
+        self.foreign = Chat.objects.create(title='Foreign')
+        self.foreign.members.add(self.stranger)
+        self.message = Message.objects.create(text='Mine', chat=self.chat)
+        self.foreign_message = Message.objects.create(text='Foreign', chat=self.foreign)
+        self.client.force_authenticate(user=self.user)
+
+    def test_lists_are_scoped(self):
+        response = self.client.get(reverse('chat-list'))
+        self.assertEqual([chat['title'] for chat in response.data], ['Mine'])
+        response = self.client.get(reverse('message-list'))
+        self.assertEqual([message['text'] for message in response.data], ['Mine'])
+        response = self.client.get(reverse('message-list'), {'limit': 10})
+        self.assertEqual([message['text'] for message in response.data['results']], ['Mine'])
+
+    def test_foreign_chat(self):
+        for method, url in (
+                ('get', reverse('chat-detail', args=[self.foreign.pk])),
+                ('patch', reverse('chat-detail', args=[self.foreign.pk])),
+                ('delete', reverse('chat-detail', args=[self.foreign.pk])),
+                ('patch', reverse('chat-add-members', args=[self.foreign.pk])),
+                ('post', reverse('chat-mark-read', args=[self.foreign.pk]))):
+            response = getattr(self.client, method)(url, {'members': [str(self.user.pk)]})
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN, url)
+        self.assertFalse(self.foreign.members.filter(pk=self.user.pk).exists())
+        self.assertTrue(Chat.objects.filter(pk=self.foreign.pk).exists())
+
+    def test_foreign_messages(self):
+        url = reverse('message-detail', args=[self.foreign_message.pk])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(
+            self.client.patch(url, {'text': 'Hijacked'}).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.foreign_message.refresh_from_db()
+        self.assertEqual(self.foreign_message.text, 'Foreign')
+        response = self.client.get(reverse('message-list'), {'chat': self.foreign.pk})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_posting_to_foreign_chat(self):
+        response = self.client.post(
+            reverse('message-list'), {'text': 'Hi', 'chat': self.foreign.pk})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.patch(
+            reverse('message-detail', args=[self.message.pk]), {'chat': self.foreign.pk})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Message.objects.filter(chat=self.foreign).count(), 1)
+
+    def test_checks_use_the_membership_cache(self):
+        url = reverse('message-detail', args=[self.message.pk])
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_removed_member_loses_access(self):
+        url = reverse('chat-detail', args=[self.chat.pk])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.chat.members.remove(self.user)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_foreign_archived_anchor(self):
+        Message.objects.filter(pk=self.foreign_message.pk).update(
+            created_at=timezone.now() - timedelta(days=400))
+        archive.archive_messages()
+        response = self.client.get(
+            reverse('message-list'), {'before': self.foreign_message.pk})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ConditionalListTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(email='user1@top.com', password='password1')
+        self.user2 = User.objects.create_user(email='user2@top.com', password='password2')
+        self.chat = Chat.objects.create(title='Chat', admin=self.user1)
+        self.chat.members.add(self.user1, self.user2)
+        self.other = Chat.objects.create(title='Other')
+        self.other.members.add(self.user1)
+        self.message = Message.objects.create(text='Hi', user=self.user1, chat=self.chat)
+        self.client.force_authenticate(user=self.user1)
+
+    def get(self, url, params=None, **headers):
+        return self.client.get(url, params, **headers)
+
+    def assertNotModified(self, url, params=None):
+        response = self.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            cached = self.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(cached.content, b'')
+        return response['ETag']
+
+    def assertChanged(self, url, etag, params=None):
+        response = self.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_headers(self):
+        response = self.get(reverse('chat-list'))
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertIn('Authorization', response['Vary'])
+        self.assertIn('Accept', response['Vary'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotIn('Last-Modified', response)
+
+    def test_chat_list(self):
+        url = reverse('chat-list')
+        etag = self.assertNotModified(url)
+        self.chat.title = 'Renamed'
+        self.chat.save()
+        self.assertChanged(url, etag)
+
+    def test_chat_list_after_delete(self):
+        url = reverse('chat-list')
+        etag = self.assertNotModified(url)
+        self.other.delete()
+        self.assertChanged(url, etag)
+
+    def test_chat_list_after_membership_change(self):
+        url = reverse('chat-list')
+        etag = self.assertNotModified(url)
+        self.client.patch(
+            reverse('chat-remove-members', args=[self.chat.pk]),
+            {'members': [str(self.user2.pk)]}, format='json')
+        self.assertChanged(url, etag)
+
+    def test_message_list(self):
+        url = reverse('message-list')
+        etag = self.assertNotModified(url)
+        Message.objects.create(text='New', user=self.user2, chat=self.chat)
+        self.assertChanged(url, etag)
+        etag = self.assertNotModified(url)
+        self.client.patch(reverse('message-detail', args=[self.message.pk]), {'text': 'Edited'})
+        self.assertChanged(url, etag)
+        etag = self.assertNotModified(url)
+        self.message.delete()
+        self.assertChanged(url, etag)
+
+    def test_message_list_of_chat(self):
+        url = reverse('message-list')
+        params = {'chat': self.chat.pk}
+        etag = self.assertNotModified(url, params)
+        Message.objects.create(text='Elsewhere', chat=self.other)
+        self.assertEqual(
+            self.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code,
+            status.HTTP_304_NOT_MODIFIED)
+        Message.objects.create(text='Here', chat=self.chat)
+        self.assertChanged(url, etag, params)
+
+    def test_message_list_of_chat_last_modified(self):
+        url = reverse('message-list')
+        params = {'chat': self.chat.pk}
+        response = self.get(url, params)
+        cached = self.get(url, params, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        Chat.objects.filter(pk=self.chat.pk).update(
+            modified_at=timezone.now() + timedelta(seconds=2))
+        cached = self.get(url, params, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+
+    def test_message_list_after_archiving(self):
+        Message.objects.filter(pk=self.message.pk).update(
+            created_at=timezone.now() - timedelta(days=400))
+        url = reverse('message-list')
+        etag = self.assertNotModified(url)
+        archive.archive_messages()
+        self.assertChanged(url, etag)
+
+    def test_etag_depends_on_user_and_media_type(self):
+        url = reverse('chat-list')
+        etag = self.get(url)['ETag']
+        self.assertNotEqual(self.get(url, HTTP_ACCEPT='text/html')['ETag'], etag)
+        self.client.force_authenticate(user=self.user2)
+        self.assertChanged(url, etag)
+
+    def test_invalid_chat(self):
+        response = self.get(reverse('message-list'), {'chat': 'nope'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn('ETag', response)
+
+
+class MessagePaginationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='pager@kek.ru', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(title='Long Chat')
+        self.other_chat = Chat.objects.create(title='Other Chat')
+        self.chat.members.add(self.user)
+        self.other_chat.members.add(self.user)
+        for i in range(10):
+            Message.objects.create(text=f'message {i}', chat=self.chat)
+            Message.objects.create(text=f'other {i}', chat=self.other_chat)
+        self.ids = [
+            str(pk) for pk in Message.objects.filter(chat=self.chat)
+            .order_by('-created_at', '-id').values_list('id', flat=True)
+        ]
+        self.url = reverse('message-list')
+
+    def result_ids(self, response):
+        return [message['id'] for message in response.data['results']]
+
+    def test_list_without_pagination_params_is_unpaginated(self):
+        response = self.client.get(self.url, {'chat': self.chat.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 10)
+
+    def test_first_page(self):
+        response = self.client.get(self.url, {'chat': self.chat.id, 'limit': 4})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.result_ids(response), self.ids[:4])
+        self.assertIn(f'before={self.ids[3]}', response.data['next'])
+        self.assertIsNone(response.data['previous'])
+
+    def test_follow_next_links_to_the_end(self):
+        response = self.client.get(self.url, {'chat': self.chat.id, 'limit': 4})
+        collected = self.result_ids(response)
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            collected += self.result_ids(response)
+        self.assertEqual(collected, self.ids)
+
+    def test_before(self):
+        response = self.client.get(
+            self.url, {'chat': self.chat.id, 'before': self.ids[2], 'limit': 3})
+        self.assertEqual(self.result_ids(response), self.ids[3:6])
+        self.assertIn(f'after={self.ids[3]}', response.data['previous'])
+
+    def test_after(self):
+        response = self.client.get(
+            self.url, {'chat': self.chat.id, 'after': self.ids[6], 'limit': 3})
+        self.assertEqual(self.result_ids(response), self.ids[3:6])
+        self.assertIn(f'before={self.ids[5]}', response.data['next'])
+
+    def test_around(self):
+        response = self.client.get(
+            self.url, {'chat': self.chat.id, 'around': self.ids[5], 'limit': 5})
+        self.assertEqual(self.result_ids(response), self.ids[3:8])
+        self.assertIsNotNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_around_newest_message(self):
+        response = self.client.get(
+            self.url, {'chat': self.chat.id, 'around': self.ids[0], 'limit': 5})
+        self.assertEqual(self.result_ids(response), self.ids[:3])
+        self.assertIsNone(response.data['previous'])
+
+    def test_pages_of_all_chats(self):
+        expected = [
+            str(pk) for pk in Message.objects.order_by('-created_at', '-id')
+            .values_list('id', flat=True)
+        ]
+        response = self.client.get(self.url, {'limit': 3})
+        self.assertIn(f'before={expected[2]}', response.data['next'])
+        self.assertNotIn('chat=', response.data['next'])
+        collected = self.result_ids(response)
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            collected += self.result_ids(response)
+        self.assertEqual(collected, expected)
+
+        response = self.client.get(self.url, {'after': expected[10], 'limit': 4})
+        self.assertEqual(self.result_ids(response), expected[6:10])
+
+    def test_multiple_anchors(self):
+        response = self.client.get(
+            self.url, {'before': self.ids[0], 'after': self.ids[1]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_anchor(self):
+        response = self.client.get(self.url, {'before': 'not-a-uuid'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unknown_anchor(self):
+        response = self.client.get(self.url, {'before': str(uuid.uuid4())})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ChatReadCursorTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='reader@kek.ru', password='testpass')
+        self.other = User.objects.create_user(
+            email='writer@kek.ru', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(title='Read Chat')
+        self.chat.members.add(self.user, self.other)
+        self.messages = [
+            Message.objects.create(text=f'message {i}', user=self.other, chat=self.chat)
+            for i in range(5)
+        ]
+        self.url = reverse('chat-mark-read', kwargs={'pk': self.chat.pk})
+
+    def test_mark_read_up_to_message(self):
+        response = self.client.post(self.url, {'message': self.messages[2].id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['last_read_seq'], 3)
+        self.assertEqual(response.data['unread_count'], 2)
+        unread = self.client.get(reverse('message-get-unread-messages'))
+        self.assertEqual(
+            [message['id'] for message in unread.data],
+            [str(self.messages[4].id), str(self.messages[3].id)])
+
+    def test_mark_read_whole_chat(self):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['last_read_seq'], 5)
+        self.assertEqual(response.data['unread_count'], 0)
+        unread = self.client.get(reverse('message-get-unread-messages'))
+        self.assertEqual(unread.data, [])
+
+    def test_mark_read_never_moves_backwards(self):
+        self.client.post(self.url)
+        response = self.client.post(self.url, {'message': self.messages[0].id})
+        self.assertEqual(response.data['last_read_seq'], 5)
+
+    def test_mark_read_is_per_member(self):
+        third = User.objects.create_user(email='third@kek.ru', password='testpass')
+        self.chat.members.add(third)
+        self.client.post(self.url)
+        self.client.force_authenticate(user=third)
+        unread = self.client.get(reverse('message-get-unread-messages'))
+        self.assertEqual(len(unread.data), 5)
+
+    def test_own_messages_are_read(self):
+        self.client.force_authenticate(user=self.other)
+        unread = self.client.get(reverse('message-get-unread-messages'))
+        self.assertEqual(unread.data, [])
+        membership = Membership.objects.get(chat=self.chat, user=self.other)
+        self.assertEqual((membership.last_read_seq, membership.unread_count), (5, 0))
+
+        # Sending moves the cursor past what was unread before.
+        Message.objects.create(text='from reader', user=self.user, chat=self.chat)
+        Message.objects.create(text='reply', user=self.other, chat=self.chat)
+        membership = Membership.objects.get(chat=self.chat, user=self.user)
+        self.assertEqual((membership.last_read_seq, membership.unread_count), (6, 1))
+        unread = self.client.get(reverse('message-get-unread-messages'))
+        self.assertEqual(unread.data, [])
+
+    def test_mark_read_not_a_member(self):
+        outsider = User.objects.create_user(
+            email='outsider@kek.ru', password='testpass')
+        self.client.force_authenticate(user=outsider)
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_mark_read_message_from_other_chat(self):
+        other_chat = Chat.objects.create(title='Other Chat')
+        message = Message.objects.create(text='elsewhere', chat=other_chat)
+        response = self.client.post(self.url, {'message': message.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class UnreadCountersTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='counter@kek.ru', password='testpass')
+        self.other = User.objects.create_user(
+            email='poster@kek.ru', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(title='Counted Chat')
+        self.chat.members.add(self.user, self.other)
+        self.quiet_chat = Chat.objects.create(title='Quiet Chat')
+        self.quiet_chat.members.add(self.user, self.other)
+        self.messages = [
+            Message.objects.create(text=f'message {i}', user=self.other, chat=self.chat)
+            for i in range(3)
+        ]
+        self.url = reverse('message-get-unread-summary')
+
+    def counter(self, user):
+        return Membership.objects.get(chat=self.chat, user=user).unread_count
+
+    def test_summary(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], 3)
+        self.assertEqual(response.data['chats'], [
+            {'chat': self.chat.id, 'unread_count': 3}])
+
+    def test_counter_follows_reads(self):
+        self.client.post(
+            reverse('chat-mark-read', kwargs={'pk': self.chat.pk}),
+            {'message': self.messages[1].id})
+        self.assertEqual(self.counter(self.user), 1)
+        self.assertEqual(self.counter(self.other), 0)
+
+    def test_counter_follows_deletes(self):
+        self.messages[0].delete()
+        self.assertEqual(self.counter(self.user), 2)
+
+    def test_new_member_counts_history(self):
+        newcomer = User.objects.create_user(
+            email='newcomer@kek.ru', password='testpass')
+        self.chat.members.add(newcomer)
+        self.assertEqual(self.counter(newcomer), 3)
+
+    def test_rebuild_command(self):
+        Membership.objects.update(unread_count=42)
+        call_command('rebuild_unread_counters', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.counter(self.user), 3)
+        self.assertEqual(
+            Membership.objects.get(chat=self.quiet_chat, user=self.user).unread_count, 0)
+
+
+class InboxTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(email='user1@top.com', password='password1')
+        self.user2 = User.objects.create_user(email='user2@top.com', password='password2')
+        self.quiet = Chat.objects.create(title='Quiet')
+        self.quiet.members.add(self.user1, self.user2)
+        self.busy = Chat.objects.create(title='Busy')
+        self.busy.members.add(self.user1, self.user2)
+        self.foreign = Chat.objects.create(title='Foreign')
+        self.foreign.members.add(self.user2)
+        self.old = Message.objects.create(text='Old', user=self.user2, chat=self.quiet)
+        Message.objects.create(text='First', user=self.user2, chat=self.busy)
+        self.last = Message.objects.create(text='Last', user=self.user2, chat=self.busy)
+        self.url = reverse('chat-inbox')
+        self.client.force_authenticate(user=self.user1)
+
+    def test_inbox(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [entry['chat']['title'] for entry in response.data], ['Busy', 'Quiet'])
+        busy = response.data[0]
+        self.assertEqual(busy['last_message'], MessageSerializer(self.last).data)
+        self.assertEqual(busy['unread_count'], 2)
+        self.assertNotIn('members', busy['chat'])
+        self.assertIsNotNone(busy['chat']['last_message_at'])
+
+    def test_new_message_moves_chat_up(self):
+        Message.objects.create(text='Again', user=self.user2, chat=self.quiet)
+        response = self.client.get(self.url)
+        self.assertEqual(
+            [entry['chat']['title'] for entry in response.data], ['Quiet', 'Busy'])
+        self.assertEqual(response.data[0]['last_message']['text'], 'Again')
+
+    def test_chat_without_messages(self):
+        Chat.objects.create(title='Empty').members.add(self.user1, self.user2)
+        response = self.client.get(self.url)
+        self.assertEqual(response.data[0]['chat']['title'], 'Empty')
+        self.assertIsNone(response.data[0]['last_message'])
+
+    def test_deleting_last_message(self):
+        self.last.delete()
+        self.busy.refresh_from_db()
+        self.assertEqual(self.busy.last_message.text, 'First')
+        self.old.delete()
+        self.quiet.refresh_from_db()
+        self.assertIsNone(self.quiet.last_message)
+        self.assertIsNone(self.quiet.last_message_at)
+
+    def test_moving_last_message(self):
+        self.last.chat = self.quiet
+        self.last.save()
+        self.busy.refresh_from_db()
+        self.quiet.refresh_from_db()
+        self.assertEqual(self.busy.last_message.text, 'First')
+        self.assertEqual(self.quiet.last_message, self.last)
+
+    def test_unauthenticated(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ChatMembersBulkTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='owner@kek.ru', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(title='Big Chat', admin=self.user)
+        self.chat.members.add(self.user)
+        self.users = [
+            User.objects.create(email=f'bulk{i}@kek.ru', password='testpass')
+            for i in range(20)
+        ]
+        self.add_url = reverse('chat-add-members', kwargs={'pk': self.chat.pk})
+        self.remove_url = reverse('chat-remove-members', kwargs={'pk': self.chat.pk})
+
+    def test_add_members_in_constant_queries(self):
+        ids = [str(user.id) for user in self.users]
+        # One of them loads the caller's membership set into the cache.
+        with self.assertNumQueries(9):
+            response = self.client.patch(self.add_url, {'members': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sorted(response.data['added']), sorted(ids))
+        self.assertEqual(self.chat.members.count(), 21)
+
+    def test_add_members_reports_missing(self):
+        unknown = str(uuid.uuid4())
+        response = self.client.patch(self.add_url, {
+            'members': [str(self.users[0].id), unknown, 'garbage']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['added'], [str(self.users[0].id)])
+        self.assertEqual(response.data['missing'], [unknown, 'garbage'])
+
+    def test_add_members_rejects_nested_ids(self):
+        for members in ([{'a': 1}], [[1]], [str(self.users[0].id), None]):
+            for url in (self.add_url, self.remove_url):
+                response = self.client.patch(url, {'members': members}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('members', response.data)
+        self.assertEqual(self.chat.members.count(), 1)
+
+    def test_add_existing_members_is_idempotent(self):
+        response = self.client.patch(
+            self.add_url, {'members': [str(self.user.id)]}, format='json')
+        self.assertEqual(response.data['added'], [])
+        self.assertEqual(self.chat.members.count(), 1)
+
+    def test_add_members_with_form_data(self):
+        response = self.client.patch(
+            self.add_url, {'members': [self.users[0].id, self.users[1].id]})
+        self.assertEqual(len(response.data['added']), 2)
+
+    def test_add_only_unknown_members(self):
+        response = self.client.patch(
+            self.add_url, {'members': [str(uuid.uuid4())]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_remove_members(self):
+        self.chat.members.add(*self.users)
+        ids = [str(user.id) for user in self.users[:5]]
+        outsider = User.objects.create(email='outsider@kek.ru', password='testpass')
+        response = self.client.patch(
+            self.remove_url, {'members': ids + [str(outsider.id)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data['removed']), sorted(ids))
+        self.assertEqual(response.data['missing'], [])
+        self.assertEqual(self.chat.members.count(), 16)
+
+
+class MessageSearchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='seeker@kek.ru', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(title='Searchable Chat')
+        self.chat.members.add(self.user)
+        self.hidden_chat = Chat.objects.create(title='Hidden Chat')
+        self.exact = Message.objects.create(text='deploy the release', chat=self.chat)
+        self.noisy = Message.objects.create(
+            text='release notes mention many unrelated words before deploy', chat=self.chat)
+        Message.objects.create(text='lunch plans', chat=self.chat)
+        Message.objects.create(text='deploy the release', chat=self.hidden_chat)
+        self.url = reverse('message-search')
+
+    def result_ids(self, response):
+        return [message['id'] for message in response.data['results']]
+
+    def test_search_is_ranked_and_scoped(self):
+        response = self.client.get(self.url, {'q': 'deploy release'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.result_ids(response),
+                         [str(self.exact.id), str(self.noisy.id)])
+        self.assertIsNone(response.data['next'])
+
+    def test_search_pages(self):
+        response = self.client.get(self.url, {'q': 'deploy', 'limit': 1})
+        self.assertEqual(self.result_ids(response), [str(self.exact.id)])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self.result_ids(response), [str(self.noisy.id)])
+        self.assertIsNone(response.data['next'])
+
+    def test_search_follows_updates_and_deletes(self):
+        self.exact.text = 'ship it'
+        self.exact.save()
+        self.noisy.delete()
+        response = self.client.get(self.url, {'q': 'deploy'})
+        self.assertEqual(self.result_ids(response), [])
+        response = self.client.get(self.url, {'q': 'ship'})
+        self.assertEqual(self.result_ids(response), [str(self.exact.id)])
+
+    def test_search_query_syntax_is_escaped(self):
+        response = self.client.get(self.url, {'q': 'deploy" OR (NEAR'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_search_without_query(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_invalid_cursor(self):
+        response = self.client.get(self.url, {'q': 'deploy', 'cursor': 'zzz'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_command(self):
+        call_command('rebuild_message_search', batch_size=1, stdout=StringIO())
+        response = self.client.get(self.url, {'q': 'lunch'})
+        self.assertEqual(len(response.data['results']), 1)
+        Message.objects.create(text='lunch again', chat=self.chat)
+        response = self.client.get(self.url, {'q': 'lunch'})
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class MessageArchiveTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='archive@kek.ru', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(title='Old Chat')
+        self.other_chat = Chat.objects.create(title='Other Chat')
+        self.chat.members.add(self.user)
+        self.other_chat.members.add(self.user)
+        old = timezone.now() - timedelta(days=400)
+        for i in range(10):
+            message = Message.objects.create(
+                text=f'message {i}', chat=self.chat, user=self.user)
+            if i < 6:
+                Message.objects.filter(pk=message.pk).update(
+                    created_at=old + timedelta(minutes=i))
+        Message.objects.create(text='other', chat=self.other_chat)
+        messages = Message.objects.filter(chat=self.chat).order_by('-created_at', '-id')
+        self.ids = [str(message.id) for message in messages]
+        self.data = MessageSerializer(messages, many=True).data
+        self.url = reverse('message-list')
+
+    def archive(self):
+        return archive.archive_messages(age=timedelta(days=365), segment_size=4)
+
+    def result_ids(self, response):
+        return [message['id'] for message in response.data['results']]
+
+    def test_archive_moves_old_messages(self):
+        self.assertEqual(self.archive(), 6)
+        self.assertEqual(Message.objects.filter(chat=self.chat).count(), 4)
+        self.assertEqual(MessageArchiveSegment.objects.count(), 2)
+        self.assertEqual(ArchivedMessage.objects.count(), 6)
+        self.assertEqual(self.archive(), 0)
+
+    def test_history_reads_through(self):
+        self.archive()
+        response = self.client.get(self.url, {'chat': self.chat.id, 'limit': 3})
+        collected = response.data['results']
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            collected += response.data['results']
+        self.assertEqual(collected, self.data)
+
+    def test_after_archived_anchor(self):
+        self.archive()
+        response = self.client.get(
+            self.url, {'chat': self.chat.id, 'after': self.ids[8], 'limit': 4})
+        self.assertEqual(self.result_ids(response), self.ids[4:8])
+        self.assertIn(f'after={self.ids[4]}', response.data['previous'])
+
+    def test_around_archived_anchor(self):
+        self.archive()
+        response = self.client.get(
+            self.url, {'chat': self.chat.id, 'around': self.ids[5], 'limit': 5})
+        self.assertEqual(self.result_ids(response), self.ids[3:8])
+
+    def test_archived_anchor_in_other_chat(self):
+        self.archive()
+        response = self.client.get(
+            self.url, {'chat': self.other_chat.id, 'before': self.ids[8]})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unread_counters_follow_archive(self):
+        reader = User.objects.create_user(email='reader@kek.ru', password='testpass')
+        self.chat.members.add(reader)
+        self.client.force_authenticate(user=reader)
+        self.archive()
+
+        response = self.client.get(reverse('message-get-unread-summary'))
+        self.assertEqual(response.data['total'], 4)
+        response = self.client.get(reverse('message-get-unread-messages'))
+        self.assertEqual([message['id'] for message in response.data], self.ids[:4])
+        response = self.client.get(reverse('chat-inbox'))
+        self.assertEqual(response.data[0]['unread_count'], 4)
+        self.assertEqual(response.data[0]['last_message']['id'], self.ids[0])
+
+    def test_fully_archived_chat(self):
+        reader = User.objects.create_user(email='reader@kek.ru', password='testpass')
+        self.chat.members.add(reader)
+        Message.objects.filter(chat=self.chat).update(
+            created_at=timezone.now() - timedelta(days=400))
+        archive.archive_messages(age=timedelta(days=365), segment_size=100)
+        self.chat.refresh_from_db()
+        self.assertIsNone(self.chat.last_message)
+        self.assertEqual(self.chat.last_message_seq, 10)
+        membership = Membership.objects.get(chat=self.chat, user=reader)
+        self.assertEqual((membership.last_read_seq, membership.unread_count), (10, 0))
+
+    def test_mark_read_after_newest_is_gone(self):
+        reader = User.objects.create_user(email='reader@kek.ru', password='testpass')
+        self.chat.members.add(reader)
+        Message.objects.get(pk=self.ids[0]).delete()
+        self.client.force_authenticate(user=reader)
+        response = self.client.post(reverse('chat-mark-read', kwargs={'pk': self.chat.pk}))
+        self.assertEqual(response.data['last_read_seq'], 10)
+        self.assertEqual(response.data['unread_count'], 0)
+
+    def test_get_message(self):
+        self.archive()
+        message = archive.get_message(uuid.UUID(self.ids[9]))
+        self.assertEqual(message.text, 'message 0')
+        self.assertEqual(message.chat_id, self.chat.id)
+        self.assertEqual(message.user_id, self.user.id)
+        self.assertEqual(MessageSerializer(message).data, self.data[9])
+        self.assertIsNone(archive.get_message(uuid.uuid4()))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('archive_messages', days=365, stdout=out)
+        self.assertIn('Done, 6 messages archived.', out.getvalue())
+
+
+class MessageBatchTestCase(APITestCase):
+    def setUp(self):
+        access.cache.clear()
+        self.user = User.objects.create_user(email='batch@kek.ru', password='testpass')
+        self.other = User.objects.create_user(email='reader@kek.ru', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.first = Chat.objects.create(title='First')
+        self.first.members.add(self.user, self.other)
+        self.second = Chat.objects.create(title='Second')
+        self.second.members.add(self.user, self.other)
+        self.foreign = Chat.objects.create(title='Foreign')
+        self.foreign.members.add(self.other)
+        Message.objects.create(text='hello', user=self.other, chat=self.first)
+        self.url = reverse('message-create-batch')
+
+    def post(self, messages):
+        with mock.patch('chats.ingest.get_broker') as get_broker, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'messages': messages}, format='json')
+        self.events = [call.args[0] for call in get_broker().publish.call_args_list]
+        return response
+
+    def test_messages_across_chats(self):
+        response = self.post([
+            {'chat': str(self.first.pk), 'text': 'a'},
+            {'chat': str(self.second.pk), 'text': 'b'},
+            {'chat': str(self.first.pk), 'text': 'c'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [201] * 3)
+        self.assertEqual([result['message']['text'] for result in results], ['a', 'b', 'c'])
+        self.assertEqual([result['message']['seq'] for result in results], [2, 1, 3])
+        self.assertEqual(
+            Membership.objects.get(chat=self.first, user=self.other).unread_count, 2)
+        self.assertEqual(
+            Membership.objects.get(chat=self.second, user=self.other).unread_count, 1)
+        self.assertEqual(
+            Membership.objects.get(chat=self.first, user=self.user).unread_count, 0)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.last_message.text, 'c')
+
+        self.assertEqual(len(self.events), 2)
+        events = {event['chat']: event for event in self.events}
+        self.assertEqual(
+            [message['text'] for message in events[str(self.first.pk)]['messages']], ['a', 'c'])
+        self.assertEqual(events[str(self.second.pk)]['type'], 'messages')
+
+    def test_invalid_and_foreign_messages(self):
+        response = self.post([
+            {'chat': str(self.first.pk), 'text': 'ok'},
+            {'chat': str(self.first.pk)},
+            {'chat': str(self.foreign.pk), 'text': 'intruder'},
+            {'chat': str(uuid.uuid4()), 'text': 'nowhere'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [201, 400, 403, 403])
+        self.assertIn('text', results[1]['errors'])
+        self.assertFalse(Message.objects.filter(chat=self.foreign).exists())
+        self.assertEqual(Message.objects.filter(chat=self.first).count(), 2)
+
+    def test_limits(self):
+        response = self.post([])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.settings(MESSAGE_INGEST={'BATCH_SEND_MAX': 2}):
+            response = self.post([{'chat': str(self.first.pk), 'text': 'x'}] * 3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Message.objects.filter(text='x').exists())
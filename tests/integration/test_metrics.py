@@ -0,0 +1,94 @@
+import atexit
+import re
+import tempfile
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from application import metrics
+from chats.models import Chat, Message
+
+User = get_user_model()
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(METRICS={'PATH': directory.name, 'TOKEN': 'secret'})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        metrics._store = None
+        self.addCleanup(self.drop_store)
+
+        self.user = User.objects.create_user(email='metrics@kek.ru', password='testpass')
+        self.chat = Chat.objects.create(title='Measured')
+        self.chat.members.add(self.user)
+        Message.objects.create(chat=self.chat, user=self.user, text='hi')
+
+    def drop_store(self):
+        if metrics._store is not None:
+            atexit.unregister(metrics._store.flush)
+            metrics._store = None
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def value(self, text, name, **labels):
+        selector = ','.join(f'{key}="{value}"' for key, value in labels.items())
+        match = re.search(rf'^{name}{{{re.escape(selector)}}} (\S+)$', text, re.MULTILINE)
+        self.assertIsNotNone(match, f'{name}{{{selector}}} missing')
+        return float(match.group(1))
+
+    def test_records_views(self):
+        self.client.post(reverse('login'), {'email': 'metrics@kek.ru', 'password': 'wrong'})
+        self.client.force_authenticate(user=self.user)
+        for _ in range(2):
+            response = self.client.get(reverse('message-list'), {'chat': self.chat.pk})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.get('/nowhere/')
+
+        text = self.scrape()
+        self.assertEqual(
+            self.value(text, 'http_requests_total', route='message-list', method='GET', status=200),
+            2)
+        self.assertEqual(
+            self.value(text, 'http_request_duration_seconds_count', route='message-list',
+                       method='GET'),
+            2)
+        self.assertGreaterEqual(
+            self.value(text, 'http_request_db_queries_total', route='message-list', method='GET'),
+            2)
+        self.assertGreater(
+            self.value(text, 'http_request_db_seconds_total', route='message-list', method='GET'),
+            0)
+        self.assertGreater(
+            self.value(text, 'http_request_render_seconds_total', route='message-list',
+                       method='GET'),
+            0)
+        self.assertEqual(
+            self.value(text, 'http_requests_total', route='login', method='POST', status=400), 1)
+        self.assertEqual(
+            self.value(text, 'http_requests_total', route='unmatched', method='GET', status=404),
+            1)
+
+    async def test_records_async_requests(self):
+        response = await self.async_client.get('/no/such/page/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        text = await sync_to_async(self.scrape)()
+        self.assertEqual(
+            self.value(text, 'http_requests_total', route='unmatched', method='GET', status=404),
+            1)
+
+    def test_requires_token(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secreT')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,70 @@
+import os
+import tempfile
+
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, override_settings
+
+ALIAS = 'migration_test'
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class ReadCursorMigrationTest(SimpleTestCase):
+    """
+    Migrates a scratch database through the read cursor and unread counter
+    backfills.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.settings[ALIAS] = connections.configure_settings({
+            'default': connections.settings['default'],
+            ALIAS: {'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': os.path.join(directory.name, 'db.sqlite3')},
+        })[ALIAS]
+        self.addCleanup(self.remove_database)
+
+    def remove_database(self):
+        connections[ALIAS].close()
+        del connections[ALIAS]
+        del connections.settings[ALIAS]
+
+    def migrate(self, migration):
+        target = [('chats', migration)]
+        executor = MigrationExecutor(connections[ALIAS])
+        executor.migrate(target)
+        return executor.loader.project_state(target).apps
+
+    def create_chat(self, apps):
+        User = apps.get_model('users', 'User')
+        Chat = apps.get_model('chats', 'Chat')
+        self.first = User.objects.using(ALIAS).create(email='first@top.com', password='!')
+        self.second = User.objects.using(ALIAS).create(email='second@top.com', password='!')
+        chat = Chat.objects.using(ALIAS).create(title='Chat')
+        chat.members.add(self.first, self.second)
+        return chat
+
+    def test_history_is_read_after_upgrade(self):
+        apps = self.migrate('0004_message_indexes')
+        chat = self.create_chat(apps)
+        Message = apps.get_model('chats', 'Message')
+        for user in (self.first, self.first, self.second):
+            Message.objects.using(ALIAS).create(chat=chat, user=user, text='old')
+
+        apps = self.migrate('0006_membership_unread_count')
+        memberships = apps.get_model('chats', 'Membership').objects.using(ALIAS)
+        self.assertEqual(
+            sorted(memberships.values_list('last_read_seq', 'unread_count')), [(3, 0), (3, 0)])
+
+    def test_own_messages_are_not_unread(self):
+        apps = self.migrate('0005_membership_read_cursors')
+        chat = self.create_chat(apps)
+        Message = apps.get_model('chats', 'Message')
+        for seq, user in enumerate((self.first, self.first, self.second), 1):
+            Message.objects.using(ALIAS).create(chat=chat, user=user, text='new', seq=seq)
+
+        apps = self.migrate('0006_membership_unread_count')
+        memberships = apps.get_model('chats', 'Membership').objects.using(ALIAS)
+        self.assertEqual(memberships.get(user_id=self.first.pk).unread_count, 1)
+        self.assertEqual(memberships.get(user_id=self.second.pk).unread_count, 2)
@@ -0,0 +1,97 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from application import replicas
+from chats.models import Chat, Membership, Message
+
+User = get_user_model()
+
+ALIAS = 'replica_test'
+
+
+@override_settings(REPLICAS={'DATABASES': [ALIAS], 'STICKY_SECONDS': 5, 'CACHE': 'default'})
+class ReplicaReadsTestCase(TransactionTestCase):
+    """
+    A file copy of the test database stands in for the replica, so rows
+    written after the last sync are only visible on the primary.
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        self.path = os.path.join(directory, 'replica.sqlite3')
+        connections.settings[ALIAS] = connections.configure_settings({
+            'default': connections.settings['default'],
+            ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.path},
+        })[ALIAS]
+        self.addCleanup(self.remove_replica)
+        replicas.get_cache().clear()
+
+        self.user = User.objects.create_user(email='user@top.com', password='password')
+        self.chat = Chat.objects.create(title='Chat', admin=self.user)
+        Membership.objects.create(chat=self.chat, user=self.user)
+        Message.objects.create(chat=self.chat, user=self.user, text='synced')
+        replicas.sync_replicas()
+        Message.objects.create(chat=self.chat, user=self.user, text='not synced')
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('message-list') + f'?chat={self.chat.pk}'
+
+    def remove_replica(self):
+        connections[ALIAS].close()
+        del connections[ALIAS]
+        del connections.settings[ALIAS]
+        os.remove(self.path)
+
+    def get_texts(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(message['text'] for message in response.data)
+
+    def test_reads_are_served_from_replica(self):
+        self.assertEqual(self.get_texts(), ['synced'])
+
+    def test_writer_reads_own_writes(self):
+        response = self.client.post(
+            reverse('message-list'), {'chat': self.chat.pk, 'text': 'new'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(self.get_texts(), ['new', 'not synced', 'synced'])
+
+        replicas.get_cache().clear()
+        self.assertEqual(self.get_texts(), ['synced'])
+
+    def test_failed_write_does_not_pin(self):
+        response = self.client.post(reverse('message-list'), {'chat': self.chat.pk})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(replicas.is_pinned(self.user.pk))
+
+    def test_other_users_stay_on_replica(self):
+        other = User.objects.create_user(email='other@top.com', password='password')
+        Membership.objects.create(chat=self.chat, user=other)
+        self.client.post(reverse('message-list'), {'chat': self.chat.pk, 'text': 'new'})
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.get_texts(), ['synced'])
+
+    def test_replica_unbound_after_error(self):
+        with mock.patch('chats.views.MessageViewSet.list', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.get(self.url)
+        self.assertIsNone(replicas.replica.get())
+
+    def test_sync_replicas_command(self):
+        stdout = StringIO()
+        call_command('sync_replicas', stdout=stdout)
+        self.assertIn(ALIAS, stdout.getvalue())
+        self.assertEqual(self.get_texts(), ['not synced', 'synced'])
@@ -0,0 +1,234 @@
+import os
+import tempfile
+import uuid
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from chats import access, archive, rebalance, sharding
+from chats.models import (
+    ArchivedMessage, Chat, ChatPlacement, Membership, Message, MessageArchiveSegment)
+
+User = get_user_model()
+
+ALIAS = 'shard_test'
+SHARDS = ['default', ALIAS]
+
+
+def chat_id_on(alias):
+    while True:
+        chat_id = uuid.uuid4()
+        if sharding.hash_shard(chat_id, SHARDS) == alias:
+            return chat_id
+
+
+@override_settings(SHARDING={'DATABASES': SHARDS})
+class ShardingTestCase(TransactionTestCase):
+    """
+    A second SQLite file holds the chats placed on `ALIAS`; users and chat
+    placements stay on the test database.
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        self.path = os.path.join(directory, 'shard.sqlite3')
+        connections.settings[ALIAS] = connections.configure_settings({
+            'default': connections.settings['default'],
+            ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.path},
+        })[ALIAS]
+        self.addCleanup(self.remove_shard)
+        call_command('migrate', database=ALIAS, verbosity=0)
+        sharding.cache.clear()
+        access.cache.clear()
+
+        self.user = User.objects.create_user(email='user@top.com', password='password')
+        self.other = User.objects.create_user(email='other@top.com', password='password')
+        self.here = self.create_chat('default', 'Here')
+        self.there = self.create_chat(ALIAS, 'There')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def remove_shard(self):
+        connections[ALIAS].close()
+        del connections[ALIAS]
+        del connections.settings[ALIAS]
+        for suffix in ('', '-journal', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def create_chat(self, alias, title):
+        chat = Chat.objects.create(id=chat_id_on(alias), title=title, admin=self.user)
+        chat.members.add(self.user, self.other)
+        Message.objects.create(chat=chat, user=self.other, text=f'{title} 1')
+        Message.objects.create(chat=chat, user=self.other, text=f'{title} 2')
+        return chat
+
+    def test_chats_are_placed_by_hash(self):
+        self.assertEqual(self.there._state.db, ALIAS)
+        self.assertTrue(Chat.objects.using(ALIAS).filter(pk=self.there.pk).exists())
+        self.assertFalse(Chat.objects.using('default').filter(pk=self.there.pk).exists())
+        self.assertEqual(Message.objects.using(ALIAS).filter(chat_id=self.there.pk).count(), 2)
+        self.assertEqual(sharding.locate(self.there.pk), ALIAS)
+        self.assertEqual(sharding.locate(self.here.pk), 'default')
+
+    def test_create_chat(self):
+        created = set()
+        # Until there was one on each shard.
+        while len(created) < 2:
+            response = self.client.post(
+                reverse('chat-list'), {'title': 'New', 'members': [self.user.pk, self.other.pk]})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            chat_id = uuid.UUID(response.data['id'])
+            alias = sharding.hash_shard(chat_id)
+            self.assertEqual(Membership.objects.using(alias).filter(chat_id=chat_id).count(), 2)
+            created.add(alias)
+
+        third = User.objects.create_user(email='third@top.com', password='password')
+        response = self.client.patch(
+            reverse('chat-detail', args=[self.there.pk]),
+            {'members': [self.user.pk, third.pk]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['members'], sorted([self.user.pk, third.pk]))
+
+    def test_messages_of_chat(self):
+        url = reverse('message-list')
+        response = self.client.post(url, {'chat': self.there.pk, 'text': 'There 3'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Message.objects.using(ALIAS).get(text='There 3').seq, 3)
+
+        response = self.client.get(url, {'chat': self.there.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(message['text'] for message in response.data),
+            ['There 1', 'There 2', 'There 3'])
+
+        message_id = response.data[0]['id']
+        response = self.client.get(reverse('message-detail', args=[message_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_move_message(self):
+        message = Message.objects.using('default').get(text='Here 1')
+        url = reverse('message-detail', args=[message.pk])
+        response = self.client.patch(url, {'chat': self.there.pk})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data['chat'], 'Messages cannot be moved to a chat on another shard.')
+        self.assertEqual(Message.objects.using('default').get(pk=message.pk).chat_id, self.here.pk)
+
+        elsewhere = self.create_chat('default', 'Elsewhere')
+        response = self.client.patch(url, {'chat': elsewhere.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Message.objects.using('default').get(pk=message.pk).chat_id, elsewhere.pk)
+
+    def test_lists_gather_all_shards(self):
+        response = self.client.get(reverse('chat-list'))
+        self.assertEqual({chat['title'] for chat in response.data}, {'Here', 'There'})
+
+        response = self.client.get(reverse('message-list'))
+        created = [message['created_at'] for message in response.data]
+        self.assertEqual(len(created), 4)
+        self.assertEqual(created, sorted(created, reverse=True))
+
+        response = self.client.get(reverse('message-list'), {'limit': 1})
+        paged = [message['created_at'] for message in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            paged += [message['created_at'] for message in response.data['results']]
+        self.assertEqual(paged, created)
+
+        response = self.client.get(reverse('message-search'), {'q': '2'})
+        self.assertEqual(
+            sorted(message['text'] for message in response.data['results']),
+            ['Here 2', 'There 2'])
+
+    def test_inbox(self):
+        Message.objects.create(chat=self.here, user=self.other, text='Here 3')
+        response = self.client.get(reverse('chat-inbox'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['chat']['id'] for item in response.data], [str(self.here.pk), str(self.there.pk)])
+
+    def test_unread_summary(self):
+        self.client.force_authenticate(user=self.other)
+        self.client.post(reverse('message-list'), {'chat': self.there.pk, 'text': 'There 3'})
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('message-get-unread-summary'))
+        self.assertEqual(response.data['total'], 5)
+        self.assertEqual(
+            {chat['chat']: chat['unread_count'] for chat in response.data['chats']},
+            {self.here.pk: 2, self.there.pk: 3})
+
+    def test_move_chat(self):
+        archive.archive_chat(self.there.pk, archive.timezone.now(), 1, using=ALIAS)
+        Membership.objects.using(ALIAS).filter(
+            chat=self.there, user=self.user).update(last_read_seq=2, unread_count=0)
+        created_at = Message.objects.using(ALIAS).get(chat=self.there).created_at
+
+        stdout = StringIO()
+        call_command('move_chats', chat=[str(self.there.pk)], to='default', stdout=stdout)
+        self.assertIn('Done, 1 chats moved.', stdout.getvalue())
+
+        self.assertFalse(Chat.objects.using(ALIAS).filter(pk=self.there.pk).exists())
+        self.assertFalse(Message.objects.using(ALIAS).exists())
+        chat = Chat.objects.using('default').get(pk=self.there.pk)
+        self.assertEqual(chat.last_message_seq, 2)
+        self.assertEqual(chat.last_message.text, 'There 2')
+        self.assertEqual(Message.objects.get(chat=chat).created_at, created_at)
+        self.assertEqual(ArchivedMessage.objects.filter(segment__chat=chat).count(), 1)
+        self.assertEqual(
+            Membership.objects.get(chat=chat, user=self.user).last_read_seq, 2)
+        self.assertEqual(
+            ChatPlacement.objects.get(chat_id=chat.pk).database, 'default')
+        self.assertEqual(sharding.locate(chat.pk), 'default')
+
+        response = self.client.get(reverse('message-list'), {'chat': chat.pk, 'limit': 10})
+        self.assertEqual(
+            [message['text'] for message in response.data['results']], ['There 2', 'There 1'])
+        response = self.client.post(reverse('message-list'), {'chat': chat.pk, 'text': 'There 3'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Message.objects.get(text='There 3').seq, 3)
+
+        # Moved on purpose, so it is not rebalanced back.
+        call_command('move_chats', stdout=StringIO())
+        self.assertEqual(sharding.locate(chat.pk, refresh=True), 'default')
+
+    def test_move_chat_clears_source_after_commit(self):
+        archive.archive_chat(self.there.pk, archive.timezone.now(), 1, using=ALIAS)
+        clear = rebalance.clear
+
+        def clear_outside_transaction(chat_id, using, batch_size):
+            self.assertFalse(connections[using].in_atomic_block)
+            # The chat's row went with the lock: writers routed here fail.
+            with self.assertRaises(Chat.DoesNotExist):
+                Message.objects.using(using).create(chat_id=chat_id, text='Stale')
+            clear(chat_id, using, batch_size)
+
+        with mock.patch('chats.rebalance.clear', side_effect=clear_outside_transaction) as patched:
+            rebalance.move_chat(self.there.pk, 'default', batch_size=1)
+        patched.assert_called_with(self.there.pk, ALIAS, 1)
+        for model in (Chat, Message, Membership, MessageArchiveSegment, ArchivedMessage):
+            self.assertFalse(model.objects.using(ALIAS).exists(), model.__name__)
+        self.assertEqual(Message.objects.filter(chat_id=self.there.pk).count(), 1)
+
+    def test_rebalance(self):
+        misplaced = Chat.objects.using(ALIAS).create(id=chat_id_on('default'), title='Misplaced')
+        Message.objects.using(ALIAS).create(chat=misplaced, text='Hi')
+
+        stdout = StringIO()
+        call_command('move_chats', dry_run=True, stdout=stdout)
+        self.assertIn(f'Would move {misplaced.pk} to default', stdout.getvalue())
+        self.assertTrue(Chat.objects.using(ALIAS).filter(pk=misplaced.pk).exists())
+
+        call_command('move_chats', stdout=StringIO())
+        self.assertFalse(Chat.objects.using(ALIAS).filter(pk=misplaced.pk).exists())
+        self.assertEqual(Message.objects.get(chat_id=misplaced.pk).text, 'Hi')
+        self.assertFalse(ChatPlacement.objects.exists())
+        self.assertEqual(Chat.objects.using(ALIAS).get().pk, self.there.pk)
@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats.models import Chat, Message
+
+User = get_user_model()
+
+
+@override_settings(REALTIME={
+    'LONG_POLL_TIMEOUT': 1,
+    'SSE_MAX_DURATION': 1,
+    'SSE_HEARTBEAT': 0.2,
+})
+class MessageStreamingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='poller@kek.ru', password='testpass')
+        self.other = User.objects.create_user(
+            email='other@kek.ru', password='testpass')
+        self.chat = Chat.objects.create(title='Polled Chat')
+        self.chat.members.add(self.user, self.other)
+        self.first = Message.objects.create(text='first', user=self.other, chat=self.chat)
+        self.headers = {
+            'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def create_message(self, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(text=text, user=self.other, chat=self.chat)
+
+    def send_batch(self, *texts):
+        client = APIClient()
+        client.force_authenticate(user=self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('message-create-batch'), {'messages': [
+                {'chat': str(self.chat.pk), 'text': text} for text in texts
+            ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return [result['message']['id'] for result in response.data['results']]
+
+    async def test_poll_requires_authentication(self):
+        response = await self.async_client.get(reverse('message-poll'))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_poll_returns_backlog_immediately(self):
+        second = await sync_to_async(self.create_message)('second')
+        response = await self.async_client.get(
+            reverse('message-poll'), {'after': str(self.first.id)}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual([m['id'] for m in data['results']], [str(second.id)])
+        self.assertEqual(data['cursor'], str(second.id))
+
+    async def test_poll_waits_for_new_message(self):
+        poll = asyncio.ensure_future(self.async_client.get(
+            reverse('message-poll'), headers=self.headers))
+        await asyncio.sleep(0.2)
+        self.assertFalse(poll.done())
+        second = await sync_to_async(self.create_message)('second')
+        response = await asyncio.wait_for(poll, 1)
+        data = json.loads(response.content)
+        self.assertEqual([m['id'] for m in data['results']], [str(second.id)])
+
+    async def test_poll_times_out_with_cursor(self):
+        response = await self.async_client.get(
+            reverse('message-poll'), {'timeout': 0.1}, headers=self.headers)
+        data = json.loads(response.content)
+        self.assertEqual(data, {'cursor': str(self.first.id), 'results': []})
+
+    async def test_invalid_timeout(self):
+        for name in ('message-poll', 'message-stream'):
+            for value in ('nan', 'inf', '-1', '0', 'soon'):
+                response = await self.async_client.get(
+                    reverse(name), {'timeout': value}, headers=self.headers)
+                self.assertEqual(response.status_code, 400, (name, value))
+
+    async def test_poll_unknown_cursor(self):
+        response = await self.async_client.get(
+            reverse('message-poll'), {'after': 'nope'}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_stream_replays_and_relays(self):
+        second = await sync_to_async(self.create_message)('second')
+        response = await self.async_client.get(
+            reverse('message-stream'), {'after': str(self.first.id)}, headers=self.headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = response.streaming_content
+        replayed = (await chunks.__anext__()).decode()
+        self.assertTrue(replayed.startswith(f'id: {second.id}\nevent: message\n'))
+
+        pending = asyncio.ensure_future(chunks.__anext__())
+        third = await sync_to_async(self.create_message)('third')
+        relayed = (await asyncio.wait_for(pending, 1)).decode()
+        self.assertTrue(relayed.startswith(f'id: {third.id}\n'))
+        data = json.loads(relayed.split('data: ', 1)[1])
+        self.assertEqual(data['message']['text'], 'third')
+        await chunks.aclose()
+
+    async def test_stream_relays_batches(self):
+        response = await self.async_client.get(reverse('message-stream'), headers=self.headers)
+        chunks = response.streaming_content
+        pending = asyncio.ensure_future(chunks.__anext__())
+        await asyncio.sleep(0.05)
+        ids = await sync_to_async(self.send_batch)('one', 'two')
+
+        relayed = [(await asyncio.wait_for(pending, 1)).decode()]
+        relayed.append((await asyncio.wait_for(chunks.__anext__(), 1)).decode())
+        self.assertEqual([chunk.split('\n', 1)[0] for chunk in relayed], [f'id: {i}' for i in ids])
+        data = [json.loads(chunk.split('data: ', 1)[1]) for chunk in relayed]
+        self.assertEqual([event['type'] for event in data], ['message', 'message'])
+        self.assertEqual([event['message']['text'] for event in data], ['one', 'two'])
+        await chunks.aclose()
+
+    async def test_poll_wakes_for_batch(self):
+        poll = asyncio.ensure_future(self.async_client.get(
+            reverse('message-poll'), headers=self.headers))
+        await asyncio.sleep(0.2)
+        ids = await sync_to_async(self.send_batch)('one', 'two')
+        response = await asyncio.wait_for(poll, 1)
+        data = json.loads(response.content)
+        self.assertEqual([m['id'] for m in data['results']], ids)
+        self.assertEqual(data['cursor'], ids[-1])
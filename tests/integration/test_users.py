@@ -3,6 +3,8 @@ from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from users import authentication
 from users.models import User
 
 
@@ -102,6 +104,52 @@ class UserViewSetTests(TestCase):
         response = self.auth_client.get(reverse('user-search'))
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_autocomplete_prefix_before_substring(self):
+        User.objects.create_user(
+            email='marjo@example.com', password='pass', first_name='Mar', last_name='Jo')
+        User.objects.create_user(
+            email='alice@example.com', password='pass', first_name='Johanna', last_name='Smith')
+        response = self.auth_client.get(
+            reverse('user-autocomplete'), {'query': 'Joh'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user['email'] for user in response.data],
+                         ['alice@example.com', 'test@example.com'])
+
+    def test_autocomplete_substring(self):
+        User.objects.create_user(
+            email='someone@example.com', password='pass', first_name='Bo', last_name='Marjoram')
+        response = self.auth_client.get(
+            reverse('user-autocomplete'), {'query': 'joram'})
+        self.assertEqual([user['email'] for user in response.data],
+                         ['someone@example.com'])
+
+    def test_autocomplete_short_query_is_prefix_only(self):
+        response = self.auth_client.get(
+            reverse('user-autocomplete'), {'query': 'oe'})
+        self.assertEqual(response.data, [])
+        response = self.auth_client.get(
+            reverse('user-autocomplete'), {'query': 'do'})
+        self.assertEqual(response.data[0]['email'], self.user.email)
+
+    def test_autocomplete_is_capped(self):
+        for i in range(15):
+            User.objects.create_user(
+                email=f'bulk{i}@example.com', password='pass', first_name='Bulk', last_name='User')
+        response = self.auth_client.get(
+            reverse('user-autocomplete'), {'query': 'bulk', 'limit': 5})
+        self.assertEqual(len(response.data), 5)
+
+    def test_autocomplete_follows_updates(self):
+        self.user.last_name = 'Renamed'
+        self.user.save()
+        response = self.auth_client.get(
+            reverse('user-autocomplete'), {'query': 'enamed'})
+        self.assertEqual(response.data[0]['email'], self.user.email)
+
+    def test_autocomplete_no_query(self):
+        response = self.auth_client.get(reverse('user-autocomplete'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_active_users(self):
         User.objects.create_user(
             email='inactiveuser@example.com',
@@ -145,3 +193,58 @@ class UserViewSetTests(TestCase):
         url = reverse('user-detail', args=[user2.id])
         response = self.auth_client.patch(url, data)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        authentication.token_cache.clear()
+        authentication.user_cache.clear()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword',
+            first_name='John',
+            last_name='Doe'
+        )
+        self.client = APIClient()
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.url = reverse('user-current-user')
+
+    def test_user_is_cached_between_requests(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['email'], 'test@example.com')
+
+    def test_saving_user_invalidates_cache(self):
+        self.client.get(self.url)
+        self.user.first_name = 'Johnny'
+        self.user.save()
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['first_name'], 'Johnny')
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalid_token_is_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer invalid')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_auth_cache_stats_require_admin(self):
+        url = reverse('user-auth-cache')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        authentication.invalidate_user(self.user.pk)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {'tokens', 'users'})
+        self.assertGreater(response.data['tokens']['hits'], 0)
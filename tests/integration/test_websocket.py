@@ -0,0 +1,109 @@
+import json
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats import ingest
+from chats.models import Chat, Message
+from chats.websocket import websocket_application, CLOSE_UNAUTHORIZED
+
+User = get_user_model()
+
+
+class WebsocketTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='socket@kek.ru', password='testpass')
+        self.other = User.objects.create_user(
+            email='other@kek.ru', password='testpass')
+        self.chat = Chat.objects.create(title='Live Chat')
+        self.chat.members.add(self.user, self.other)
+        self.token = str(AccessToken.for_user(self.user))
+
+    def communicator(self, token=None, path='/ws/chats/'):
+        return ApplicationCommunicator(websocket_application, {
+            'type': 'websocket',
+            'path': path,
+            'query_string': f'token={token}'.encode() if token else b'',
+            'headers': [],
+        })
+
+    def create_message(self, chat, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(text=text, user=self.other, chat=chat)
+
+    async def connect(self, communicator):
+        await communicator.send_input({'type': 'websocket.connect'})
+        return await communicator.receive_output()
+
+    async def test_rejects_missing_token(self):
+        communicator = self.communicator()
+        response = await self.connect(communicator)
+        self.assertEqual(response, {'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+
+    async def test_rejects_invalid_token(self):
+        communicator = self.communicator(token='garbage')
+        response = await self.connect(communicator)
+        self.assertEqual(response['code'], CLOSE_UNAUTHORIZED)
+
+    async def test_rejects_unknown_path(self):
+        communicator = self.communicator(token=self.token, path='/ws/other/')
+        response = await self.connect(communicator)
+        self.assertEqual(response['type'], 'websocket.close')
+
+    async def test_receives_messages_of_own_chats(self):
+        communicator = self.communicator(token=self.token)
+        response = await self.connect(communicator)
+        self.assertEqual(response, {'type': 'websocket.accept'})
+
+        other_chat = await sync_to_async(Chat.objects.create)(title='Elsewhere')
+        await sync_to_async(self.create_message)(other_chat, 'not for you')
+        message = await sync_to_async(self.create_message)(self.chat, 'hello')
+
+        output = await communicator.receive_output()
+        event = json.loads(output['text'])
+        self.assertEqual(event['type'], 'message')
+        self.assertEqual(event['message']['id'], str(message.id))
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+    async def test_follows_membership_changes(self):
+        communicator = self.communicator(token=self.token)
+        await self.connect(communicator)
+        chat = await sync_to_async(Chat.objects.create)(title='Joined Later')
+
+        def join():
+            with self.captureOnCommitCallbacks(execute=True):
+                chat.members.add(self.user)
+        await sync_to_async(join)()
+        await sync_to_async(self.create_message)(chat, 'welcome')
+
+        output = await communicator.receive_output()
+        self.assertEqual(json.loads(output['text'])['message']['text'], 'welcome')
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+    async def test_receives_message_batches(self):
+        communicator = self.communicator(token=self.token)
+        await self.connect(communicator)
+
+        def send_batch():
+            messages = [
+                Message(text=text, user=self.other, chat=self.chat) for text in ('one', 'two')]
+            with self.captureOnCommitCallbacks(execute=True):
+                ingest.write_messages(messages, 'default')
+                ingest.publish_messages(messages, 'default')
+        await sync_to_async(send_batch)()
+
+        output = await communicator.receive_output()
+        event = json.loads(output['text'])
+        self.assertEqual(event['type'], 'messages')
+        self.assertEqual([message['text'] for message in event['messages']], ['one', 'two'])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
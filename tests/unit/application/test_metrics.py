@@ -0,0 +1,84 @@
+import atexit
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.handlers.asgi import ASGIHandler
+from django.test import SimpleTestCase, override_settings
+
+from application import metrics
+
+
+class MetricsStoreTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.store = self.create_store()
+
+    def create_store(self):
+        store = metrics.MetricsStore(self.path, buckets=(0.1, 1), flush_interval=60)
+        self.addCleanup(atexit.unregister, store.flush)
+        return store
+
+    def observe(self, store, duration, status=200, queries=2):
+        timings = metrics.Timings()
+        timings.queries = queries
+        timings.db_time = 0.01
+        timings.view_start, timings.view_end = 1.0, 1.05
+        store.observe('message-list', 'GET', status, duration, timings, 0.002)
+
+    def test_histogram(self):
+        self.observe(self.store, 0.05)
+        self.observe(self.store, 0.1)
+        self.observe(self.store, 0.5, status=500)
+        self.observe(self.store, 3)
+        text = self.store.render()
+        route = 'route="message-list",method="GET"'
+        self.assertIn(f'http_requests_total{{{route},status="200"}} 3', text)
+        self.assertIn(f'http_requests_total{{{route},status="500"}} 1', text)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{route},le="0.1"}} 2', text)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{route},le="1.0"}} 3', text)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{route},le="+Inf"}} 4', text)
+        self.assertIn(f'http_request_duration_seconds_sum{{{route}}} 3.65', text)
+        self.assertIn(f'http_request_duration_seconds_count{{{route}}} 4', text)
+        self.assertIn(f'http_request_db_queries_total{{{route}}} 8', text)
+        self.assertIn(f'http_request_view_seconds_total{{{route}}} 0.16', text)
+
+    def test_counts_of_other_processes(self):
+        other = self.create_store()
+        self.observe(other, 0.05)
+        other.flush()
+        os.rename(other.name, os.path.join(self.path, '999999999-exited.json'))
+        self.observe(self.store, 0.05)
+
+        for _ in range(2):
+            data = self.store.collect()
+            self.assertEqual(data['requests'], {('message-list', 'GET', 200): 2})
+            self.assertEqual(data['work'][('message-list', 'GET')][0], 4)
+        # The exited process was folded into the archive.
+        self.assertEqual(
+            sorted(os.listdir(self.path)),
+            sorted(['.lock', metrics.ARCHIVE, os.path.basename(self.store.name)]))
+        with open(os.path.join(self.path, metrics.ARCHIVE)) as file:
+            self.assertEqual(json.load(file)['requests'], [[['message-list', 'GET', 200], 1]])
+
+    def test_forked_process_starts_over(self):
+        self.observe(self.store, 0.05)
+        name = self.store.name
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            self.observe(self.store, 0.05)
+            self.assertNotEqual(self.store.name, name)
+            self.assertEqual(sum(self.store.data['requests'].values()), 1)
+
+    def test_label_escaping(self):
+        self.assertEqual(metrics.labels(route='a"b\\c\nd'), r'{route="a\"b\\c\nd"}')
+
+
+class AsyncMiddlewareTest(SimpleTestCase):
+    @override_settings(DEBUG=True)
+    def test_asgi_chain_is_not_adapted(self):
+        # Django logs each middleware it has to wrap in a thread.
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
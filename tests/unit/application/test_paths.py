@@ -0,0 +1,35 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+from application.paths import private_directory
+
+
+class PrivateDirectoryTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch('tempfile.gettempdir', return_value=directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_private_to_user(self):
+        path = private_directory('shared')
+        self.assertEqual(path, os.path.join(tempfile.gettempdir(), f'shared-{os.getuid()}'))
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+        self.assertEqual(private_directory('shared'), path)
+
+    def test_refuses_shared_directory(self):
+        path = private_directory('shared')
+        os.chmod(path, 0o777)
+        with self.assertRaises(ImproperlyConfigured):
+            private_directory('shared')
+
+    def test_refuses_symlink(self):
+        target = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        os.symlink(target, os.path.join(tempfile.gettempdir(), f'shared-{os.getuid()}'))
+        with self.assertRaises(ImproperlyConfigured):
+            private_directory('shared')
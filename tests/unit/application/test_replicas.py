@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from application import replicas
+from chats.models import Message
+
+
+@override_settings(REPLICAS={'DATABASES': ['replica1', 'replica2']})
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = replicas.ReplicaRouter()
+
+    def test_reads_go_to_primary_by_default(self):
+        self.assertIsNone(self.router.db_for_read(Message))
+
+    def test_reads_go_to_chosen_replica(self):
+        with replicas.use_replica() as alias:
+            self.assertIn(alias, ['replica1', 'replica2'])
+            self.assertEqual(self.router.db_for_read(Message), alias)
+        self.assertIsNone(self.router.db_for_read(Message))
+
+    def test_writes_go_to_primary(self):
+        with replicas.use_replica('replica1'):
+            self.assertEqual(self.router.db_for_write(Message), 'default')
+
+    def test_only_primary_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'chats'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'chats'))
+
+    @override_settings(REPLICAS={'DATABASES': []})
+    def test_no_replicas(self):
+        with replicas.use_replica() as alias:
+            self.assertIsNone(alias)
+
+
+class PinTest(SimpleTestCase):
+    def setUp(self):
+        replicas.get_cache().clear()
+
+    def test_pin(self):
+        self.assertFalse(replicas.is_pinned('user'))
+        replicas.pin('user')
+        self.assertTrue(replicas.is_pinned('user'))
+        self.assertFalse(replicas.is_pinned('other'))
+
+    @override_settings(REPLICAS={'STICKY_SECONDS': 0})
+    def test_pin_disabled(self):
+        replicas.pin('user')
+        self.assertFalse(replicas.is_pinned('user'))
+
+
+class SharedPinTest(SimpleTestCase):
+    def run_worker(self, code, directory):
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': 'application.settings',
+            'DATABASE_REPLICAS': os.path.join(directory, 'replica.sqlite3'),
+        }
+        script = f'import django; django.setup(); from application import replicas; {code}'
+        return subprocess.run(
+            [sys.executable, '-c', script], env=env, cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+
+    def test_pins_are_shared_by_worker_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.run_worker('replicas.pin(1)', directory)
+            self.assertTrue(os.path.isdir(os.path.join(directory, 'replica-pins')))
+            self.assertEqual(self.run_worker('print(replicas.is_pinned(1))', directory), 'True')
+            self.assertEqual(self.run_worker('print(replicas.is_pinned(2))', directory), 'False')
@@ -0,0 +1,179 @@
+import fcntl
+import os
+import sqlite3
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from application.sqlite import base, maintenance
+from application.sqlite.middleware import OverloadedMiddleware
+
+ALIAS = 'sqlite_test'
+
+
+class WriterGateTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'db.sqlite3')
+
+    def test_queue_is_bounded(self):
+        gate = base.WriterGate(self.path, max_queue=0, timeout=1)
+        gate.acquire()
+        with self.assertRaises(base.Overloaded):
+            gate.acquire()
+        gate.release()
+        gate.acquire()
+        gate.release()
+
+    def test_waiters_time_out(self):
+        gate = base.WriterGate(self.path, max_queue=1, timeout=0.01)
+        gate.acquire()
+        with self.assertRaises(base.Overloaded):
+            gate.acquire()
+        gate.release()
+        self.assertFalse(gate.writer.locked())
+
+    def test_waiters_get_their_turn(self):
+        gate = base.WriterGate(self.path, max_queue=1, timeout=5)
+        gate.acquire()
+        waiter = threading.Thread(target=lambda: (gate.acquire(), gate.release()))
+        waiter.start()
+        gate.release()
+        waiter.join()
+        self.assertFalse(gate.writer.locked())
+
+    def test_other_processes_wait(self):
+        gate = base.WriterGate(self.path, max_queue=0, timeout=1)
+        gate.acquire()
+        with open(gate.path) as file:
+            with self.assertRaises(BlockingIOError):
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            gate.release()
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+class ProductionBackendTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'db.sqlite3')
+        connections.settings[ALIAS] = connections.configure_settings({
+            'default': connections.settings['default'],
+            ALIAS: {'ENGINE': 'application.sqlite', 'NAME': self.path},
+        })[ALIAS]
+        self.addCleanup(self.remove_database, directory)
+        self.connection = connections[ALIAS]
+
+    def remove_database(self, directory):
+        connections[ALIAS].close()
+        del connections[ALIAS]
+        del connections.settings[ALIAS]
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    def pragma(self, name):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('auto_vacuum'), 2)
+        self.assertEqual(self.pragma('cache_size'), -64000)
+
+    def test_auto_vacuum_only_on_new_files(self):
+        sqlite3.connect(self.path).execute('CREATE TABLE t (x)').connection.close()
+        statements = []
+        connect = base.base.DatabaseWrapper.get_new_connection
+
+        def traced(wrapper, conn_params):
+            conn = connect(wrapper, conn_params)
+            conn.set_trace_callback(statements.append)
+            return conn
+
+        with mock.patch.object(base.base.DatabaseWrapper, 'get_new_connection', traced):
+            self.assertEqual(self.pragma('journal_mode'), 'wal')
+        # Setting it would wait for the write lock of every other writer.
+        self.assertNotIn('PRAGMA auto_vacuum=INCREMENTAL', statements)
+        self.assertIn('PRAGMA journal_mode=WAL', statements)
+
+    def test_transactions_take_write_lock_up_front(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (x)')
+        other = sqlite3.connect(self.path, timeout=0)
+        self.addCleanup(other.close)
+        gate = base.get_gate(self.path)
+        with transaction.atomic(using=ALIAS):
+            self.assertTrue(gate.writer.locked())
+            with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+                other.execute('INSERT INTO t VALUES (1)')
+        self.assertFalse(gate.writer.locked())
+
+    def test_gate_released_on_rollback(self):
+        gate = base.get_gate(self.path)
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic(using=ALIAS):
+                1 / 0
+        self.assertFalse(gate.writer.locked())
+
+    def fill_and_empty(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (x)')
+            cursor.executemany('INSERT INTO t VALUES (%s)', [('x' * 1000,)] * 2000)
+            cursor.execute('DELETE FROM t')
+        return self.pragma('freelist_count')
+
+    def test_maintenance(self):
+        free = self.fill_and_empty()
+        self.assertGreater(free, 0)
+        stats = maintenance.run(using=ALIAS, step=100, pause=0)
+        self.assertTrue(stats['incremental'])
+        self.assertEqual(stats['freed_pages'], free)
+        self.assertEqual(stats['free_pages'], 0)
+        self.assertEqual(self.pragma('freelist_count'), 0)
+
+    def test_maintenance_command(self):
+        self.fill_and_empty()
+        stdout = StringIO()
+        call_command('sqlite_maintenance', database=[ALIAS], pause=0, stdout=stdout)
+        self.assertIn(f'{ALIAS}: done', stdout.getvalue())
+        self.assertIn('0 left', stdout.getvalue())
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+    def test_maintenance_command_runs_on_every_shard(self):
+        self.fill_and_empty()
+        stdout = StringIO()
+        with override_settings(SHARDING={'DATABASES': [ALIAS]}):
+            call_command('sqlite_maintenance', pause=0, stdout=stdout)
+        self.assertIn(f'{ALIAS}: done', stdout.getvalue())
+        self.assertEqual(self.pragma('freelist_count'), 0)
+
+
+class OverloadedMiddlewareTest(SimpleTestCase):
+    def test_overloaded_is_503(self):
+        middleware = OverloadedMiddleware(lambda request: None)
+        request = RequestFactory().post('/api/messages/')
+        response = middleware.process_exception(request, base.Overloaded())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertIsNone(middleware.process_exception(request, ValueError()))
+
+    def test_async(self):
+        async def get_response(request):
+            return 'response'
+
+        middleware = OverloadedMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = RequestFactory().get('/api/messages/')
+        self.assertEqual(async_to_sync(middleware)(request), 'response')
@@ -1,5 +1,6 @@
 from django.test import SimpleTestCase
 from django.urls import reverse, resolve
+from users import async_views
 from users.views import RegistrationView, LoginView, LogoutView, obtain_jwt_token
 
 
@@ -20,3 +21,15 @@ class TestUrls(SimpleTestCase):
     def test_token_obtain_url(self):
         url = reverse('obtain')
         self.assertEquals(resolve(url).func, obtain_jwt_token)
+
+    def test_async_registration_url(self):
+        url = reverse('async-register')
+        self.assertEquals(resolve(url).func, async_views.register)
+
+    def test_async_login_url(self):
+        url = reverse('async-login')
+        self.assertEquals(resolve(url).func, async_views.login_view)
+
+    def test_async_token_obtain_url(self):
+        url = reverse('async-obtain')
+        self.assertEquals(resolve(url).func, async_views.obtain_jwt_token)
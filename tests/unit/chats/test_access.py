@@ -0,0 +1,49 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from chats import access
+from chats.models import Chat, Membership
+
+User = get_user_model()
+
+
+class MembershipCacheTests(TestCase):
+    def setUp(self):
+        access.cache.clear()
+        self.user = User.objects.create(email='member@test.ru', password='testpass')
+        self.chat = Chat.objects.create(title='Chat')
+        self.other = Chat.objects.create(title='Other')
+        self.chat.members.add(self.user)
+
+    def test_chat_ids_are_cached(self):
+        self.assertEqual(access.get_chat_ids(self.user.pk), {self.chat.pk})
+        with self.assertNumQueries(0):
+            self.assertTrue(access.is_member(self.user.pk, self.chat.pk))
+
+    def test_adding_and_removing_members_invalidates(self):
+        access.get_chat_ids(self.user.pk)
+        self.other.members.add(self.user)
+        self.assertEqual(access.get_chat_ids(self.user.pk), {self.chat.pk, self.other.pk})
+        self.chat.members.remove(self.user)
+        self.assertEqual(access.get_chat_ids(self.user.pk), {self.other.pk})
+        self.user.chats.clear()
+        self.assertEqual(access.get_chat_ids(self.user.pk), frozenset())
+
+    def test_clearing_chat_invalidates(self):
+        access.get_chat_ids(self.user.pk)
+        self.chat.members.clear()
+        self.assertFalse(access.is_member(self.user.pk, self.chat.pk))
+
+    def test_membership_rows_invalidate(self):
+        access.get_chat_ids(self.user.pk)
+        membership = Membership.objects.create(chat=self.other, user=self.user)
+        self.assertIn(self.other.pk, access.get_chat_ids(self.user.pk))
+        membership.delete()
+        self.assertNotIn(self.other.pk, access.get_chat_ids(self.user.pk))
+
+    def test_denial_rechecks_database(self):
+        access.get_chat_ids(self.user.pk)
+        # As if another process had added the member.
+        Membership.objects.bulk_create([Membership(chat=self.other, user=self.user)])
+        with self.assertNumQueries(1):
+            self.assertTrue(access.is_member(self.user.pk, self.other.pk))
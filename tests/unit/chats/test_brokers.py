@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import tempfile
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase
+
+from chats.brokers import MAX_DATAGRAM_SIZE, InProcessBroker, UnixSocketBroker
+from chats import websocket
+from chats.websocket import Connection, CLOSE_TOO_SLOW
+
+
+class InProcessBrokerTest(SimpleTestCase):
+
+    async def test_publish_reaches_subscribers(self):
+        broker = InProcessBroker()
+        received = asyncio.Queue()
+        broker.subscribe(received.put_nowait)
+        broker.publish({'type': 'message', 'chat': 'abc'})
+        data = await asyncio.wait_for(received.get(), 1)
+        self.assertEqual(json.loads(data), {'type': 'message', 'chat': 'abc'})
+
+    async def test_unsubscribe(self):
+        broker = InProcessBroker()
+        received = asyncio.Queue()
+        broker.subscribe(received.put_nowait)
+        broker.unsubscribe(received.put_nowait)
+        broker.publish({'type': 'message', 'chat': 'abc'})
+        await asyncio.sleep(0.01)
+        self.assertTrue(received.empty())
+
+
+class UnixSocketBrokerTest(SimpleTestCase):
+
+    async def test_publish_crosses_broker_instances(self):
+        with tempfile.TemporaryDirectory() as path:
+            subscriber = UnixSocketBroker(path=path)
+            publisher = UnixSocketBroker(path=path)
+            received = asyncio.Queue()
+            subscriber.subscribe(received.put_nowait)
+            try:
+                publisher.publish({'type': 'message', 'chat': 'abc'})
+                data = await asyncio.wait_for(received.get(), 1)
+                self.assertEqual(json.loads(data)['chat'], 'abc')
+            finally:
+                subscriber.close()
+
+    async def test_stale_sockets_are_removed(self):
+        with tempfile.TemporaryDirectory() as path:
+            subscriber = UnixSocketBroker(path=path)
+            subscriber.subscribe(lambda data: None)
+            address = subscriber.address
+            subscriber.receiver.close()
+            subscriber.receiver = None
+            UnixSocketBroker(path=path).publish({'type': 'message', 'chat': 'abc'})
+            self.assertFalse(os.path.exists(address))
+
+    async def test_sockets_are_private(self):
+        with tempfile.TemporaryDirectory() as path:
+            subscriber = UnixSocketBroker(path=path)
+            subscriber.subscribe(lambda data: None)
+            try:
+                self.assertEqual(os.stat(subscriber.address).st_mode & 0o777, 0o600)
+            finally:
+                subscriber.close()
+
+    async def test_large_batches_are_split(self):
+        with tempfile.TemporaryDirectory() as path:
+            subscriber = UnixSocketBroker(path=path)
+            received = asyncio.Queue()
+            subscriber.subscribe(received.put_nowait)
+            messages = [{'id': str(i), 'text': 'x' * 3000} for i in range(100)]
+            try:
+                UnixSocketBroker(path=path).publish(
+                    {'type': 'messages', 'chat': 'abc', 'messages': messages})
+                ids = []
+                while len(ids) < len(messages):
+                    event = json.loads(await asyncio.wait_for(received.get(), 1))
+                    ids += [message['id'] for message in event['messages']]
+                self.assertEqual(ids, [message['id'] for message in messages])
+            finally:
+                subscriber.close()
+
+    def test_oversized_event_is_logged(self):
+        with tempfile.TemporaryDirectory() as path:
+            broker = UnixSocketBroker(path=path)
+            with self.assertLogs('chats.brokers', 'WARNING'):
+                broker.publish({'type': 'message', 'chat': 'abc', 'message': {
+                    'text': 'x' * MAX_DATAGRAM_SIZE}})
+
+    def test_default_directory_is_private(self):
+        with tempfile.TemporaryDirectory() as path:
+            with mock.patch('tempfile.gettempdir', return_value=path):
+                broker = UnixSocketBroker()
+            self.assertEqual(broker.path, os.path.join(path, f'pythontests-realtime-{os.getuid()}'))
+            self.assertEqual(os.stat(broker.path).st_mode & 0o777, 0o700)
+
+
+class ConnectionTest(SimpleTestCase):
+
+    async def test_slow_connection_is_closed(self):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+            await asyncio.sleep(1)
+
+        connection = Connection('user', {'chat'}, send)
+        for i in range(5):
+            connection.push(str(i), max_pending=2)
+        await asyncio.sleep(0.01)
+        self.assertTrue(connection.closed)
+        self.assertIn({'type': 'websocket.close', 'code': CLOSE_TOO_SLOW}, sent)
+
+
+class HubTest(SimpleTestCase):
+    def test_hubs_of_closed_loops_are_dropped(self):
+        broker = InProcessBroker()
+
+        async def get_hub():
+            return websocket.get_hub()
+
+        with mock.patch('chats.websocket.get_broker', return_value=broker), \
+                mock.patch.dict(websocket._hubs, clear=True):
+            # Each call runs on a new event loop, as under WSGI.
+            first = async_to_sync(get_hub)()
+            second = async_to_sync(get_hub)()
+            self.assertIsNot(first, second)
+            self.assertEqual(len(websocket._hubs), 1)
+            self.assertEqual([callback for loop, callback in broker.subscribers],
+                             [second.on_event])
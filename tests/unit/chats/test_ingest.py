@@ -0,0 +1,120 @@
+import threading
+import uuid
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from chats import ingest
+from chats.models import Chat, Membership, Message
+
+User = get_user_model()
+
+
+class WriteMessagesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@top.com', password='password')
+        self.other = User.objects.create_user(email='other@top.com', password='password')
+        self.chats = [Chat.objects.create(title=f'Chat {i}') for i in range(2)]
+        for chat in self.chats:
+            Membership.objects.create(chat=chat, user=self.user)
+            Membership.objects.create(chat=chat, user=self.other)
+        Message.objects.create(chat=self.chats[0], user=self.user, text='first')
+
+    def test_one_seq_range_per_chat(self):
+        first, second = self.chats
+        messages = [
+            Message(chat=first, user=self.other, text='a'),
+            Message(chat=second, user=self.user, text='b'),
+            Message(chat=first, user=self.user, text='c'),
+        ]
+        versions = dict(Chat.objects.values_list('pk', 'version'))
+        with CaptureQueriesContext(connection) as queries:
+            ingest.write_messages(messages, 'default')
+        inserts = [query for query in queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+
+        self.assertEqual([message.seq for message in messages], [2, 1, 3])
+        first.refresh_from_db()
+        self.assertEqual(first.last_message_seq, 3)
+        self.assertEqual(first.last_message_id, messages[2].pk)
+        self.assertEqual(first.version, versions[first.pk] + 1)
+        # Authors have read up to their own last message.
+        self.assertEqual(
+            {(chat_id, user_id): counters for chat_id, user_id, *counters in
+             Membership.objects.values_list('chat_id', 'user_id', 'last_read_seq', 'unread_count')},
+            {
+                (first.pk, self.user.pk): [3, 0],
+                (first.pk, self.other.pk): [2, 1],
+                (second.pk, self.user.pk): [1, 0],
+                (second.pk, self.other.pk): [0, 1],
+            })
+
+    def test_failed_message_does_not_fail_the_batch(self):
+        group = ingest.GroupCommit('default', 10, 0)
+        entries = [
+            ingest.Entry(Message(chat=self.chats[0], user=self.user, text='a')),
+            ingest.Entry(Message(chat_id=uuid.uuid4(), user=self.user, text='lost')),
+            ingest.Entry(Message(chat=self.chats[1], user=self.user, text='b')),
+        ]
+        group.commit(entries)
+
+        self.assertIsNone(entries[0].error)
+        self.assertIsInstance(entries[1].error, Chat.DoesNotExist)
+        self.assertIsNone(entries[2].error)
+        self.assertTrue(all(entry.done for entry in entries))
+        self.assertFalse(group.leading)
+        self.assertEqual(
+            sorted(Message.objects.values_list('text', 'seq')),
+            [('a', 2), ('b', 1), ('first', 1)])
+
+    @override_settings(MESSAGE_INGEST={'GROUP_COMMIT': True})
+    def test_saved_directly_inside_transaction(self):
+        with mock.patch.object(ingest.GroupCommit, 'submit') as submit:
+            message = ingest.create_message(chat=self.chats[0], user=self.user, text='a')
+        submit.assert_not_called()
+        self.assertEqual(message.seq, 2)
+
+
+@override_settings(MESSAGE_INGEST={'GROUP_COMMIT': True, 'BATCH_SIZE': 4, 'MAX_WAIT': 0.2})
+class GroupCommitTest(TransactionTestCase):
+    def setUp(self):
+        ingest._groups.clear()
+        self.addCleanup(ingest._groups.clear)
+        self.user = User.objects.create_user(email='user@top.com', password='password')
+        self.reader = User.objects.create_user(email='reader@top.com', password='password')
+        self.chat = Chat.objects.create(title='Chat')
+        Membership.objects.create(chat=self.chat, user=self.user)
+        Membership.objects.create(chat=self.chat, user=self.reader)
+
+    def create(self, text, results):
+        try:
+            results[text] = ingest.create_message(chat_id=self.chat.pk, user=self.user, text=text)
+        finally:
+            connection.close()
+
+    def test_concurrent_messages_commit_together(self):
+        results = {}
+        threads = [
+            threading.Thread(target=self.create, args=(f'message {i}', results))
+            for i in range(8)
+        ]
+        with mock.patch('chats.ingest.write_messages', wraps=ingest.write_messages) as write, \
+                mock.patch('chats.signals.get_broker') as get_broker:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(results), 8)
+        self.assertLess(write.call_count, 8)
+        self.assertTrue(all(len(call.args[0]) <= 4 for call in write.call_args_list))
+        self.assertEqual(get_broker().publish.call_count, 8)
+        self.assertEqual(
+            sorted(message.seq for message in results.values()), list(range(1, 9)))
+        self.assertEqual(Message.objects.count(), 8)
+        self.assertEqual(Membership.objects.get(user=self.reader).unread_count, 8)
+        author = Membership.objects.get(user=self.user)
+        self.assertEqual((author.last_read_seq, author.unread_count), (8, 0))
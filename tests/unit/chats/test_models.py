@@ -123,6 +123,77 @@ class MessageModelTest(TestCase):
     def test_message_str_method(self):
         self.assertEqual(str(self.message), self.message.text)
 
+    def test_message_seq_is_allocated_per_chat(self):
+        second = Message.objects.create(text='Second', chat=self.chat)
+        other_chat = Chat.objects.create(title='Other Chat')
+        other = Message.objects.create(text='Other', chat=other_chat)
+        self.chat.refresh_from_db()
+        self.assertEqual(self.message.seq, 1)
+        self.assertEqual(second.seq, 2)
+        self.assertEqual(other.seq, 1)
+        self.assertEqual(self.chat.last_message_seq, 2)
+
     def test_message_chat_cascade_delete(self):
         self.chat.delete()
         self.assertFalse(Message.objects.filter(id=self.message.id).exists())
+
+
+class ChatVersionTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email='test@test.ru', password='testpass')
+        self.chat = Chat.objects.create(title='Test Chat', admin=self.user)
+
+    def assertTouched(self, chat=None):
+        chat = chat or self.chat
+        version = Chat.objects.values_list('version', flat=True).get(pk=chat.pk)
+        self.assertGreater(version, chat.version)
+        chat.refresh_from_db()
+
+    def test_save_touches_chat(self):
+        self.chat.refresh_from_db()
+        self.chat.title = 'Renamed'
+        self.chat.save()
+        self.assertTouched()
+
+    def test_new_message_touches_chat(self):
+        self.chat.refresh_from_db()
+        modified_at = self.chat.modified_at
+        Message.objects.create(text='Hi', user=self.user, chat=self.chat)
+        self.assertTouched()
+        self.assertGreater(self.chat.modified_at, modified_at)
+
+    def test_message_edit_and_delete_touch_chat(self):
+        message = Message.objects.create(text='Hi', user=self.user, chat=self.chat)
+        self.chat.refresh_from_db()
+        message.text = 'Edited'
+        message.save()
+        self.assertTouched()
+        message.delete()
+        self.assertTouched()
+
+    def test_moving_message_touches_both_chats(self):
+        other = Chat.objects.create(title='Other')
+        message = Message.objects.create(text='Hi', user=self.user, chat=self.chat)
+        self.chat.refresh_from_db()
+        other.refresh_from_db()
+        message.chat = other
+        message.save()
+        self.assertTouched()
+        self.assertTouched(other)
+
+    def test_membership_changes_touch_chat(self):
+        self.chat.refresh_from_db()
+        self.chat.members.add(self.user)
+        self.assertTouched()
+        self.user.chats.clear()
+        self.assertTouched()
+
+    def test_deleting_user_touches_their_chats(self):
+        other = Chat.objects.create(title='Other')
+        Message.objects.create(text='Hi', user=self.user, chat=other)
+        self.chat.refresh_from_db()
+        other.refresh_from_db()
+        self.user.delete()
+        self.assertTouched()
+        self.assertTouched(other)
@@ -0,0 +1,50 @@
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
+
+from chats import renderers
+from chats.renderers import FastJSONRenderer
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    def assertSameBytes(self, data, accepted_media_type=None):
+        self.assertEqual(
+            FastJSONRenderer().render(data, accepted_media_type),
+            JSONRenderer().render(data, accepted_media_type))
+
+    def test_matches_json_renderer(self):
+        self.assertSameBytes([
+            OrderedDict([('id', uuid.uuid4()), ('text', 'Привет 👋 "q" \\ /')]),
+            {'created_at': datetime(2023, 5, 1, 12, 30, 1, 123456, tzinfo=timezone.utc)},
+            {'naive': datetime(2023, 5, 1, 12, 30)},
+            {'seq': 2 ** 63 - 1, 'is_read': False, 'user': None, 'members': []},
+            {'detail': ErrorDetail('Not found.', code='not_found')},
+            {'lazy': gettext_lazy('Not found.')},
+        ])
+
+    def test_control_characters(self):
+        self.assertSameBytes({'text': ''.join(chr(c) for c in range(0x80))})
+
+    def test_line_terminators(self):
+        rendered = FastJSONRenderer().render({'text': 'a\u2028b\u2029c'})
+        self.assertEqual(rendered, b'{"text":"a\\u2028b\\u2029c"}')
+
+    def test_falls_back_for_unsupported_data(self):
+        self.assertSameBytes({'big': 2 ** 64})
+        self.assertSameBytes({1: 'integer key'})
+
+    def test_indent(self):
+        self.assertSameBytes({'a': [1, 2]}, 'application/json; indent=4')
+
+    def test_none(self):
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_without_orjson(self):
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertSameBytes({'text': 'Привет'})
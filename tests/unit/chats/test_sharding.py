@@ -0,0 +1,90 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, override_settings
+
+from chats import sharding
+from chats.models import Chat, ChatPlacement, Message
+
+User = get_user_model()
+
+SHARDS = ['default', 'shard1', 'shard2']
+
+
+@override_settings(SHARDING={'DATABASES': SHARDS})
+class HashShardTestCase(SimpleTestCase):
+    def test_is_stable(self):
+        chat_id = uuid.uuid4()
+        self.assertEqual(sharding.hash_shard(chat_id), sharding.hash_shard(str(chat_id)))
+        self.assertIn(sharding.hash_shard(chat_id), SHARDS)
+
+    def test_spreads_chats(self):
+        counts = dict.fromkeys(SHARDS, 0)
+        for _ in range(3000):
+            counts[sharding.hash_shard(uuid.uuid4())] += 1
+        for count in counts.values():
+            self.assertGreater(count, 800)
+
+    def test_added_shard_only_takes_chats(self):
+        chat_ids = [uuid.uuid4() for _ in range(1000)]
+        for chat_id in chat_ids:
+            before = sharding.hash_shard(chat_id, SHARDS)
+            after = sharding.hash_shard(chat_id, SHARDS + ['shard3'])
+            self.assertIn(after, (before, 'shard3'))
+
+
+class MergeTestCase(SimpleTestCase):
+    def test_merges_sorted_lists(self):
+        now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        rows = [SimpleNamespace(created_at=now + timedelta(seconds=i), id=i) for i in range(6)]
+        merged = sharding.merge(
+            [[rows[4], rows[1]], [rows[5], rows[3], rows[2]], [rows[0]]], ['-created_at', 'id'])
+        self.assertEqual(merged, list(reversed(rows)))
+
+    def test_single_list_is_kept(self):
+        rows = [SimpleNamespace(id=2), SimpleNamespace(id=1)]
+        self.assertIs(sharding.merge([rows], ['id']), rows)
+
+
+@override_settings(SHARDING={'DATABASES': SHARDS})
+class ShardRouterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.router = sharding.ShardRouter()
+
+    def test_new_chat_goes_to_hash_shard(self):
+        chat = Chat(title='Chat')
+        self.assertEqual(
+            self.router.db_for_write(Chat, instance=chat), sharding.hash_shard(chat.pk))
+
+    def test_instance_keeps_its_database(self):
+        message = Message(chat_id=uuid.uuid4(), text='Hi')
+        message._state.adding = False
+        message._state.db = 'shard2'
+        self.assertEqual(self.router.db_for_write(Message, instance=message), 'shard2')
+
+    def test_bound_shard(self):
+        self.assertIsNone(self.router.db_for_read(Message))
+        with sharding.use_shard('shard1'):
+            self.assertEqual(self.router.db_for_read(Message), 'shard1')
+            self.assertEqual(sharding.gather(lambda: sharding.shard.get()), ['shard1'])
+        self.assertEqual(sharding.gather(lambda: sharding.shard.get()), SHARDS)
+
+    def test_other_models_stay_on_default(self):
+        with sharding.use_shard('shard1'):
+            self.assertIsNone(self.router.db_for_read(User))
+            self.assertIsNone(self.router.db_for_write(ChatPlacement))
+
+    def test_allow_migrate(self):
+        self.assertTrue(self.router.allow_migrate('shard1', 'chats', 'message'))
+        self.assertFalse(self.router.allow_migrate('shard1', 'chats', 'chatplacement'))
+        self.assertFalse(self.router.allow_migrate('shard1', 'users', 'user'))
+        self.assertTrue(self.router.allow_migrate('default', 'users', 'user'))
+        self.assertIsNone(self.router.allow_migrate('replica1', 'chats', 'message'))
+
+    @override_settings(SHARDING={'DATABASES': ['default']})
+    def test_unsharded(self):
+        self.assertIsNone(self.router.db_for_write(Chat, instance=Chat(title='Chat')))
+        self.assertIsNone(self.router.allow_migrate('default', 'chats', 'message'))
+        self.assertEqual(sharding.locate(uuid.uuid4()), 'default')
@@ -1,6 +1,7 @@
 from django.test import SimpleTestCase
 from django.urls import reverse, resolve
 from chats.views import ChatViewSet, MessageViewSet
+from chats.streaming import poll_messages, stream_messages
 
 
 class TestUrls(SimpleTestCase):
@@ -28,3 +29,31 @@ class TestUrls(SimpleTestCase):
     def test_message_detail_url(self):
         url = reverse('message-get-unread-messages')
         self.assertEquals(resolve(url).func.cls, MessageViewSet)
+
+    def test_chat_mark_read_url(self):
+        url = reverse('chat-mark-read', kwargs={'pk': 1})
+        self.assertEquals(resolve(url).func.cls, ChatViewSet)
+
+    def test_message_unread_summary_url(self):
+        url = reverse('message-get-unread-summary')
+        self.assertEquals(resolve(url).func.cls, MessageViewSet)
+
+    def test_message_poll_url(self):
+        url = reverse('message-poll')
+        self.assertEquals(resolve(url).func, poll_messages)
+
+    def test_message_stream_url(self):
+        url = reverse('message-stream')
+        self.assertEquals(resolve(url).func, stream_messages)
+
+    def test_chat_remove_members_url(self):
+        url = reverse('chat-remove-members', kwargs={'pk': 1})
+        self.assertEquals(resolve(url).func.cls, ChatViewSet)
+
+    def test_message_search_url(self):
+        url = reverse('message-search')
+        self.assertEquals(resolve(url).func.cls, MessageViewSet)
+
+    def test_chat_inbox_url(self):
+        url = reverse('chat-inbox')
+        self.assertEquals(resolve(url).func.cls, ChatViewSet)
@@ -0,0 +1,109 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from tasks import queue
+from tasks.models import Job
+from tasks.worker import Worker
+
+calls = []
+
+
+def record(*args, **kwargs):
+    calls.append((args, kwargs))
+
+
+def explode():
+    raise ValueError('boom')
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue(self):
+        job = queue.enqueue(record, args=[1], kwargs={'a': 2}, priority=3)
+        self.assertEqual(job.task, 'tests.unit.tasks.test_queue.record')
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.max_attempts, 5)
+
+    def test_claim_orders_by_priority_then_age(self):
+        low = queue.enqueue(record, priority=0)
+        high = queue.enqueue(record, priority=10)
+        older = queue.enqueue(record, priority=0)
+        token, jobs = queue.claim('worker', limit=2)
+        self.assertEqual([job.pk for job in jobs], [high.pk, low.pk])
+        self.assertTrue(all(job.status == Job.RUNNING for job in jobs))
+        self.assertTrue(all(job.locked_by == token for job in jobs))
+        self.assertTrue(all(job.attempts == 1 for job in jobs))
+        _, jobs = queue.claim('worker', limit=2)
+        self.assertEqual([job.pk for job in jobs], [older.pk])
+        self.assertEqual(queue.claim('worker', limit=2)[1], [])
+
+    def test_claim_skips_delayed_jobs(self):
+        queue.enqueue(record, delay=60)
+        self.assertEqual(queue.claim('worker')[1], [])
+
+    def test_process_batch(self):
+        queue.enqueue_many([(record, [1]), (record, [2], {'b': 3})])
+        self.assertEqual(queue.process_batch('worker', limit=10), 2)
+        self.assertEqual(calls, [((1,), {}), ((2,), {'b': 3})])
+        self.assertFalse(Job.objects.exists())
+
+    def test_failure_is_retried_with_backoff(self):
+        job = queue.enqueue(explode)
+        queue.process_batch('worker')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('ValueError: boom', job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=3))
+        self.assertIsNone(job.locked_by)
+
+    def test_backoff_grows(self):
+        with mock.patch('tasks.queue.random.uniform', return_value=1):
+            self.assertEqual(
+                [queue.get_backoff(attempt) for attempt in (1, 2, 3)], [5, 10, 20])
+            self.assertEqual(queue.get_backoff(20), 3600)
+
+    def test_failure_after_max_attempts(self):
+        job = queue.enqueue(explode, max_attempts=1)
+        queue.process_batch('worker')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(queue.claim('worker')[1], [])
+
+    def test_release_expired(self):
+        retried = queue.enqueue(record)
+        exhausted = queue.enqueue(record, max_attempts=1)
+        queue.claim('worker', limit=2)
+        self.assertEqual(queue.release_expired(), (0, 0))
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(queue.release_expired(), (1, 1))
+        retried.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual(retried.status, Job.QUEUED)
+        self.assertEqual(exhausted.status, Job.FAILED)
+
+    def test_late_ack_does_not_touch_reclaimed_job(self):
+        queue.enqueue(record)
+        token, jobs = queue.claim('worker')
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        queue.release_expired()
+        queue.claim('other')
+        queue.complete([jobs[0].pk], token)
+        self.assertTrue(Job.objects.filter(status=Job.RUNNING).exists())
+
+    def test_worker_burst(self):
+        for i in range(25):
+            queue.enqueue(record, args=[i])
+        self.assertEqual(Worker(batch_size=10, burst=True).run(), 25)
+        self.assertEqual(len(calls), 25)
+
+    def test_run_worker_command(self):
+        queue.enqueue(record)
+        out = StringIO()
+        call_command('run_worker', processes=1, burst=True, stdout=out)
+        self.assertIn('Ran 1 jobs', out.getvalue())
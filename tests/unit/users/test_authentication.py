@@ -0,0 +1,45 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+from users.authentication import LRUCache
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_get_and_set(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_entries_expire(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        with mock.patch('users.authentication.time.monotonic', return_value=100):
+            cache.set('a', 1)
+            cache.set('b', 2, ttl=5)
+        with mock.patch('users.authentication.time.monotonic', return_value=110):
+            self.assertEqual(cache.get('a'), 1)
+            self.assertIsNone(cache.get('b'))
+
+    def test_non_positive_ttl_is_not_cached(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1, ttl=-1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_set_skipped_after_invalidation(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        generation = cache.generation
+        cache.delete('a')
+        cache.set('a', 1, generation=generation)
+        self.assertIsNone(cache.get('a'))
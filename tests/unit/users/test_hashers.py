@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+from django.contrib.auth.hashers import make_password
+from django.test import SimpleTestCase, override_settings
+from users.hashers import HashingPool, Overloaded, verify_password
+
+
+@override_settings(PASSWORD_HASHING={'ITERATIONS': 1000})
+class ConfigurableHasherTests(SimpleTestCase):
+    def test_uses_configured_iterations(self):
+        self.assertTrue(make_password('secret').startswith('pbkdf2_sha256$1000$'))
+
+    def test_verify_password(self):
+        encoded = make_password('secret')
+        self.assertEqual(verify_password('secret', encoded), (True, None))
+        self.assertEqual(verify_password('wrong', encoded), (False, None))
+
+    def test_verify_password_upgrades_other_iterations(self):
+        with override_settings(PASSWORD_HASHING={'ITERATIONS': 2000}):
+            encoded = make_password('secret')
+        valid, upgraded = verify_password('secret', encoded)
+        self.assertTrue(valid)
+        self.assertTrue(upgraded.startswith('pbkdf2_sha256$1000$'))
+
+
+class HashingPoolTests(SimpleTestCase):
+    def test_run(self):
+        pool = HashingPool(max_workers=1, max_queue=0)
+        self.assertEqual(asyncio.run(pool.run(sum, [1, 2])), 3)
+
+    def test_fails_fast_when_full(self):
+        pool = HashingPool(max_workers=1, max_queue=1)
+        release = threading.Event()
+
+        async def main():
+            first = asyncio.ensure_future(pool.run(release.wait))
+            second = asyncio.ensure_future(pool.run(release.wait))
+            await asyncio.sleep(0)
+            with self.assertRaises(Overloaded):
+                await pool.run(release.wait)
+            with self.assertRaises(Overloaded):
+                with pool.slot():
+                    pass
+            release.set()
+            await asyncio.gather(first, second)
+            self.assertEqual(await pool.run(sum, [1]), 1)
+
+        asyncio.run(main())
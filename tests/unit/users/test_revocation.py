@@ -0,0 +1,79 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+from users.revocation import BloomFilter, RevocationList
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = [f'jti-{i}' for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f'jti-{i}')
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class RevocationListTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'revoked')
+
+    def test_add_and_check(self):
+        revocations = RevocationList(self.path, capacity=10)
+        self.assertNotIn('a', revocations)
+        revocations.add('a', time.time() + 60)
+        self.assertIn('a', revocations)
+        self.assertNotIn('b', revocations)
+
+    def test_shared_between_workers(self):
+        first = RevocationList(self.path, capacity=10)
+        second = RevocationList(self.path, capacity=10)
+        self.assertNotIn('a', second)
+        first.add('a', time.time() + 60)
+        self.assertIn('a', second)
+
+    def test_grows_past_capacity(self):
+        revocations = RevocationList(self.path, capacity=2)
+        for i in range(10):
+            revocations.add(f'jti-{i}', time.time() + 60)
+        self.assertTrue(all(f'jti-{i}' in revocations for i in range(10)))
+
+    def test_expired_entries_are_ignored(self):
+        revocations = RevocationList(self.path, capacity=10)
+        revocations.add('old', time.time() - 1)
+        self.assertNotIn('old', revocations)
+
+    def test_expired_entries_are_pruned(self):
+        revocations = RevocationList(self.path, capacity=10)
+        revocations.add('a', time.time() + 60)
+        with mock.patch('users.revocation.time.time', return_value=time.time() + 120):
+            revocations.prune()
+        self.assertEqual(revocations.expires, {})
+
+    def test_compaction_is_picked_up_by_other_workers(self):
+        first = RevocationList(self.path, capacity=10)
+        second = RevocationList(self.path, capacity=10)
+        first.add('a', time.time() + 60)
+        first.add('b', time.time() + 1)
+        self.assertIn('b', second)
+        with mock.patch('users.revocation.time.time', return_value=time.time() + 30):
+            first.compact()
+            self.assertIn('a', second)
+            self.assertNotIn('b', second)
+
+    def test_files_are_private(self):
+        revocations = RevocationList(self.path, capacity=10)
+        revocations.add('a', time.time() + 60)
+        revocations.compact()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
@@ -76,7 +76,8 @@ class UserSerializerTests(APITestCase):
 
     def test_serializer_returns_all_fields(self):
         expected_fields = ['id', 'email', 'first_name', 'last_name',
-                           'is_active', 'is_staff', 'date_joined', 'avatar']
+                           'is_active', 'is_staff', 'date_joined', 'avatar',
+                           'avatar_thumbnails']
         data = self.serializer.data
         self.assertCountEqual(data.keys(), expected_fields)
 
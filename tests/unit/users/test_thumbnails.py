@@ -0,0 +1,117 @@
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from chats.models import Chat
+from PIL import Image
+from tasks.models import Job
+from users import thumbnails
+from users.models import User
+from users.serializers import UserSerializer
+
+
+def make_image(size=(400, 300), image_format='PNG', mode='RGBA'):
+    output = BytesIO()
+    Image.new(mode, size, (200, 20, 20, 128)[:len(mode)]).save(output, image_format)
+    return output.getvalue()
+
+
+@override_settings(AVATAR_THUMBNAILS={'SIZES': [32, 64], 'FORMATS': ['webp', 'jpeg'], 'QUALITY': 80})
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword',
+            first_name='John',
+            last_name='Doe',
+            avatar=SimpleUploadedFile('avatar.png', make_image(), content_type='image/png'),
+        )
+
+    def test_generate(self):
+        digest = thumbnails.generate(make_image())
+        for size in (32, 64):
+            with default_storage.open(thumbnails.thumbnail_name(digest, size, 'webp')) as file:
+                with Image.open(file) as image:
+                    self.assertEqual(image.format, 'WEBP')
+                    self.assertEqual(image.size, (size, size))
+            with default_storage.open(thumbnails.thumbnail_name(digest, size, 'jpeg')) as file:
+                with Image.open(file) as image:
+                    self.assertEqual(image.format, 'JPEG')
+
+    def test_same_content_same_name(self):
+        self.assertEqual(thumbnails.generate(make_image()), thumbnails.generate(make_image()))
+        self.assertNotEqual(
+            thumbnails.generate(make_image()), thumbnails.generate(make_image(mode='RGB')))
+
+    def test_process_sets_hash(self):
+        digest = thumbnails.process('users.User', self.user.pk, self.user.avatar.name)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_hash, digest)
+
+    def test_process_skips_replaced_avatar(self):
+        name = self.user.avatar.name
+        User.objects.filter(pk=self.user.pk).update(avatar='avatars/other.png')
+        thumbnails.process('users.User', self.user.pk, name)
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.avatar_hash)
+
+    def test_process_invalid_image(self):
+        name = default_storage.save('avatars/broken.png', SimpleUploadedFile('broken.png', b'nope'))
+        with self.assertLogs('users.thumbnails', 'WARNING'):
+            self.assertIsNone(thumbnails.process('users.User', self.user.pk, name))
+
+    def test_scheduled_on_save(self):
+        jobs = Job.objects.filter(task='users.thumbnails.process')
+        self.assertEqual(
+            list(jobs.values_list('args', flat=True)),
+            [['users.User', str(self.user.pk), self.user.avatar.name]])
+        self.user.save(update_fields=['last_login'])
+        self.user.save()
+        User.objects.get(pk=self.user.pk).save()
+        self.assertEqual(jobs.count(), 1)
+        user = User.objects.get(pk=self.user.pk)
+        user.avatar = SimpleUploadedFile('other.png', make_image(mode='RGB'), content_type='image/png')
+        user.save()
+        self.assertEqual(jobs.count(), 2)
+        self.assertEqual(jobs.latest('id').args, ['users.User', str(user.pk), user.avatar.name])
+
+    def test_default_avatar_not_scheduled(self):
+        jobs = Job.objects.filter(task='users.thumbnails.process')
+        jobs.delete()
+        user = User.objects.create_user(email='other@example.com', password='testpassword')
+        self.assertEqual(user.avatar.name, 'avatars/default_avatar.jpg')
+        user.save()
+        self.assertFalse(jobs.exists())
+
+    def test_scheduled_for_chats(self):
+        jobs = Job.objects.filter(task='users.thumbnails.process', args__0='chats.Chat')
+        chat = Chat.objects.create(title='Chat', admin=self.user)
+        chat.title = 'Renamed'
+        chat.save()
+        self.assertFalse(jobs.exists())
+        chat.avatar = SimpleUploadedFile('chat.png', make_image(), content_type='image/png')
+        chat.save(update_fields=['avatar'])
+        self.assertEqual(list(jobs.values_list('args', flat=True)),
+                         [['chats.Chat', str(chat.pk), chat.avatar.name]])
+
+    def test_serializer(self):
+        self.assertIsNone(UserSerializer(self.user).data['avatar_thumbnails'])
+        thumbnails.process('users.User', self.user.pk, self.user.avatar.name)
+        self.user.refresh_from_db()
+        data = UserSerializer(self.user).data['avatar_thumbnails']
+        self.assertEqual(set(data), {'32', '64'})
+        self.assertTrue(data['64']['webp'].endswith(f'/avatars/thumbs/{self.user.avatar_hash}-64.webp'))
+
+    def test_thumbnail_url(self):
+        self.assertEqual(thumbnails.thumbnail_url(self.user, 50), self.user.avatar.url)
+        self.user.avatar_hash = 'abc'
+        self.assertTrue(thumbnails.thumbnail_url(self.user, 50).endswith('abc-64.webp'))
+        self.assertTrue(thumbnails.thumbnail_url(self.user, 500).endswith('abc-64.webp'))
@@ -20,3 +20,11 @@ class TestUrls(SimpleTestCase):
     def test_user_active_url(self):
         url = reverse('user-active-users')
         self.assertEquals(resolve(url).func.cls, UserViewSet)
+
+    def test_user_autocomplete_url(self):
+        url = reverse('user-autocomplete')
+        self.assertEquals(resolve(url).func.cls, UserViewSet)
+
+    def test_user_auth_cache_url(self):
+        url = reverse('user-auth-cache')
+        self.assertEquals(resolve(url).func.cls, UserViewSet)
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from .models import User
+from .thumbnails import thumbnail_url
 
 
 class UserAdmin(admin.ModelAdmin):
@@ -18,7 +19,7 @@ class UserAdmin(admin.ModelAdmin):
     ordering = ['email']
 
     def avatar_display(self, obj):
-        return format_html('<img src="{}" width="50" height="50" />', obj.avatar.url)
+        return format_html('<img src="{}" width="50" height="50" />', thumbnail_url(obj, 50))
 
     avatar_display.short_description = 'Avatar'
 
@@ -0,0 +1,126 @@
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import login
+from django.contrib.auth.hashers import make_password
+from django.http import JsonResponse
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .hashers import Overloaded, get_pool, verify_password
+from .models import User
+from .serializers import UserSerializer
+
+
+def error(status, data):
+    return JsonResponse(data, status=status, encoder=JSONEncoder)
+
+
+def overloaded():
+    response = error(503, {'detail': 'Too many authentication requests, try again shortly.'})
+    response['Retry-After'] = '1'
+    return response
+
+
+def get_data(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+def get_tokens(user):
+    refresh = RefreshToken.for_user(user)
+    return {
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+    }
+
+
+@sync_to_async
+def get_user(email):
+    return User.objects.filter(email=email).first()
+
+
+@sync_to_async
+def update_password(user, encoded):
+    user.password = encoded
+    User.objects.filter(pk=user.pk).update(password=encoded)
+
+
+async def authenticate(email, password):
+    """
+    Same checks as ModelBackend, with the hashing done in the hashing pool
+    and the database work in sync_to_async threads.
+    """
+    if not email or not password:
+        return None
+    user = await get_user(email)
+    if user is None:
+        # Hash anyway so unknown emails take as long as wrong passwords.
+        await get_pool().run(make_password, password)
+        return None
+    valid, upgraded = await get_pool().run(verify_password, password, user.password)
+    if not valid or not user.is_active:
+        return None
+    if upgraded is not None:
+        await update_password(user, upgraded)
+    return user
+
+
+def post_only(view):
+    @wraps(view)
+    async def wrapper(request):
+        if request.method != 'POST':
+            return error(405, {'detail': f'Method "{request.method}" not allowed.'})
+        data = get_data(request)
+        if data is None:
+            return error(400, {'detail': 'Invalid JSON body.'})
+        try:
+            return await view(request, data)
+        except Overloaded:
+            return overloaded()
+    # Token endpoints, like DRF's views; Django 4.2's csrf_exempt() would
+    # wrap the coroutine function in a sync one.
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+@post_only
+async def register(request, data):
+    """
+    Async counterpart of RegistrationView.
+    """
+    serializer = UserSerializer(data=data)
+    if not await sync_to_async(serializer.is_valid)():
+        return error(400, serializer.errors)
+    password = await get_pool().run(make_password, data.get('password') or None)
+    user = await sync_to_async(serializer.save)(password=password)
+    return JsonResponse(get_tokens(user), status=201)
+
+
+@post_only
+async def login_view(request, data):
+    """
+    Async counterpart of LoginView.
+    """
+    user = await authenticate(data.get('email'), data.get('password'))
+    if user is None:
+        return error(400, {'detail': 'Invalid email or password.'})
+    await sync_to_async(login)(request, user)
+    return JsonResponse(get_tokens(user))
+
+
+@post_only
+async def obtain_jwt_token(request, data):
+    """
+    Async counterpart of views.obtain_jwt_token.
+    """
+    user = await authenticate(data.get('email'), data.get('password'))
+    if user is None:
+        return error(400, {'error': 'Invalid credentials'})
+    return JsonResponse(get_tokens(user))
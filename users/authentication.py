@@ -0,0 +1,124 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .revocation import is_revoked
+
+
+def get_setting(name, default):
+    return getattr(settings, 'AUTH_CACHE', {}).get(name, default)
+
+
+class LRUCache:
+    """
+    Thread-safe LRU mapping whose entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None, generation=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                # Something was invalidated while the value was being
+                # loaded, so it may already be stale.
+                return
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+token_cache = LRUCache(
+    get_setting('MAX_TOKENS', 10000), get_setting('TTL', 60))
+user_cache = LRUCache(
+    get_setting('MAX_USERS', 10000), get_setting('TTL', 60))
+
+
+def invalidate_user(user_id):
+    user_cache.delete(str(user_id))
+
+
+def stats():
+    return {'tokens': token_cache.stats(), 'users': user_cache.stats()}
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that remembers decoded tokens and their users.
+
+    Entries live for AUTH_CACHE['TTL'] seconds at most, never past the token
+    expiry, and users are dropped from the cache whenever their row is saved
+    or deleted in this process. Other processes see such changes once the
+    TTL runs out. Revoked tokens are rejected on every request, cached or not.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = token_cache.get(raw_token)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            expires_in = token.get('exp', 0) - time.time()
+            token_cache.set(raw_token, token, ttl=expires_in)
+        if is_revoked(token):
+            raise InvalidToken('Token has been revoked.')
+        return token
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = user_cache.get(str(user_id)) if user_id is not None else None
+        if user is None:
+            generation = user_cache.generation
+            user = super().get_user(validated_token)
+            user_cache.set(str(user_id), user, generation=generation)
+        # Every request gets its own instance so per-request state set on
+        # request.user never leaks between threads.
+        return copy.copy(user)
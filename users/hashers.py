@@ -0,0 +1,95 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, make_password
+
+
+def get_setting(name, default):
+    return getattr(settings, 'PASSWORD_HASHING', {}).get(name, default)
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 with its iteration count taken from PASSWORD_HASHING['ITERATIONS'].
+
+    Hashes made with another count still verify and are rewritten with the
+    configured one on the next successful login.
+    """
+
+    @property
+    def iterations(self):
+        return get_setting('ITERATIONS', PBKDF2PasswordHasher.iterations)
+
+
+class Overloaded(Exception):
+    pass
+
+
+class HashingPool:
+    """
+    Caps the CPU spent on password hashing.
+
+    At most `max_workers` hashes run at once, across sync callers running
+    inline and async callers handed to the pool's threads. Up to
+    `max_queue` more wait for a turn; anything beyond that raises
+    Overloaded straight away instead of piling up.
+    """
+
+    def __init__(self, max_workers, max_queue):
+        self.admission = threading.BoundedSemaphore(max_workers + max_queue)
+        self.workers = threading.BoundedSemaphore(max_workers)
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix='password-hashing')
+
+    def admit(self):
+        if not self.admission.acquire(blocking=False):
+            raise Overloaded
+
+    @contextmanager
+    def slot(self):
+        self.admit()
+        try:
+            with self.workers:
+                yield
+        finally:
+            self.admission.release()
+
+    def call(self, func, *args):
+        with self.workers:
+            return func(*args)
+
+    async def run(self, func, *args):
+        self.admit()
+        future = self.executor.submit(self.call, func, *args)
+        # Released when the hash is done, even if the caller went away.
+        future.add_done_callback(lambda future: self.admission.release())
+        return await asyncio.wrap_future(future)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool(
+                    get_setting('MAX_WORKERS', max(1, (os.cpu_count() or 2) // 2)),
+                    get_setting('MAX_QUEUE', 32))
+    return _pool
+
+
+def verify_password(password, encoded):
+    """
+    Return (valid, new hash or None) without touching the database, so it
+    can run on a hashing thread.
+    """
+    upgraded = []
+    valid = check_password(password, encoded, setter=upgraded.append)
+    return valid, make_password(password) if upgraded else None
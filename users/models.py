@@ -1,6 +1,7 @@
 import uuid
 
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.utils import timezone
 from django.contrib.auth.models import PermissionsMixin
@@ -37,6 +38,14 @@ class User(AbstractBaseUser, PermissionsMixin):
         blank=True,
         null=True
     )
+    # Content hash naming the avatar's thumbnails, see users.thumbnails.
+    # Nullable so adding it does not rebuild the table on SQLite.
+    avatar_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False
+    )
     date_joined = models.DateTimeField(default=timezone.now)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
@@ -50,6 +59,13 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    class Meta:
+        indexes = [
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+            models.Index(Lower('first_name'), name='user_first_name_lower_idx'),
+            models.Index(Lower('last_name'), name='user_last_name_lower_idx'),
+        ]
+
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}".strip()
 
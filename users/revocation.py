@@ -0,0 +1,212 @@
+import fcntl
+import hashlib
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework_simplejwt.settings import api_settings
+
+from application.paths import private_directory
+
+COMPACT_INTERVAL = 3600
+PRUNE_INTERVAL = 60
+
+
+def get_setting(name, default):
+    return getattr(settings, 'TOKEN_REVOCATION', {}).get(name, default)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self.positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RevocationList:
+    """
+    Revoked token ids shared by all workers on a host through an append-only
+    file of "<jti> <exp>" lines.
+
+    Each process keeps a Bloom filter in front of an exact jti -> exp map and
+    only stats the file per lookup, reading just the bytes appended since.
+    Entries are dropped once their token has expired, and the file is
+    rewritten without them from time to time.
+    """
+
+    def __init__(self, path, capacity=100000, error_rate=0.001):
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        self.lock = threading.Lock()
+        self.expires = {}
+        self.filter = BloomFilter(capacity, error_rate)
+        self.inode = None
+        self.offset = 0
+        self.next_prune = time.monotonic() + PRUNE_INTERVAL
+        self.next_compact = time.monotonic() + COMPACT_INTERVAL
+
+    @contextmanager
+    def file_lock(self, operation):
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            os.close(fd)
+
+    def build_filter(self, expires):
+        capacity = self.capacity
+        while capacity < len(expires):
+            capacity *= 2
+        bloom = BloomFilter(capacity, self.error_rate)
+        for jti in expires:
+            bloom.add(jti)
+        return bloom
+
+    def parse(self, data, expires, now):
+        for line in data.splitlines():
+            try:
+                jti, exp = line.decode().split()
+                exp = int(exp)
+            except ValueError:
+                continue
+            if exp > now:
+                expires[jti] = exp
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino == self.inode and stat.st_size == self.offset:
+            if time.monotonic() >= self.next_prune:
+                self.prune()
+            return
+        with self.lock:
+            try:
+                file = open(self.path, 'rb')
+            except FileNotFoundError:
+                return
+            with file:
+                inode = os.fstat(file.fileno()).st_ino
+                if inode != self.inode:
+                    # Another worker compacted the file: start over from it.
+                    offset, expires = 0, {}
+                else:
+                    offset, expires = self.offset, None
+                file.seek(offset)
+                data = file.read()
+            end = data.rfind(b'\n') + 1
+            now = time.time()
+            if expires is None:
+                added = {}
+                self.parse(data[:end], added, now)
+                if self.filter.count + len(added) > self.filter.capacity:
+                    expires = dict(self.expires)
+                    expires.update(added)
+                    self.filter = self.build_filter(expires)
+                    self.expires = expires
+                else:
+                    for jti in added:
+                        self.filter.add(jti)
+                    self.expires.update(added)
+            else:
+                self.parse(data[:end], expires, now)
+                # Swap both at once so lock-free readers never see a
+                # half-loaded list.
+                self.filter, self.expires = self.build_filter(expires), expires
+            self.inode = inode
+            self.offset = offset + end
+
+    def prune(self):
+        with self.lock:
+            now = time.time()
+            expires = {jti: exp for jti, exp in self.expires.items() if exp > now}
+            if len(expires) != len(self.expires):
+                self.filter, self.expires = self.build_filter(expires), expires
+            self.next_prune = time.monotonic() + PRUNE_INTERVAL
+
+    def add(self, jti, exp):
+        line = f'{jti} {int(exp)}\n'.encode()
+        with self.file_lock(fcntl.LOCK_SH):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        if time.monotonic() >= self.next_compact:
+            self.compact()
+        self.refresh()
+
+    def compact(self):
+        with self.file_lock(fcntl.LOCK_EX):
+            expires = {}
+            try:
+                with open(self.path, 'rb') as file:
+                    self.parse(file.read(), expires, time.time())
+            except FileNotFoundError:
+                pass
+            temp = f'{self.path}.{os.getpid()}.tmp'
+            fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as file:
+                file.writelines(f'{jti} {exp}\n' for jti, exp in expires.items())
+            os.replace(temp, self.path)
+        self.next_compact = time.monotonic() + COMPACT_INTERVAL
+
+    def __contains__(self, jti):
+        self.refresh()
+        return jti in self.filter and jti in self.expires
+
+
+_revocations = None
+_revocations_lock = threading.Lock()
+
+
+def get_revocation_list():
+    global _revocations
+    if _revocations is None:
+        with _revocations_lock:
+            if _revocations is None:
+                path = get_setting('PATH', None) or os.path.join(
+                    private_directory('pythontests-revoked-tokens'), 'revoked')
+                _revocations = RevocationList(
+                    path,
+                    capacity=get_setting('BLOOM_CAPACITY', 100000),
+                    error_rate=get_setting('BLOOM_ERROR_RATE', 0.001))
+    return _revocations
+
+
+def revoke(token):
+    jti = token.get(api_settings.JTI_CLAIM)
+    if jti is not None:
+        get_revocation_list().add(jti, token.get('exp', time.time()))
+
+
+def is_revoked(token):
+    jti = token.get(api_settings.JTI_CLAIM)
+    return jti is not None and jti in get_revocation_list()
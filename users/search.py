@@ -0,0 +1,146 @@
+from django.db import connections
+from django.db.models.functions import Lower
+
+from .models import User
+
+SEARCH_TABLE = 'users_user_search'
+ROWID_TABLE = 'users_user_search_rowid'
+SEARCH_FIELDS = ('email', 'first_name', 'last_name')
+MIN_SUBSTRING_LENGTH = 3
+
+# Same layout as chats.search: users_user is keyed by UUID, so the integer
+# rowids FTS5 needs are kept in a side table.
+CREATE_TABLES = [
+    f'CREATE TABLE IF NOT EXISTS {ROWID_TABLE} ('
+    'rowid INTEGER PRIMARY KEY, user_id char(32) NOT NULL UNIQUE)',
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+    "email, first_name, last_name, tokenize='trigram')",
+]
+
+DROP_TABLES = [
+    f'DROP TABLE IF EXISTS {SEARCH_TABLE}',
+    f'DROP TABLE IF EXISTS {ROWID_TABLE}',
+]
+
+ROWID_OF = f'(SELECT rowid FROM {ROWID_TABLE} WHERE user_id = {{}}.id)'
+
+CREATE_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert
+    AFTER INSERT ON users_user BEGIN
+        INSERT INTO {ROWID_TABLE} (user_id) VALUES (new.id);
+        INSERT INTO {SEARCH_TABLE} (rowid, email, first_name, last_name)
+        VALUES ({ROWID_OF.format('new')}, new.email, new.first_name, new.last_name);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update
+    AFTER UPDATE OF email, first_name, last_name ON users_user BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET email = new.email, first_name = new.first_name, last_name = new.last_name
+        WHERE rowid = {ROWID_OF.format('old')};
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete
+    AFTER DELETE ON users_user BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = {ROWID_OF.format('old')};
+        DELETE FROM {ROWID_TABLE} WHERE user_id = old.id;
+    END''',
+]
+
+DROP_TRIGGERS = [
+    f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{event}'
+    for event in ('insert', 'update', 'delete')
+]
+
+POPULATE = (
+    f'INSERT OR IGNORE INTO {ROWID_TABLE} (user_id) SELECT id FROM users_user',
+    f'INSERT INTO {SEARCH_TABLE} (rowid, email, first_name, last_name) '
+    f'SELECT r.rowid, u.email, u.first_name, u.last_name FROM users_user u '
+    f'JOIN {ROWID_TABLE} r ON r.user_id = u.id',
+)
+
+
+def is_supported(connection):
+    return connection.vendor == 'sqlite'
+
+
+def execute_all(cursor, statements):
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def install(connection):
+    """
+    Create the trigram index over users_user and populate it.
+
+    Like chats.search, the triggers are dropped whenever Django rebuilds
+    users_user, so migrations altering it must call this again.
+    """
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        execute_all(cursor, DROP_TRIGGERS)
+        execute_all(cursor, DROP_TABLES)
+        execute_all(cursor, CREATE_TABLES)
+        execute_all(cursor, POPULATE)
+        execute_all(cursor, CREATE_TRIGGERS)
+
+
+def uninstall(connection):
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        execute_all(cursor, DROP_TRIGGERS)
+        execute_all(cursor, DROP_TABLES)
+
+
+def prefix_matches(query, limit, using):
+    # Range scans over the lower(<field>) indexes, so every keystroke costs
+    # at most `limit` index entries per field.
+    found = {}
+    upper = query + '\U0010ffff'
+    for field in SEARCH_FIELDS:
+        users = User.objects.using(using).alias(
+            key=Lower(field)
+        ).filter(key__gte=query, key__lt=upper).order_by('key')[:limit]
+        for user in users:
+            found.setdefault(user.pk, user)
+    return sorted(
+        found.values(),
+        key=lambda user: min((
+            getattr(user, field).lower() for field in SEARCH_FIELDS
+            if getattr(user, field).lower().startswith(query)), default='')
+    )[:limit]
+
+
+def substring_matches(query, limit, exclude, using):
+    connection = connections[using]
+    if len(query) < MIN_SUBSTRING_LENGTH or not is_supported(connection):
+        return []
+    expression = '"{}"'.format(query.replace('"', '""'))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT r.user_id FROM {SEARCH_TABLE} s '
+            f'JOIN {ROWID_TABLE} r ON r.rowid = s.rowid '
+            f'WHERE {SEARCH_TABLE} MATCH %s LIMIT %s',
+            [expression, limit + len(exclude)])
+        ids = [row[0] for row in cursor.fetchall()]
+    users = User.objects.using(using).in_bulk(ids)
+    matches = []
+    for pk in ids:
+        user = users.get(User._meta.pk.to_python(pk))
+        if user is not None and user.pk not in exclude:
+            matches.append(user)
+    return matches[:limit]
+
+
+def autocomplete(query, limit=10, using='default'):
+    """
+    Top `limit` users whose email, first or last name starts with `query`,
+    followed by users containing it anywhere, for queries of 3+ characters.
+    """
+    query = query.strip().lower()
+    if not query:
+        return []
+    users = prefix_matches(query, limit, using)
+    if len(users) < limit:
+        exclude = {user.pk for user in users}
+        users += substring_matches(query, limit - len(users), exclude, using)
+    return users
@@ -1,8 +1,12 @@
+from django.utils.functional import cached_property
 from rest_framework import serializers
 from .models import User
+from .thumbnails import thumbnail_urls_builder
 
 
 class UserSerializer(serializers.ModelSerializer):
+    avatar_thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = User
         fields = [
@@ -13,6 +17,14 @@ class UserSerializer(serializers.ModelSerializer):
             'is_active',
             'is_staff',
             'date_joined',
-            'avatar'
+            'avatar',
+            'avatar_thumbnails'
         ]
         read_only_fields = ['id', 'date_joined']
+
+    @cached_property
+    def build_thumbnail_urls(self):
+        return thumbnail_urls_builder(self.context.get('request'))
+
+    def get_avatar_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj.avatar_hash)
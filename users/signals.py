@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_user
+from .models import User
+from .thumbnails import avatar_replaced, remember_avatar, schedule, thumbnails_ready
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(thumbnails_ready, sender=User)
+def invalidate_user_with_thumbnails(sender, pk, **kwargs):
+    invalidate_user(pk)
+
+
+@receiver(post_init, sender=User)
+def remember_loaded_avatar(sender, instance, **kwargs):
+    remember_avatar(instance)
+
+
+@receiver(post_save, sender=User)
+def make_avatar_thumbnails(sender, instance, created, update_fields, **kwargs):
+    if avatar_replaced(instance, created, update_fields):
+        schedule(instance)
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.dispatch import Signal
+from django.views.static import serve
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from tasks.queue import enqueue
+
+logger = logging.getLogger(__name__)
+
+# Sent with `pk` and `digest` once an avatar's thumbnails are written.
+thumbnails_ready = Signal()
+
+THUMBNAIL_DIR = 'avatars/thumbs'
+FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Stands in for the digest in URLs resolved ahead of time.
+DIGEST_PLACEHOLDER = 'digest'
+
+
+def get_setting(name, default):
+    return getattr(settings, 'AVATAR_THUMBNAILS', {}).get(name, default)
+
+
+def get_sizes():
+    return get_setting('SIZES', [32, 64, 128, 256])
+
+
+def get_formats():
+    return get_setting('FORMATS', list(FORMATS))
+
+
+def thumbnail_name(digest, size, extension):
+    return f'{THUMBNAIL_DIR}/{digest}-{size}.{extension}'
+
+
+def get_digest(data):
+    # The encoder settings are part of the hash, so a changed quality never
+    # reuses a name that may be cached forever.
+    quality = get_setting('QUALITY', 80)
+    return hashlib.sha256(data + f':{quality}'.encode()).hexdigest()[:20]
+
+
+def render(image, size, image_format):
+    thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    if image_format == 'JPEG' and thumbnail.mode != 'RGB':
+        background = Image.new('RGB', thumbnail.size, (255, 255, 255))
+        background.paste(thumbnail, mask=thumbnail.getchannel('A'))
+        thumbnail = background
+    output = BytesIO()
+    thumbnail.save(output, image_format, quality=get_setting('QUALITY', 80))
+    return output.getvalue()
+
+
+def generate(data, storage=default_storage):
+    """
+    Write every configured size and format of the image in `data` under
+    content-hashed names and return the hash.
+    """
+    digest = get_digest(data)
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source).convert('RGBA')
+    for size in get_sizes():
+        for extension in get_formats():
+            name = thumbnail_name(digest, size, extension)
+            if not storage.exists(name):
+                storage.save(name, ContentFile(render(image, size, FORMATS[extension])))
+    return digest
+
+
+def process(model_label, pk, avatar_name):
+    model = apps.get_model(model_label)
+    try:
+        with default_storage.open(avatar_name, 'rb') as file:
+            data = file.read()
+        digest = generate(data)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning('Could not make thumbnails of %s', avatar_name, exc_info=True)
+        return None
+    # Only if the avatar was not replaced in the meantime. The pk hint lets
+    # database routers find a sharded row.
+    objects = model.objects.db_manager(hints={'pk': pk})
+    if objects.filter(pk=pk, avatar=avatar_name).update(avatar_hash=digest):
+        thumbnails_ready.send(sender=model, pk=pk, digest=digest)
+    return digest
+
+
+def remember_avatar(instance):
+    # The name as loaded, so a later save can tell whether it was replaced.
+    value = instance.__dict__.get('avatar')
+    instance._saved_avatar = getattr(value, 'name', value)
+
+
+def avatar_replaced(instance, created, update_fields):
+    """
+    Whether saving `instance` stored an avatar other than the one it was
+    loaded with and other than the field default.
+    """
+    if 'avatar' not in instance.__dict__ or (
+            update_fields is not None and 'avatar' not in update_fields):
+        return False
+    name = instance.avatar.name
+    previous = None if created else getattr(instance, '_saved_avatar', None)
+    instance._saved_avatar = name
+    return bool(name) and name not in (previous, instance._meta.get_field('avatar').get_default())
+
+
+def schedule(instance):
+    if instance.avatar:
+        enqueue(process, args=[instance._meta.label, str(instance.pk), instance.avatar.name])
+
+
+def thumbnail_urls_builder(request=None):
+    """
+    A function of the digest returning thumbnail_urls(digest, request).
+
+    The URLs are resolved once with a placeholder digest and then only
+    joined, which matters when serializing long lists.
+    """
+    templates = []
+    for size in get_sizes():
+        for extension in get_formats():
+            url = default_storage.url(thumbnail_name(DIGEST_PLACEHOLDER, size, extension))
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            prefix, _, suffix = url.rpartition(DIGEST_PLACEHOLDER)
+            templates.append((str(size), extension, prefix, suffix))
+
+    def build(digest):
+        if not digest:
+            return None
+        urls = {}
+        for size, extension, prefix, suffix in templates:
+            urls.setdefault(size, {})[extension] = prefix + digest + suffix
+        return urls
+    return build
+
+
+def thumbnail_urls(digest, request=None):
+    return thumbnail_urls_builder(request)(digest)
+
+
+def thumbnail_url(instance, size, extension='webp'):
+    """
+    URL of the smallest thumbnail at least `size` pixels wide, or of the
+    original while the thumbnails are not ready.
+    """
+    if not instance.avatar_hash:
+        return instance.avatar.url
+    sizes = get_sizes()
+    size = min((s for s in sizes if s >= size), default=max(sizes))
+    return default_storage.url(thumbnail_name(instance.avatar_hash, size, extension))
+
+
+def serve_thumbnail(request, path):
+    response = serve(
+        request, f'{THUMBNAIL_DIR}/{path}', document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
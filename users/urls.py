@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import UserViewSet, RegistrationView, LoginView, LogoutView, obtain_jwt_token
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
@@ -9,7 +10,10 @@ authpatterns = [
     path('register/', RegistrationView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
-    path('obtain/', obtain_jwt_token, name='obtain')
+    path('obtain/', obtain_jwt_token, name='obtain'),
+    path('async/register/', async_views.register, name='async-register'),
+    path('async/login/', async_views.login_view, name='async-login'),
+    path('async/obtain/', async_views.obtain_jwt_token, name='async-obtain'),
 ]
 
 urlpatterns = [
@@ -1,18 +1,35 @@
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth.hashers import make_password
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken, Token
+from application.replicas import ReplicaReadsMixin
 from .serializers import UserSerializer, User
 from .permissions import IsOwner
+from . import authentication, revocation, search
+from .hashers import Overloaded, get_pool
+
+
+def overloaded():
+    return Response(
+        {'detail': 'Too many authentication requests, try again shortly.'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+
 
 class RegistrationView(APIView):
     def post(self, request):
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
+            try:
+                with get_pool().slot():
+                    password = make_password(request.data.get('password') or None)
+            except Overloaded:
+                return overloaded()
+            user = serializer.save(password=password)
 
             refresh = RefreshToken.for_user(user)
             data = {
@@ -28,7 +45,11 @@ class LoginView(APIView):
     def post(self, request):
         email = request.data.get('email')
         password = request.data.get('password')
-        user = authenticate(request, email=email, password=password)
+        try:
+            with get_pool().slot():
+                user = authenticate(request, email=email, password=password)
+        except Overloaded:
+            return overloaded()
         if user is not None:
             login(request, user)
             refresh = RefreshToken.for_user(user)
@@ -43,6 +64,14 @@ class LoginView(APIView):
 
 class LogoutView(APIView):
     def post(self, request):
+        refresh = request.data.get('refresh')
+        if refresh:
+            try:
+                revocation.revoke(RefreshToken(refresh))
+            except TokenError:
+                return Response({'detail': 'Invalid refresh token.'}, status=status.HTTP_400_BAD_REQUEST)
+        if isinstance(request.auth, Token):
+            revocation.revoke(request.auth)
         logout(request)
         return Response({'detail': 'Logged out successfully.'}, status=status.HTTP_200_OK)
 
@@ -52,7 +81,11 @@ def obtain_jwt_token(request):
     email = request.data.get('email')
     password = request.data.get('password')
 
-    user = authenticate(email=email, password=password)
+    try:
+        with get_pool().slot():
+            user = authenticate(email=email, password=password)
+    except Overloaded:
+        return overloaded()
     if not user:
         return Response({'error': 'Invalid credentials'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -63,7 +96,7 @@ def obtain_jwt_token(request):
     })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -83,15 +116,34 @@ class UserViewSet(viewsets.ModelViewSet):
         else:
             return Response({'error': 'No query parameter provided'}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        query = self.request.query_params.get('query', None)
+        if query is None:
+            return Response({'error': 'No query parameter provided'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(self.request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+        users = search.autocomplete(query, limit=max(limit, 1))
+        serializer = UserSerializer(users, many=True)
+        return Response(serializer.data)
+
     @action(detail=False, methods=['get'])
     def active_users(self, request):
         users = User.objects.filter(is_active=True)
         serializer = UserSerializer(users, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def auth_cache(self, request):
+        return Response(authentication.stats())
+
     def get_permissions(self):
         if self.action == 'create':
             return [permissions.AllowAny()]
+        elif self.action == 'auth_cache':
+            return [permissions.IsAdminUser()]
         elif self.action in ['retrieve', 'update', 'partial_update', 'delete']:
             return [permissions.IsAuthenticated(), IsOwner()]
         else: